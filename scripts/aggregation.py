@@ -0,0 +1,237 @@
+"""
+Thống kê nhiều chiều cho hiệu thuốc
+
+Tính cùng lúc các nhóm (group-by) đã cấu hình trong AGGREGATIONS:
+- theo quận/huyện, theo phường/xã (addr:subdistrict), theo ô lưới GRID_CELL_M mét
+- chuỗi nhà thuốc (có thẻ brand) so với hiệu thuốc độc lập
+- mật độ trên 10.000 dân và trên km² (nếu có file data/district_stats.csv với các cột
+  district, population, area_km2; ô lưới luôn có diện tích)
+
+Mỗi chiều được mã hóa thành số nguyên một lần, mỗi nhóm chỉ là một lần np.bincount
+trên mã ghép. Kết quả là một bảng dạng tidy (mỗi dòng một nhóm, cột dimension cho
+biết nhóm theo chiều nào), ghi ra CSV hoặc Parquet và được cache theo mã băm dữ liệu.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+from columnar_cache import load_table
+from district_normalizer import DistrictNormalizer
+from geojson_io import file_digest
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+DISTRICT_STATS_FILE = Path(__file__).parent.parent / "data" / "district_stats.csv"
+OUTPUT_FILE = Path(__file__).parent.parent / "results" / "aggregates.csv"
+
+# Mã băm đầu vào của lần tính trước, nằm cạnh file kết quả
+STATE_FILE_NAME = ".aggregates_state.json"
+
+# Kích thước ô lưới (mét)
+GRID_CELL_M = 1000
+# Vĩ độ tham chiếu cố định của lưới (phép chiếu equirectangular), để mã ô ổn định giữa các lần chạy
+GRID_ORIGIN_LAT = 21.0
+METERS_PER_DEGREE = 111_320.0
+
+UNKNOWN = 'Không rõ'
+OWNERSHIP_LABELS = ['Độc lập', 'Chuỗi']
+
+# Tên nhóm -> các chiều dùng để nhóm
+AGGREGATIONS = {
+    'district': ('district',),
+    'ward': ('district', 'ward'),
+    'grid': ('cell',),
+    'ownership': ('ownership',),
+    'district_ownership': ('district', 'ownership'),
+}
+
+RESULT_COLUMNS = ['dimension', 'district', 'ward', 'cell', 'cell_lat', 'cell_lon', 'ownership',
+                  'count', 'chain_count', 'independent_count', 'share_pct',
+                  'population', 'area_km2', 'per_10k_pop', 'per_km2']
+
+
+def load_district_stats(path=DISTRICT_STATS_FILE, districts=None):
+    """Đọc dân số/diện tích theo quận: dict tên quận -> (population, area_km2)
+
+    Tên quận trong file được đối chiếu với danh sách districts (không phân biệt dấu,
+    tiền tố "Quận"...). Trả về {} nếu file không tồn tại.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    import pandas as pd
+    stats_df = pd.read_csv(path, encoding='utf-8-sig')
+    stats_df.columns = [col.strip().lower() for col in stats_df.columns]
+    normalize = DistrictNormalizer(districts) if districts else (lambda name: name)
+    stats = {}
+    for row in stats_df.itertuples(index=False):
+        name = normalize(str(row.district)) or str(row.district)
+        population = float(row.population) if 'population' in stats_df.columns and pd.notna(row.population) else None
+        area = float(row.area_km2) if 'area_km2' in stats_df.columns and pd.notna(row.area_km2) else None
+        stats[name] = (population, area)
+    return stats
+
+
+def _encode_dimensions(table, cell_m):
+    """Mã số nguyên của từng chiều: dict chiều -> (mã, nhãn); cùng tọa độ tâm ô lưới"""
+    import pandas as pd
+    n = len(table)
+    district_codes = np.asarray(table.district_code, dtype=np.int64).copy()
+    district_codes[district_codes < 0] = len(table.districts)
+    districts = list(table.districts) + [UNKNOWN]
+
+    ward_codes, wards = pd.factorize(pd.Series([w or UNKNOWN for w in table.column('ward')], dtype=object))
+
+    is_chain = np.fromiter((bool(b) for b in table.column('brand')), dtype=bool, count=n)
+
+    # Ô lưới theo phép chiếu equirectangular với vĩ độ tham chiếu cố định
+    lons = np.asarray(table.lon, dtype=np.float64)
+    lats = np.asarray(table.lat, dtype=np.float64)
+    kx = METERS_PER_DEGREE * math.cos(math.radians(GRID_ORIGIN_LAT)) / cell_m
+    ky = METERS_PER_DEGREE / cell_m
+    gx = np.floor(np.nan_to_num(lons) * kx).astype(np.int64)
+    gy = np.floor(np.nan_to_num(lats) * ky).astype(np.int64)
+    cell_codes, cell_keys = pd.factorize(pd.Series(list(zip(gx.tolist(), gy.tolist())), dtype=object))
+    cell_labels = [f"{x}_{y}" for x, y in cell_keys]
+    cell_centres = [((y + 0.5) / ky, (x + 0.5) / kx) for x, y in cell_keys]
+
+    codes = {
+        'district': (district_codes, districts),
+        'ward': (ward_codes.astype(np.int64), list(wards)),
+        'cell': (cell_codes.astype(np.int64), cell_labels),
+        'ownership': (is_chain.astype(np.int64), OWNERSHIP_LABELS),
+    }
+    return codes, is_chain, cell_centres
+
+
+def compute_aggregates(table, stats=None, cell_m=GRID_CELL_M, aggregations=AGGREGATIONS):
+    """Tính mọi nhóm trong aggregations; trả về DataFrame dạng tidy (RESULT_COLUMNS)"""
+    import pandas as pd
+    stats = stats or {}
+    codes, is_chain, cell_centres = _encode_dimensions(table, cell_m)
+    total = len(table)
+    cell_area = (cell_m / 1000.0) ** 2
+    rows = []
+    for dimension, dims in aggregations.items():
+        shape = tuple(len(codes[dim][1]) for dim in dims)
+        size = int(np.prod(shape)) if shape else 0
+        if not total or not size:
+            continue
+        # Mã ghép của các chiều (mixed radix) -> một lần bincount cho cả nhóm
+        key = np.ravel_multi_index(tuple(codes[dim][0] for dim in dims), shape)
+        counts = np.bincount(key, minlength=size)
+        chains = np.bincount(key, weights=is_chain, minlength=size).astype(np.int64)
+        present = np.flatnonzero(counts)
+        parts = np.unravel_index(present, shape)
+        for j, flat in enumerate(present.tolist()):
+            row = dict.fromkeys(RESULT_COLUMNS)
+            row['dimension'] = dimension
+            for dim, part in zip(dims, parts):
+                row[dim] = codes[dim][1][int(part[j])]
+            count = int(counts[flat])
+            row['count'] = count
+            row['chain_count'] = int(chains[flat])
+            row['independent_count'] = count - int(chains[flat])
+            row['share_pct'] = round(count / total * 100, 2)
+            if 'cell' in dims:
+                row['cell_lat'], row['cell_lon'] = (round(v, 6) for v in cell_centres[int(parts[dims.index('cell')][j])])
+                row['area_km2'] = cell_area
+            elif set(dims) <= {'district', 'ownership'} and row['district'] in stats:
+                row['population'], row['area_km2'] = stats[row['district']]
+            if row['population']:
+                row['per_10k_pop'] = round(count / row['population'] * 10_000, 3)
+            if row['area_km2']:
+                row['per_km2'] = round(count / row['area_km2'], 3)
+            rows.append(row)
+    result = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    return result.sort_values(['dimension', 'count'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+
+def _cache_key(table, stats_file, cell_m, aggregations):
+    key = json.dumps({'source': table.meta.get('source_hash'), 'stats': file_digest(stats_file),
+                      'cell_m': cell_m, 'aggregations': aggregations, 'code': file_digest(__file__)},
+                     sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _read_table(path):
+    import pandas as pd
+    if path.suffix.lower() == '.parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path, encoding='utf-8-sig', keep_default_na=False, na_values=[''])
+
+
+def write_aggregates(result, output):
+    """Ghi bảng kết quả ra CSV, hoặc Parquet nếu đuôi file là .parquet"""
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if output.suffix.lower() == '.parquet':
+        result.to_parquet(output, index=False)
+    else:
+        result.to_csv(output, index=False, encoding='utf-8-sig')
+
+
+def aggregate(data_file=DATA_FILE, output=OUTPUT_FILE, stats_file=DISTRICT_STATS_FILE,
+              cell_m=GRID_CELL_M, aggregations=AGGREGATIONS, force=False):
+    """Tính (hoặc đọc lại từ cache) bảng thống kê nhiều chiều và ghi ra output
+
+    Nếu dữ liệu, file dân số/diện tích và cấu hình không đổi so với lần trước, bảng
+    được đọc lại từ output thay vì tính lại.
+    """
+    output = Path(output)
+    table = load_table(data_file)
+    state_path = output.parent / STATE_FILE_NAME
+    state = {}
+    if state_path.exists():
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    key = _cache_key(table, stats_file, cell_m, aggregations)
+    if not force and state.get(output.name) == key and output.exists():
+        print(f" Dữ liệu không đổi, dùng lại kết quả: {output}")
+        return _read_table(output)
+
+    stats = load_district_stats(stats_file, table.districts)
+    result = compute_aggregates(table, stats, cell_m, aggregations)
+    write_aggregates(result, output)
+    state[output.name] = key
+    tmp_path = state_path.with_name(state_path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    tmp_path.replace(state_path)
+    print(f" Đã lưu bảng thống kê nhiều chiều: {output} ({len(result)} dòng)")
+    return result
+
+
+def print_summary(result):
+    """In tóm tắt số nhóm của từng chiều và tỉ lệ chuỗi/độc lập"""
+    print("\n" + "="*60)
+    print("THỐNG KÊ NHIỀU CHIỀU")
+    print("="*60)
+    for dimension, group in result.groupby('dimension', sort=False):
+        print(f"   {dimension:<20} {len(group):>5} nhóm")
+    ownership = result[result['dimension'] == 'ownership']
+    for row in ownership.itertuples(index=False):
+        print(f" {row.ownership}: {row.count} hiệu thuốc ({row.share_pct}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Thống kê hiệu thuốc theo quận, phường, ô lưới, chuỗi/độc lập")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File GeoJSON hiệu thuốc đã làm sạch")
+    parser.add_argument("--stats", type=Path, default=DISTRICT_STATS_FILE,
+                        help="File CSV dân số/diện tích theo quận (district, population, area_km2)")
+    parser.add_argument("--cell", type=float, default=GRID_CELL_M, help="Kích thước ô lưới (mét)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE, help="File kết quả .csv hoặc .parquet")
+    parser.add_argument("--force", action="store_true", help="Tính lại kể cả khi dữ liệu không đổi")
+    args = parser.parse_args(argv)
+
+    result = aggregate(args.data, args.output, args.stats, args.cell, force=args.force)
+    print_summary(result)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -3,46 +3,61 @@ Người 2 - Phân tích & Thống kê
 Đếm số lượng hiệu thuốc theo quận/huyện và vẽ biểu đồ
 """
 
+import argparse
+import hashlib
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
 from collections import Counter
 
-# Thiết lập font hỗ trợ tiếng Việt
-matplotlib.rcParams['font.family'] = 'DejaVu Sans'
-plt.rcParams['axes.unicode_minus'] = False
+import aggregation
+from columnar_cache import load_table
+from geojson_io import file_digest
+from instrumentation import add_metrics_arguments, configure_from_args, span, stage
 
+# pandas và matplotlib được nạp khi cần (mất khoảng nửa giây), để import module này nhanh
 # Đường dẫn file
 DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
 OUTPUT_CSV = Path(__file__).parent.parent / "results" / "pharmacy_by_district.csv"
 OUTPUT_CHART = Path(__file__).parent.parent / "results" / "chart_district.png"
+PREVIEW_DIR = Path(__file__).parent.parent / "results" / "preview"
+PREVIEW_DPI = 72
 
 
-def load_pharmacy_data():
-    """Đọc dữ liệu từ file clean_pharmacy.geojson"""
-    print(" Đang đọc dữ liệu hiệu thuốc...")
-    
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+def _pyplot():
+    """Nạp matplotlib.pyplot với backend Agg và font hỗ trợ tiếng Việt"""
+    import matplotlib
+    matplotlib.use('Agg')  # Chỉ lưu file ảnh, không cần cửa sổ (an toàn khi chạy trong luồng phụ)
+    import matplotlib.pyplot as plt
     
-    pharmacies = []
-    for feature in data['features']:
-        props = feature['properties']
-        pharmacies.append({
-            'name': props.get('name', 'Không rõ tên'),
-            'district': props.get('district'),
-            'street': props.get('street', ''),
-            'opening_hours': props.get('opening_hours', ''),
-            'coordinates': feature['geometry']['coordinates']
-        })
+    # Thiết lập font hỗ trợ tiếng Việt
+    matplotlib.rcParams['font.family'] = CHART_STYLE['font_family']
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
+
+
+def load_pharmacy_data(data_file=DATA_FILE):
+    """Đọc dữ liệu từ file clean_pharmacy.geojson (qua cache dạng cột)"""
+    import pandas as pd
+    print(" Đang đọc dữ liệu hiệu thuốc...")
     
-    return pd.DataFrame(pharmacies)
+    table = load_table(data_file)
+    return pd.DataFrame({
+        'name': table.column('name'),
+        'district': pd.Categorical.from_codes(table.district_code, categories=table.districts)
+                    if table.districts else pd.Categorical([None] * len(table)),
+        'street': table.column('street'),
+        'opening_hours': table.column('opening_hours'),
+        'lon': table.lon,
+        'lat': table.lat,
+    })
 
 
-def analyze_by_district(df):
+def analyze_by_district(df, output_csv=OUTPUT_CSV):
     """Phân tích số lượng hiệu thuốc theo quận/huyện"""
+    import pandas as pd
     print("\n Đang thống kê theo quận/huyện...")
     
     # Đếm số lượng theo quận
@@ -56,8 +71,8 @@ def analyze_by_district(df):
     })
     
     # Lưu ra CSV
-    analysis_df.to_csv(OUTPUT_CSV, index=False, encoding='utf-8-sig')
-    print(f" Đã lưu file CSV: {OUTPUT_CSV}")
+    analysis_df.to_csv(output_csv, index=False, encoding='utf-8-sig')
+    print(f" Đã lưu file CSV: {output_csv}")
     
     # In ra thống kê
     print("\n" + "="*60)
@@ -83,162 +98,225 @@ def analyze_by_district(df):
     return analysis_df
 
 
-def plot_charts(analysis_df):
-    """Vẽ các biểu đồ thống kê"""
-    print("\n Đang vẽ biểu đồ...")
-    
-    # Sắp xếp dữ liệu theo số lượng giảm dần
-    sorted_df = analysis_df.sort_values('Số lượng hiệu thuốc', ascending=False)
-    
-    # Đường dẫn cho các biểu đồ riêng
-    output_dir = Path(__file__).parent.parent / "results"
-    chart_bar = output_dir / "chart_bar.png"
-    chart_pie = output_dir / "chart_pie.png"
-    chart_horizontal = output_dir / "chart_horizontal.png"
-    
-    # 1. Biểu đồ cột (riêng)
-    print("   Đang vẽ biểu đồ cột...")
-    fig1, ax1 = plt.subplots(figsize=(12, 6))
-    bars = ax1.bar(range(len(sorted_df)), sorted_df['Số lượng hiệu thuốc'], 
-                   color='steelblue', alpha=0.8, edgecolor='navy')
-    ax1.set_xlabel('Quận/Huyện', fontsize=12, fontweight='bold')
-    ax1.set_ylabel('Số lượng hiệu thuốc', fontsize=12, fontweight='bold')
-    ax1.set_title('Biểu đồ cột: Số lượng hiệu thuốc theo quận/huyện', 
-                  fontsize=14, fontweight='bold', pad=20)
-    ax1.set_xticks(range(len(sorted_df)))
-    ax1.set_xticklabels(sorted_df['Quận/Huyện'], rotation=45, ha='right', fontsize=10)
-    ax1.grid(axis='y', alpha=0.3, linestyle='--')
+# Cấu hình kiểu biểu đồ: thay đổi ở đây sẽ khiến các biểu đồ được vẽ lại
+CHART_STYLE = {
+    'font_family': 'DejaVu Sans',
+    'bar_color': 'steelblue', 'bar_edge': 'navy',
+    'barh_color': 'coral', 'barh_edge': 'darkred',
+    'pie_top_n': 10, 'barh_top_n': 15,
+}
+
+# Trạng thái lần vẽ trước (mã băm dữ liệu + cấu hình của từng biểu đồ), nằm trong thư mục kết quả
+CHART_STATE_FILE = ".chart_state.json"
+
+
+def _pie_data(labels, values):
+    """Top N quận cho biểu đồ tròn, phần còn lại gộp thành 'Các quận khác'"""
+    top_n = CHART_STYLE['pie_top_n']
+    if len(labels) > top_n:
+        return labels[:top_n] + ['Các quận khác'], values[:top_n] + [sum(values[top_n:])]
+    return list(labels), list(values)
+
+
+def _draw_bar(ax, labels, values, small=False):
+    bars = ax.bar(range(len(labels)), values,
+                  color=CHART_STYLE['bar_color'], alpha=0.8, edgecolor=CHART_STYLE['bar_edge'])
+    ax.set_xlabel('Quận/Huyện', fontsize=11 if small else 12, fontweight='bold')
+    ax.set_ylabel('Số lượng hiệu thuốc', fontsize=11 if small else 12, fontweight='bold')
+    ax.set_title('Biểu đồ cột: Số lượng hiệu thuốc theo quận/huyện', 
+                 fontsize=12 if small else 14, fontweight='bold', pad=15 if small else 20)
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=45, ha='right', fontsize=9 if small else 10)
+    ax.grid(axis='y', alpha=0.3, linestyle='--')
     
     # Thêm giá trị lên đỉnh cột
-    for i, bar in enumerate(bars):
+    for bar in bars:
         height = bar.get_height()
-        ax1.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(height)}',
-                ha='center', va='bottom', fontsize=10, fontweight='bold')
+        ax.text(bar.get_x() + bar.get_width()/2., height, f'{int(height)}',
+                ha='center', va='bottom', fontsize=8 if small else 10,
+                fontweight='normal' if small else 'bold')
+
+
+def _draw_pie(ax, labels, values, small=False):
+    from matplotlib import colormaps
+    pie_labels, pie_values = _pie_data(labels, values)
+    colors = colormaps['Set3'](range(len(pie_values)))
+    ax.pie(pie_values, labels=pie_labels, autopct='%1.1f%%', startangle=90, colors=colors,
+           textprops={'fontsize': 9 if small else 11})
+    ax.set_title('Biểu đồ tròn: Tỷ lệ phân bố hiệu thuốc', 
+                 fontsize=12 if small else 14, fontweight='bold', pad=15 if small else 20)
+
+
+def _draw_horizontal(ax, labels, values, small=False):
+    top_n = CHART_STYLE['barh_top_n']
+    labels, values = labels[:top_n], values[:top_n]
+    y_pos = range(len(labels))
+    ax.barh(y_pos, values, color=CHART_STYLE['barh_color'], alpha=0.8, edgecolor=CHART_STYLE['barh_edge'])
+    ax.set_yticks(y_pos)
+    ax.set_yticklabels(labels, fontsize=9 if small else 11)
+    ax.set_xlabel('Số lượng hiệu thuốc', fontsize=11 if small else 12, fontweight='bold')
+    ax.set_title(f'Top {top_n} quận/huyện có nhiều hiệu thuốc nhất', 
+                 fontsize=12 if small else 14, fontweight='bold', pad=15 if small else 20)
+    ax.invert_yaxis()
+    ax.grid(axis='x', alpha=0.3, linestyle='--')
     
-    plt.tight_layout()
-    plt.savefig(chart_bar, dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"   Đã lưu: {chart_bar.name}")
-    
-    # 2. Biểu đồ tròn (riêng)
-    print("   Đang vẽ biểu đồ tròn...")
-    fig2, ax2 = plt.subplots(figsize=(10, 8))
-    top_n = 10
-    if len(sorted_df) > top_n:
-        top_districts = sorted_df.head(top_n)
-        others_sum = sorted_df.iloc[top_n:]['Số lượng hiệu thuốc'].sum()
-        
-        pie_labels = list(top_districts['Quận/Huyện']) + ['Các quận khác']
-        pie_values = list(top_districts['Số lượng hiệu thuốc']) + [others_sum]
+    # Thêm giá trị
+    for i, v in enumerate(values):
+        if small:
+            ax.text(v + 1, i, str(int(v)), va='center', fontsize=9)
+        else:
+            ax.text(v + 0.1, i, str(int(v)), va='center', fontsize=10, fontweight='bold')
+
+
+def _init_chart_worker():
+    """Khởi tạo tiến trình vẽ: chọn backend Agg và font trước khi vẽ biểu đồ đầu tiên"""
+    _pyplot()
+
+
+def _render_chart(name, labels, values, path, dpi):
+    """Vẽ một biểu đồ ra file (chạy trong tiến trình con, backend Agg)"""
+    plt = _pyplot()
+    if name == 'bar':
+        fig, ax = plt.subplots(figsize=(12, 6))
+        _draw_bar(ax, labels, values)
+    elif name == 'pie':
+        fig, ax = plt.subplots(figsize=(10, 8))
+        _draw_pie(ax, labels, values)
+    elif name == 'horizontal':
+        fig, ax = plt.subplots(figsize=(10, 8))
+        _draw_horizontal(ax, labels, values)
     else:
-        pie_labels = list(sorted_df['Quận/Huyện'])
-        pie_values = list(sorted_df['Số lượng hiệu thuốc'])
-    
-    colors = plt.cm.Set3(range(len(pie_values)))
-    wedges, texts, autotexts = ax2.pie(pie_values, labels=pie_labels, autopct='%1.1f%%',
-                                        startangle=90, colors=colors,
-                                        textprops={'fontsize': 11})
-    ax2.set_title('Biểu đồ tròn: Tỷ lệ phân bố hiệu thuốc', 
-                  fontsize=14, fontweight='bold', pad=20)
+        # Biểu đồ tổng hợp: ba biểu đồ trên cùng một hình
+        fig = plt.figure(figsize=(18, 6))
+        for i, draw in enumerate((_draw_bar, _draw_pie, _draw_horizontal), 1):
+            draw(plt.subplot(1, 3, i), labels, values, small=True)
     
     plt.tight_layout()
-    plt.savefig(chart_pie, dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"   Đã lưu: {chart_pie.name}")
-    
-    # 3. Biểu đồ ngang (riêng)
-    print("   Đang vẽ biểu đồ ngang...")
-    fig3, ax3 = plt.subplots(figsize=(10, 8))
-    top_15 = sorted_df.head(15)
-    y_pos = range(len(top_15))
-    bars = ax3.barh(y_pos, top_15['Số lượng hiệu thuốc'], 
-                    color='coral', alpha=0.8, edgecolor='darkred')
-    ax3.set_yticks(y_pos)
-    ax3.set_yticklabels(top_15['Quận/Huyện'], fontsize=11)
-    ax3.set_xlabel('Số lượng hiệu thuốc', fontsize=12, fontweight='bold')
-    ax3.set_title('Top 15 quận/huyện có nhiều hiệu thuốc nhất', 
-                  fontsize=14, fontweight='bold', pad=20)
-    ax3.invert_yaxis()
-    ax3.grid(axis='x', alpha=0.3, linestyle='--')
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return name
+
+
+def chart_paths(output_dir, fmt='png'):
+    """File kết quả của từng biểu đồ"""
+    output_dir = Path(output_dir)
+    return {
+        'bar': output_dir / f"chart_bar.{fmt}",
+        'pie': output_dir / f"chart_pie.{fmt}",
+        'horizontal': output_dir / f"chart_horizontal.{fmt}",
+        'district': output_dir / f"{OUTPUT_CHART.stem}.{fmt}",
+    }
+
+
+def _chart_hash(name, labels, values, dpi):
+    """Mã băm dữ liệu đầu vào + cấu hình kiểu (và mã vẽ) của một biểu đồ"""
+    key = json.dumps({'chart': name, 'labels': labels, 'values': values, 'dpi': dpi,
+                      'style': CHART_STYLE, 'code': file_digest(__file__)},
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _load_chart_state(path):
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def plot_charts(analysis_df, output_dir=None, dpi=300, fmt='png', workers=None, force=False):
+    """Vẽ các biểu đồ thống kê
+
+    Mỗi biểu đồ được vẽ trong một tiến trình riêng (backend Agg). Biểu đồ có dữ liệu
+    và cấu hình kiểu giống lần vẽ trước (và file vẫn còn) sẽ được bỏ qua.
+    Dùng dpi thấp hoặc fmt='svg' để xem trước nhanh.
+    """
+    print("\n Đang vẽ biểu đồ...")
+    output_dir = Path(output_dir) if output_dir else OUTPUT_CHART.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Thêm giá trị
-    for i, v in enumerate(top_15['Số lượng hiệu thuốc']):
-        ax3.text(v + 0.1, i, str(int(v)), va='center', fontsize=10, fontweight='bold')
+    # Sắp xếp dữ liệu theo số lượng giảm dần
+    sorted_df = analysis_df.sort_values('Số lượng hiệu thuốc', ascending=False)
+    labels = [str(label) for label in sorted_df['Quận/Huyện']]
+    values = [int(v) for v in sorted_df['Số lượng hiệu thuốc']]
     
-    plt.tight_layout()
-    plt.savefig(chart_horizontal, dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"   Đã lưu: {chart_horizontal.name}")
-    
-    # Vẽ biểu đồ tổng hợp (giữ lại file gốc)
-    print("   Đang vẽ biểu đồ tổng hợp...")
-    fig = plt.figure(figsize=(18, 6))
-    
-    # Subplot 1: Biểu đồ cột
-    ax1 = plt.subplot(1, 3, 1)
-    bars = ax1.bar(range(len(sorted_df)), sorted_df['Số lượng hiệu thuốc'], 
-                   color='steelblue', alpha=0.8, edgecolor='navy')
-    ax1.set_xlabel('Quận/Huyện', fontsize=11, fontweight='bold')
-    ax1.set_ylabel('Số lượng hiệu thuốc', fontsize=11, fontweight='bold')
-    ax1.set_title('Biểu đồ cột: Số lượng hiệu thuốc theo quận/huyện', 
-                  fontsize=12, fontweight='bold', pad=15)
-    ax1.set_xticks(range(len(sorted_df)))
-    ax1.set_xticklabels(sorted_df['Quận/Huyện'], rotation=45, ha='right', fontsize=9)
-    ax1.grid(axis='y', alpha=0.3, linestyle='--')
-    for i, bar in enumerate(bars):
-        height = bar.get_height()
-        ax1.text(bar.get_x() + bar.get_width()/2., height, f'{int(height)}',
-                ha='center', va='bottom', fontsize=8)
-    
-    # Subplot 2: Biểu đồ tròn
-    ax2 = plt.subplot(1, 3, 2)
-    wedges, texts, autotexts = ax2.pie(pie_values, labels=pie_labels, autopct='%1.1f%%',
-                                        startangle=90, colors=colors,
-                                        textprops={'fontsize': 9})
-    ax2.set_title('Biểu đồ tròn: Tỷ lệ phân bố hiệu thuốc', 
-                  fontsize=12, fontweight='bold', pad=15)
-    
-    # Subplot 3: Biểu đồ ngang
-    ax3 = plt.subplot(1, 3, 3)
-    ax3.barh(y_pos, top_15['Số lượng hiệu thuốc'], 
-             color='coral', alpha=0.8, edgecolor='darkred')
-    ax3.set_yticks(y_pos)
-    ax3.set_yticklabels(top_15['Quận/Huyện'], fontsize=9)
-    ax3.set_xlabel('Số lượng hiệu thuốc', fontsize=11, fontweight='bold')
-    ax3.set_title('Top 15 quận/huyện có nhiều hiệu thuốc nhất', 
-                  fontsize=12, fontweight='bold', pad=15)
-    ax3.invert_yaxis()
-    ax3.grid(axis='x', alpha=0.3, linestyle='--')
-    for i, v in enumerate(top_15['Số lượng hiệu thuốc']):
-        ax3.text(v + 1, i, str(int(v)), va='center', fontsize=9)
+    paths = chart_paths(output_dir, fmt)
+    state_path = output_dir / CHART_STATE_FILE
+    state = _load_chart_state(state_path)
+    hashes = {name: _chart_hash(name, labels, values, dpi) for name in paths}
+    todo = [name for name, path in paths.items()
+            if force or state.get(path.name) != hashes[name] or not path.exists()]
+    for name in paths:
+        if name not in todo:
+            print(f"   Không đổi, bỏ qua: {paths[name].name}")
     
-    plt.tight_layout()
-    plt.savefig(OUTPUT_CHART, dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"   Đã lưu biểu đồ tổng hợp: {OUTPUT_CHART.name}")
+    if todo:
+        workers = workers or min(len(todo), os.cpu_count() or 1)
+        if workers <= 1:
+            done = [_render_chart(name, labels, values, paths[name], dpi) for name in todo]
+        else:
+            # spawn thay vì fork: trong run_all bước này chạy trong một luồng cạnh bước bản đồ
+            # và buffer; fork một tiến trình nhiều luồng có thể làm tiến trình con bị treo
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_chart_worker,
+                                     mp_context=get_context('spawn')) as executor:
+                futures = [executor.submit(_render_chart, name, labels, values, paths[name], dpi)
+                           for name in todo]
+                done = [future.result() for future in futures]
+        for name in done:
+            state[paths[name].name] = hashes[name]
+            print(f"   Đã lưu: {paths[name].name}")
+        tmp_path = state_path.with_name(state_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(state_path)
     
-    print("\n🎉 Hoàn thành! Đã tạo 4 file biểu đồ:")
-    print(f"   1. {chart_bar.name} - Biểu đồ cột")
-    print(f"   2. {chart_pie.name} - Biểu đồ tròn")
-    print(f"   3. {chart_horizontal.name} - Biểu đồ ngang")
-    print(f"   4. {OUTPUT_CHART.name} - Biểu đồ tổng hợp")
+    print(f"\n🎉 Hoàn thành! {len(todo)} biểu đồ được vẽ, {len(paths) - len(todo)} không đổi:")
+    print(f"   1. {paths['bar'].name} - Biểu đồ cột")
+    print(f"   2. {paths['pie'].name} - Biểu đồ tròn")
+    print(f"   3. {paths['horizontal'].name} - Biểu đồ ngang")
+    print(f"   4. {paths['district'].name} - Biểu đồ tổng hợp")
+    return paths
 
 
-def main():
+def main(argv=None):
     """Hàm chính"""
+    parser = argparse.ArgumentParser(description="Thống kê hiệu thuốc theo quận/huyện và vẽ biểu đồ")
+    parser.add_argument("--dpi", type=int, default=300, help="Độ phân giải ảnh PNG")
+    parser.add_argument("--format", choices=("png", "svg"), default="png", help="Định dạng biểu đồ")
+    parser.add_argument("--preview", action="store_true",
+                        help=f"Xem trước nhanh: dpi {PREVIEW_DPI}, ghi vào results/preview/")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình vẽ biểu đồ")
+    parser.add_argument("--force", action="store_true", help="Vẽ lại mọi biểu đồ")
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_from_args(args)
+    
     print("="*60)
     print("PHÂN TÍCH & THỐNG KÊ HIỆU THUỐC HÀ NỘI")
     print("="*60)
     
-    # Đọc dữ liệu
-    df = load_pharmacy_data()
-    
-    # Phân tích theo quận
-    analysis_df = analyze_by_district(df)
-    
-    # Vẽ biểu đồ
-    plot_charts(analysis_df)
+    with stage("analysis") as total:
+        # Đọc dữ liệu
+        with span("analysis.load") as s:
+            df = load_pharmacy_data()
+            s.items = total.items = len(df)
+        
+        # Phân tích theo quận
+        with span("analysis.district", items=len(df)) as s:
+            analysis_df = analyze_by_district(df)
+            s.output(OUTPUT_CSV)
+        
+        # Thống kê nhiều chiều: quận, phường, ô lưới, mật độ, chuỗi/độc lập
+        with span("analysis.aggregate", items=len(df)):
+            aggregation.print_summary(aggregation.aggregate(DATA_FILE, force=args.force))
+        
+        # Vẽ biểu đồ
+        with span("analysis.charts", items=len(analysis_df)) as s:
+            if args.preview:
+                paths = plot_charts(analysis_df, PREVIEW_DIR, PREVIEW_DPI, args.format, args.workers, args.force)
+            else:
+                paths = plot_charts(analysis_df, dpi=args.dpi, fmt=args.format, workers=args.workers,
+                                    force=args.force)
+            s.output(*paths.values())
     
     print("\n Hoàn thành phân tích!")
 
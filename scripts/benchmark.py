@@ -0,0 +1,271 @@
+"""
+Benchmark các bước của pipeline trên dữ liệu giả lập 10^3..10^7 hiệu thuốc
+
+Với mỗi kích thước, file xuất được sinh bằng synthetic_data.py (dùng lại nếu đã có),
+rồi từng bước được chạy trong một tiến trình riêng để đo:
+- thời gian chạy (giây) và số hiệu thuốc xử lý mỗi giây
+- bộ nhớ đỉnh (peak RSS) của tiến trình, cùng RSS ngay trước khi chạy bước (sau khi
+  nạp thư viện) để tách phần bộ nhớ do chính bước đó dùng
+- tùy chọn --tracemalloc: bộ nhớ đỉnh của các đối tượng Python (chạy chậm hơn)
+
+Mỗi lần đo là một dòng JSON (kèm commit git, phiên bản Python, nền tảng) được nối vào
+results/benchmarks.jsonl, để so sánh đường cong mở rộng giữa các phiên bản.
+
+Với --imports, đo thời gian khởi động: import từng module trong một tiến trình Python
+mới (và một tiến trình chỉ truy vấn bán kính: import, đọc cache, dựng chỉ mục, một truy
+vấn), so với ngân sách IMPORT_BUDGET_S; thoát với mã lỗi nếu vượt ngân sách hoặc nếu
+import kéo theo thư viện nặng (pandas, matplotlib, folium).
+
+Ví dụ:
+    python benchmark.py --sizes 1000 10000 100000
+    python benchmark.py --sizes 1000000 --stages clean buffer
+    python benchmark.py --imports
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+# Nạp sẵn các bước để thời gian import không bị tính vào thời gian chạy
+import aggregation
+import analysis
+import data_cleaning
+import map_visualization
+import pharmacy_buffer_analysis
+from columnar_cache import load_table
+from instrumentation import rss_mb
+from synthetic_data import HANOI_BBOX, OUTPUT_DIR, generate
+
+RESULTS_FILE = Path(__file__).parent.parent / "results" / "benchmarks.jsonl"
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+# Số điểm trung tâm và bán kính cho bước buffer
+BUFFER_CENTRES = 200
+BUFFER_RADII = [500, 1000, 2000]
+
+# Ngân sách thời gian khởi động (giây, lần nhanh nhất trong tiến trình mới)
+IMPORT_BUDGET_S = {
+    'data_cleaning': 0.5,
+    'analysis': 0.5,
+    'aggregation': 0.5,
+    'map_visualization': 0.5,
+    'pharmacy_buffer_analysis': 0.5,
+    'radius_query': 0.8,
+}
+# Thư viện chỉ được nạp trong nhánh cần đến chúng, không được nạp khi import
+HEAVY_MODULES = ('pandas', 'matplotlib', 'folium')
+
+# Tiến trình chỉ truy vấn bán kính: import, đọc cache dạng cột, dựng chỉ mục, một truy vấn
+RADIUS_QUERY_CODE = """
+import pharmacy_buffer_analysis as pba
+from spatial_index import PharmacyIndex
+table = pba.load_pharmacies()
+pba.find_in_radius(PharmacyIndex(table.lon, table.lat), table, pba.pharmacy_ids(table),
+                   pba.CENTER_LAT, pba.CENTER_LON, pba.RADIUS_M)
+"""
+
+
+def _stage_paths(export, workdir):
+    return {
+        'export': export,
+        'clean': workdir / "clean_pharmacy.geojson",
+        'audit': workdir / "dedup_audit.csv",
+        'csv': workdir / "pharmacy_by_district.csv",
+        'map': workdir / "pharmacies_map.html",
+    }
+
+
+def _run_clean(paths):
+    stats = data_cleaning.clean_pharmacy_data(paths['export'], paths['clean'], stream=True,
+                                              audit_file=paths['audit'])
+    return stats['total']
+
+
+def _run_analysis(paths):
+    df = analysis.load_pharmacy_data(paths['clean'])
+    analysis.analyze_by_district(df, paths['csv'])
+    aggregation.compute_aggregates(load_table(paths['clean']))
+    return len(df)
+
+
+def _run_map(paths):
+    map_visualization.create_map(paths['map'], compact=True, heatmap=False, data_file=paths['clean'])
+    return len(load_table(paths['clean']))
+
+
+def _run_buffer(paths):
+    rng = np.random.default_rng(0)
+    centres = [(f"c{i}", lat, lon) for i, (lon, lat) in enumerate(zip(
+        rng.uniform(105.75, 105.90, BUFFER_CENTRES), rng.uniform(20.95, 21.08, BUFFER_CENTRES)))]
+    rows = pharmacy_buffer_analysis.run_batch(centres, BUFFER_RADII, paths['clean'], workers=1)
+    return len(rows)
+
+
+# Tên bước -> (hàm chạy, đơn vị của số lượng trả về)
+STAGES = {
+    'clean': (_run_clean, "feature"),
+    'analysis': (_run_analysis, "hiệu thuốc"),
+    'map': (_run_map, "hiệu thuốc"),
+    'buffer': (_run_buffer, "truy vấn"),
+}
+
+
+def _measure(stage, paths, trace_memory=False, verbose=False):
+    """Chạy một bước (trong tiến trình con) và trả về số đo"""
+    run, _ = STAGES[stage]
+    baseline = rss_mb(peak=False)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        items = run(paths)
+        seconds = time.perf_counter() - start
+        python_peak = tracemalloc.get_traced_memory()[1] / 2**20 if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    return {'items': items, 'seconds': seconds, 'peak_rss_mb': rss_mb(),
+            'baseline_rss_mb': baseline, 'python_peak_mb': python_peak}
+
+
+def measure_in_subprocess(stage, paths, trace_memory=False, verbose=False):
+    """Đo trong một tiến trình mới để bộ nhớ đỉnh không bị ảnh hưởng bởi bước trước"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(_measure, stage, paths, trace_memory, verbose).result()
+
+
+def measure_startup(target):
+    """Thời gian import một module (hoặc chạy 'radius_query') trong tiến trình Python mới"""
+    code = RADIUS_QUERY_CODE if target == 'radius_query' else f"import {target}"
+    probe = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"exec({code!r})\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", probe], cwd=Path(__file__).parent,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_import_budget(targets=tuple(IMPORT_BUDGET_S), repeat=3):
+    """Đo thời gian khởi động của từng mục so với ngân sách; trả về danh sách mục vượt"""
+    print(f"   {'Module':<26} {'Thời gian':>10} {'Ngân sách':>10}  Thư viện nặng đã nạp")
+    over = []
+    for target in targets:
+        runs = [measure_startup(target) for _ in range(repeat)]
+        best = min(runs, key=lambda r: r['seconds'])
+        budget = IMPORT_BUDGET_S.get(target)
+        # Truy vấn bán kính được phép nạp numpy, nhưng không được nạp pandas/matplotlib/folium
+        failed = bool(best['heavy']) or (budget is not None and best['seconds'] > budget)
+        if failed:
+            over.append(target)
+        print(f"   {target:<26} {best['seconds']:>9.3f}s {budget or 0:>9.2f}s  "
+              f"{', '.join(best['heavy']) or '-'}{'  VƯỢT' if failed else ''}")
+    return over
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=tuple(STAGES), seed=0, repeat=1,
+                   results_file=RESULTS_FILE, trace_memory=False, verbose=False):
+    """Chạy các bước trên từng kích thước dữ liệu, ghi kết quả ra results_file (JSONL)"""
+    environment = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    results_file = Path(results_file)
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    records = []
+    for size in sizes:
+        export = generate(size, seed)
+        workdir = OUTPUT_DIR / f"run_{size}_s{seed}"
+        workdir.mkdir(parents=True, exist_ok=True)
+        paths = _stage_paths(export, workdir)
+        if 'clean' not in stages and not paths['clean'].exists():
+            # Các bước sau cần dữ liệu đã làm sạch; bước làm sạch không được tính giờ
+            measure_in_subprocess('clean', paths)
+        for stage in sorted(stages, key=list(STAGES).index):
+            runs = [measure_in_subprocess(stage, paths, trace_memory, verbose) for _ in range(repeat)]
+            best = min(runs, key=lambda r: r['seconds'])
+            record = {
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                **environment,
+                'seed': seed,
+                'size': size,
+                'stage': stage,
+                'items': best['items'],
+                'unit': STAGES[stage][1],
+                'seconds': round(best['seconds'], 4),
+                'items_per_sec': round(best['items'] / best['seconds'], 1) if best['seconds'] > 0 else None,
+                'peak_rss_mb': round(max(r['peak_rss_mb'] or 0 for r in runs), 1),
+                'baseline_rss_mb': round(best['baseline_rss_mb'], 1) if best['baseline_rss_mb'] else None,
+                'python_peak_mb': round(best['python_peak_mb'], 1) if trace_memory else None,
+                'repeat': repeat,
+            }
+            records.append(record)
+            with open(results_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            print(f"   {size:>10} {stage:<10} {record['seconds']:>9.3f}s "
+                  f"{record['items_per_sec'] or 0:>12.0f} {record['unit'] + '/s':<14} {record['peak_rss_mb']:>9.1f} MB")
+    print(f"\n Đã ghi {len(records)} kết quả vào: {results_file}")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline trên dữ liệu giả lập nhiều kích thước")
+    parser.add_argument("--sizes", type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Số feature của file xuất giả lập (ví dụ 1000 10000 1000000)")
+    parser.add_argument("--stages", nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help="Các bước cần đo")
+    parser.add_argument("--seed", type=int, default=0, help="Seed sinh dữ liệu")
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần chạy mỗi bước (lấy lần nhanh nhất)")
+    parser.add_argument("--output", type=Path, default=RESULTS_FILE, help="File kết quả JSONL (nối thêm)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Đo thêm bộ nhớ đỉnh của đối tượng Python (chậm hơn)")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của từng bước")
+    parser.add_argument("--imports", action="store_true",
+                        help="Chỉ kiểm tra thời gian khởi động so với ngân sách IMPORT_BUDGET_S")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        repeat = max(args.repeat, 3)
+        print(f" Thời gian khởi động (lần nhanh nhất / {repeat} lần)")
+        over = check_import_budget(repeat=repeat)
+        if over:
+            print(f"\n Vượt ngân sách khởi động: {', '.join(over)}")
+            sys.exit(1)
+        print("\n Mọi module đều trong ngân sách khởi động")
+        return over
+
+    print(f" Benchmark {len(args.sizes)} kích thước x {len(args.stages)} bước "
+          f"(khung dữ liệu: {HANOI_BBOX})")
+    print(f"   {'Kích thước':>10} {'Bước':<10} {'Thời gian':>10} {'Thông lượng':>12} {'':<14} {'RSS đỉnh':>9}")
+    return run_benchmarks(args.sizes, args.stages, args.seed, args.repeat, args.output,
+                          args.tracemalloc, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Bộ nhớ đệm dạng cột (columnar) của dữ liệu hiệu thuốc đã làm sạch
+
+Bước làm sạch ghi thêm thư mục clean_pharmacy.cache/ bên cạnh clean_pharmacy.geojson.
+Mỗi lần ghi tạo một thế hệ mới gen-*/ gồm:
+- lon.npy, lat.npy: tọa độ float64
+- district_code.npy: mã quận int16 (-1 nếu không có), bảng tên quận nằm trong meta.json
+- <cột>.offsets.npy + <cột>.utf8: các cột chuỗi (tên, đường, giờ mở cửa...) lưu liền
+  nhau dạng UTF-8 kèm mảng vị trí
+
+meta.json (mã băm của file GeoJSON nguồn, số bản ghi, danh sách cột, thế hệ hiện hành)
+được thay bằng phép đổi tên sau khi thế hệ mới đã ghi xong: bước chạy song song đang
+ánh xạ bộ nhớ thế hệ cũ vẫn đọc được, không ai thấy một thế hệ ghi dở. Thế hệ cũ được
+xóa sau GENERATION_GRACE_S giây.
+
+Các bước sau (phân tích, bản đồ, buffer) đọc cache bằng np.load(mmap_mode='r') — không
+sao chép, không phân tích JSON. GeoJSON vẫn là định dạng trao đổi; cache tự được tạo
+lại khi nội dung file GeoJSON thay đổi.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from geojson_io import file_digest, iter_geojson_features
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+
+# Các cột chuỗi được lưu trong cache (lấy từ properties của feature)
+STRING_COLUMNS = ("osm_id", "name", "district_raw", "street", "housenumber", "ward",
+                  "opening_hours", "phone", "website", "brand")
+
+CACHE_FORMAT_VERSION = 3
+
+# Thế hệ cache không còn được meta.json trỏ tới sẽ bị xóa sau khoảng thời gian này (giây)
+GENERATION_GRACE_S = 60
+
+
+def cache_dir_for(geojson_path):
+    """Thư mục cache ứng với một file GeoJSON (clean_pharmacy.geojson -> clean_pharmacy.cache)"""
+    geojson_path = Path(geojson_path)
+    return geojson_path.with_name(geojson_path.name.split('.')[0] + ".cache")
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _write_json_atomic(path, data):
+    """Ghi JSON ra file tạm riêng của lần ghi rồi đổi tên đè lên path"""
+    fd, tmp_path = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _prune_generations(cache_dir, current):
+    """Xóa các thế hệ cũ (và thư mục ghi dở bị bỏ lại) đã quá GENERATION_GRACE_S giây"""
+    cutoff = time.time() - GENERATION_GRACE_S
+    for path in cache_dir.glob("gen-*"):
+        if path.name == current:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+
+
+def write_cache(features, geojson_path=DATA_FILE):
+    """Ghi cache dạng cột từ các feature đã làm sạch của file geojson_path"""
+    cache_dir = cache_dir_for(geojson_path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_dir = Path(tempfile.mkdtemp(prefix="gen-", dir=cache_dir))
+
+    lons, lats, codes = [], [], []
+    districts = {}
+    strings = {col: [] for col in STRING_COLUMNS}
+    for feature in features:
+        props = feature.get('properties') or {}
+        coords = (feature.get('geometry') or {}).get('coordinates') or [float('nan'), float('nan')]
+        lons.append(coords[0])
+        lats.append(coords[1])
+        district = props.get('district')
+        codes.append(districts.setdefault(district, len(districts)) if district else -1)
+        for col in STRING_COLUMNS:
+            strings[col].append(props.get(col) or "")
+
+    np.save(data_dir / "lon.npy", np.array(lons, dtype=np.float64))
+    np.save(data_dir / "lat.npy", np.array(lats, dtype=np.float64))
+    np.save(data_dir / "district_code.npy", np.array(codes, dtype=np.int16))
+    for col, values in strings.items():
+        encoded = [v.encode('utf-8') for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(data_dir / f"{col}.offsets.npy", offsets)
+        with open(data_dir / f"{col}.utf8", 'wb') as f:
+            f.write(b"".join(encoded))
+
+    # meta.json được thay sau cùng: thế hệ mới chỉ được dùng khi đã ghi đủ các cột
+    meta = {
+        'version': CACHE_FORMAT_VERSION,
+        'source_hash': file_digest(geojson_path),
+        'source_stat': _source_stat(geojson_path),
+        'count': len(lons),
+        'districts': list(districts),
+        'string_columns': list(STRING_COLUMNS),
+        'generation': data_dir.name,
+    }
+    _write_json_atomic(cache_dir / "meta.json", meta)
+    _prune_generations(cache_dir, data_dir.name)
+    return cache_dir
+
+
+def build_cache(geojson_path=DATA_FILE):
+    """Tạo cache từ file GeoJSON (đọc theo kiểu streaming)"""
+    return write_cache(iter_geojson_features(geojson_path), geojson_path)
+
+
+def _read_meta(geojson_path):
+    """meta.json nếu cache còn khớp với file GeoJSON, ngược lại None"""
+    meta_path = cache_dir_for(geojson_path) / "meta.json"
+    if not meta_path.exists():
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_FORMAT_VERSION or not (meta_path.parent / meta['generation']).is_dir():
+        return None
+    # Kiểm tra nhanh theo kích thước/thời gian sửa; nếu khác mới tính lại mã băm nội dung
+    if meta.get('source_stat') == _source_stat(geojson_path):
+        return meta
+    if meta.get('source_hash') != file_digest(geojson_path):
+        return None
+    meta['source_stat'] = _source_stat(geojson_path)
+    _write_json_atomic(meta_path, meta)
+    return meta
+
+
+class PharmacyTable:
+    """Dữ liệu hiệu thuốc dạng cột, các mảng được ánh xạ bộ nhớ từ một thế hệ cache"""
+
+    def __init__(self, cache_dir, meta):
+        self.cache_dir = Path(cache_dir)
+        self.data_dir = self.cache_dir / meta['generation']
+        self.meta = meta
+        self.lon = np.load(self.data_dir / "lon.npy", mmap_mode='r')
+        self.lat = np.load(self.data_dir / "lat.npy", mmap_mode='r')
+        self.district_code = np.load(self.data_dir / "district_code.npy", mmap_mode='r')
+        self.districts = list(meta['districts'])
+        self._strings = {}
+
+    def __len__(self):
+        return self.meta['count']
+
+    def _string_column(self, name):
+        if name not in self._strings:
+            if name not in self.meta['string_columns']:
+                raise KeyError(name)
+            offsets = np.load(self.data_dir / f"{name}.offsets.npy", mmap_mode='r')
+            blob_path = self.data_dir / f"{name}.utf8"
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if blob_path.stat().st_size else np.empty(0, np.uint8)
+            self._strings[name] = (offsets, blob)
+        return self._strings[name]
+
+    def get(self, name, i):
+        """Giá trị chuỗi của cột name tại bản ghi i"""
+        offsets, blob = self._string_column(name)
+        return bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    def column(self, name):
+        """Toàn bộ cột chuỗi dưới dạng list[str]"""
+        if name == 'district':
+            return self.district_names().tolist()
+        offsets, blob = self._string_column(name)
+        data = bytes(blob)
+        bounds = offsets.tolist()
+        return [data[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(len(bounds) - 1)]
+
+    def district_names(self):
+        """Tên quận của từng bản ghi (mảng object, None nếu không có quận)"""
+        table = np.array(self.districts + [None], dtype=object)
+        return table[np.asarray(self.district_code)]
+
+    def records(self, columns=("name", "district", "street", "opening_hours", "phone")):
+        """Danh sách dict cho từng hiệu thuốc, kèm lat/lon"""
+        values = {col: self.column(col) for col in columns}
+        lats, lons = self.lat.tolist(), self.lon.tolist()
+        return [dict({col: values[col][i] for col in columns}, lat=lats[i], lon=lons[i])
+                for i in range(len(self))]
+
+
+def load_table(geojson_path=DATA_FILE):
+    """Đọc dữ liệu hiệu thuốc dạng cột; tạo lại cache nếu chưa có hoặc đã cũ"""
+    meta = _read_meta(geojson_path)
+    if meta is None:
+        build_cache(geojson_path)
+        meta = _read_meta(geojson_path)
+    return PharmacyTable(cache_dir_for(geojson_path), meta)
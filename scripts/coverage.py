@@ -0,0 +1,290 @@
+"""
+Phân tích độ phủ: khoảng cách tới hiệu thuốc gần nhất cho từng ô lưới 100 m
+
+Ngược với phân tích buffer (có bao nhiêu hiệu thuốc quanh một điểm), bước này trả lời:
+với mỗi ô lưới trong thành phố, hiệu thuốc gần nhất cách bao xa, và khu vực nào
+thiếu hiệu thuốc.
+
+- Lưới ô vuông COVERAGE_CELL_M mét (phép chiếu equirectangular, cùng gốc với density.py)
+  phủ ranh giới quận/huyện nếu có file ranh giới, nếu không thì phủ hộp bao các hiệu
+  thuốc cộng thêm COVERAGE_MARGIN_M.
+- Lưới được chia thành các khối COVERAGE_BLOCK x COVERAGE_BLOCK ô, xử lý song song.
+  Với mỗi khối chỉ cần xét các hiệu thuốc trong bán kính (từ chỉ mục KD-tree) có
+  thể là gần nhất với một ô nào đó trong khối, nên tổng chi phí gần tuyến tính.
+- Kết quả ghi vào mảng ánh xạ bộ nhớ results/coverage_distance.npy (float32, mét,
+  NaN ngoài ranh giới) kèm coverage_distance.json, và bảng tóm tắt khu vực thiếu
+  hiệu thuốc results/coverage_summary.csv.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from columnar_cache import load_table
+from density import to_lonlat, to_metres
+from distance import HaversineEngine
+from district_boundaries import DISTRICT_BOUNDARIES_FILE, DistrictBoundaries
+from spatial_index import PharmacyIndex
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+OUTPUT_RASTER = Path(__file__).parent.parent / "results" / "coverage_distance.npy"
+OUTPUT_SUMMARY = Path(__file__).parent.parent / "results" / "coverage_summary.csv"
+
+# Kích thước ô lưới (mét)
+COVERAGE_CELL_M = 100
+# Lề quanh hộp bao các hiệu thuốc khi không có file ranh giới (mét)
+COVERAGE_MARGIN_M = 2000
+# Số ô mỗi cạnh của một khối xử lý
+COVERAGE_BLOCK = 128
+
+# Các ngưỡng khoảng cách (mét) để đánh giá thiếu hiệu thuốc
+UNDERSERVED_THRESHOLDS_M = (500, 1000, 2000)
+
+SUMMARY_COLUMNS = ['area', 'cells', 'area_km2', 'mean_m', 'p50_m', 'p90_m', 'max_m',
+                   *[f'share_over_{t}m' for t in UNDERSERVED_THRESHOLDS_M]]
+
+
+def grid_spec(lons, lats, boundaries=None, cell_m=COVERAGE_CELL_M, margin_m=COVERAGE_MARGIN_M):
+    """Gốc (x0, y0) mét và kích thước (ny, nx) của lưới"""
+    if boundaries is not None and len(boundaries):
+        min_lon, min_lat = boundaries._bbox[:, 0].min(), boundaries._bbox[:, 1].min()
+        max_lon, max_lat = boundaries._bbox[:, 2].max(), boundaries._bbox[:, 3].max()
+        margin_m = 0
+    else:
+        min_lon, max_lon = float(np.min(lons)), float(np.max(lons))
+        min_lat, max_lat = float(np.min(lats)), float(np.max(lats))
+    (x0, x1), (y0, y1) = to_metres([min_lon, max_lon], [min_lat, max_lat])
+    x0, y0 = math.floor((x0 - margin_m) / cell_m) * cell_m, math.floor((y0 - margin_m) / cell_m) * cell_m
+    nx = math.ceil((x1 + margin_m - x0) / cell_m)
+    ny = math.ceil((y1 + margin_m - y0) / cell_m)
+    return (x0, y0), (ny, nx)
+
+
+def _cell_centres(origin, cell_m, rows, cols):
+    """Kinh độ/vĩ độ tâm các ô trong khối rows x cols (mảng 2 chiều)"""
+    x0, y0 = origin
+    xs = x0 + (np.arange(cols.start, cols.stop) + 0.5) * cell_m
+    ys = y0 + (np.arange(rows.start, rows.stop) + 0.5) * cell_m
+    gx, gy = np.meshgrid(xs, ys)
+    return to_lonlat(gx, gy)
+
+
+# Trạng thái của mỗi tiến trình con: chỉ mục và ranh giới được nạp một lần
+_worker_state = {}
+
+
+def _valid_coordinates(table):
+    """Kinh độ/vĩ độ của các hiệu thuốc có tọa độ hữu hạn (bỏ NaN/inf)"""
+    lons = np.asarray(table.lon, dtype=np.float64)
+    lats = np.asarray(table.lat, dtype=np.float64)
+    valid = np.isfinite(lons) & np.isfinite(lats)
+    return lons[valid], lats[valid]
+
+
+def _init_worker(data_file, boundaries_file):
+    _worker_state['index'] = PharmacyIndex(*_valid_coordinates(load_table(data_file)))
+    _worker_state['boundaries'] = (DistrictBoundaries.from_geojson(boundaries_file)
+                                   if boundaries_file and Path(boundaries_file).exists() else None)
+
+
+def nearest_distances(index, lons, lats):
+    """Khoảng cách (mét) tới hiệu thuốc gần nhất cho một khối ô gần nhau
+
+    Gọi c là tâm các ô, h là khoảng cách xa nhất từ c tới một ô, d* là khoảng cách từ c
+    tới hiệu thuốc gần nhất. Mọi ô có hiệu thuốc gần nhất cách không quá d* + h, nên chỉ
+    các hiệu thuốc cách c không quá d* + 2h mới cần xét. h được đo tới từng ô (không chỉ
+    tới góc hộp bao) vì các ô trong ranh giới quận có thể dồn về một phía của khối.
+    """
+    flat_lons, flat_lats = lons.ravel(), lats.ravel()
+    c_lon, c_lat = float(flat_lons.mean()), float(flat_lats.mean())
+    spread = float(HaversineEngine(flat_lons, flat_lats).distances(c_lon, c_lat)[0].max())
+    nearest = index.nearest(c_lat, c_lon, 1)
+    if not nearest:
+        return np.full(lons.shape, np.nan, dtype=np.float32)
+    radius = nearest[0][1] + 2 * spread
+    cols = np.array([i for i, _ in index.within_radius(c_lat, c_lon, radius)], dtype=np.intp)
+    result = np.empty(len(flat_lons), dtype=np.float32)
+    for start, block in index.engine.iter_blocks(flat_lons, flat_lats, cols):
+        result[start:start + len(block)] = block.min(axis=1)
+    return result.reshape(lons.shape)
+
+
+def check_nearest_distances(trials=200, seed=0):
+    """Đối chiếu nearest_distances với phép quét toàn bộ trên các khối ô bị che ngẫu nhiên
+
+    Mô phỏng khối cắt bởi ranh giới quận (ô dồn về một góc, vài ô lẻ ở góc đối diện).
+    Trả về số khối cho kết quả khác phép quét toàn bộ.
+    """
+    rng = np.random.default_rng(seed)
+    origin, cell_m = to_metres([105.80], [21.00]), COVERAGE_CELL_M
+    origin = (float(origin[0][0]), float(origin[1][0]))
+    lons, lats = _cell_centres(origin, cell_m, slice(0, COVERAGE_BLOCK), slice(0, COVERAGE_BLOCK))
+    failures = 0
+    span_lon, span_lat = lons.max() - lons.min(), lats.max() - lats.min()
+    for _ in range(trials):
+        inside = np.zeros(lons.shape, dtype=bool)
+        corner = int(rng.integers(1, COVERAGE_BLOCK // 4))
+        inside[-corner:, :corner] = True  # cụm ô ở góc tây bắc
+        inside[0, -1] = True  # ô lẻ ở góc đông nam (xa tâm nhất, không phải góc của hộp bao đo cũ)
+        inside[rng.integers(0, COVERAGE_BLOCK, 3), rng.integers(0, COVERAGE_BLOCK, 3)] = True
+        # Một hiệu thuốc sát cụm ô (d* nhỏ), các hiệu thuốc khác rải cả ra ngoài khối
+        n = int(rng.integers(1, 6))
+        p_lons = np.append(lons[-1, 0] + rng.uniform(-0.002, 0.002),
+                           rng.uniform(lons.min() - span_lon, lons.max() + span_lon, n))
+        p_lats = np.append(lats[-1, 0] + rng.uniform(-0.002, 0.002),
+                           rng.uniform(lats.min() - span_lat, lats.max() + span_lat, n))
+        index = PharmacyIndex(p_lons, p_lats)
+        got = nearest_distances(index, lons[inside], lats[inside])
+        expected = index.engine.distances(lons[inside], lats[inside]).min(axis=1)
+        if not np.allclose(got, expected, rtol=1e-5, atol=0.01):
+            failures += 1
+    return failures
+
+
+def _process_block(raster_path, origin, cell_m, rows, cols):
+    """Tính một khối và ghi thẳng vào mảng ánh xạ bộ nhớ; trả về mã quận của các ô"""
+    index, boundaries = _worker_state['index'], _worker_state['boundaries']
+    lons, lats = _cell_centres(origin, cell_m, rows, cols)
+    codes = None
+    dist = np.full(lons.shape, np.nan, dtype=np.float32)
+    if boundaries is not None:
+        codes = boundaries.assign_codes(lons.ravel(), lats.ravel()).reshape(lons.shape)
+        inside = codes >= 0
+        if inside.any():
+            dist[inside] = nearest_distances(index, lons[inside], lats[inside])
+    else:
+        dist = nearest_distances(index, lons, lats)
+    raster = np.lib.format.open_memmap(raster_path, mode='r+')
+    raster[rows, cols] = dist
+    raster.flush()
+    del raster
+    return rows, cols, codes
+
+
+def compute_coverage(data_file=DATA_FILE, output_raster=OUTPUT_RASTER, boundaries_file=DISTRICT_BOUNDARIES_FILE,
+                     cell_m=COVERAGE_CELL_M, block=COVERAGE_BLOCK, workers=None):
+    """Tính raster khoảng cách tới hiệu thuốc gần nhất
+
+    Trả về (raster ánh xạ bộ nhớ, mã quận của từng ô hoặc None, danh sách tên quận).
+    """
+    output_raster = Path(output_raster)
+    output_raster.parent.mkdir(parents=True, exist_ok=True)
+    lons, lats = _valid_coordinates(load_table(data_file))
+    if not len(lons):
+        raise ValueError("Không có hiệu thuốc nào để tính độ phủ")
+    boundaries = None
+    if boundaries_file and Path(boundaries_file).exists():
+        boundaries = DistrictBoundaries.from_geojson(boundaries_file)
+    else:
+        boundaries_file = None
+        print(f"  Không có file ranh giới, dùng hộp bao hiệu thuốc + {COVERAGE_MARGIN_M}m")
+
+    origin, (ny, nx) = grid_spec(lons, lats, boundaries, cell_m)
+    print(f" Lưới {nx} x {ny} = {nx * ny:,} ô {cell_m}m")
+    raster = np.lib.format.open_memmap(output_raster, mode='w+', dtype=np.float32, shape=(ny, nx))
+    raster[:] = np.nan
+    raster.flush()
+    del raster
+
+    blocks = [(slice(r, min(r + block, ny)), slice(c, min(c + block, nx)))
+              for r in range(0, ny, block) for c in range(0, nx, block)]
+    codes = np.full((ny, nx), -1, dtype=np.int16) if boundaries is not None else None
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(blocks))
+    if workers <= 1 or len(blocks) <= 1:
+        _init_worker(data_file, boundaries_file)
+        results = [_process_block(output_raster, origin, cell_m, rows, cols) for rows, cols in blocks]
+    else:
+        # spawn thay vì fork: run_all chạy bước này trong một luồng cạnh các bước khác
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(data_file, boundaries_file), mp_context=get_context('spawn')) as executor:
+            results = list(executor.map(_process_block, [output_raster] * len(blocks), [origin] * len(blocks),
+                                        [cell_m] * len(blocks), *zip(*blocks)))
+    if codes is not None:
+        for rows, cols, block_codes in results:
+            codes[rows, cols] = block_codes
+
+    meta = {'origin_m': list(origin), 'cell_m': cell_m, 'shape': [ny, nx],
+            'projection': 'equirectangular (density.to_metres)', 'units': 'm',
+            'row_order': 'south_to_north'}
+    with open(output_raster.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    names = boundaries.names if boundaries is not None else []
+    return np.load(output_raster, mmap_mode='r'), codes, names
+
+
+def _summary_row(area, dist, cell_m):
+    dist = dist[np.isfinite(dist)]
+    row = {'area': area, 'cells': int(len(dist)), 'area_km2': round(len(dist) * (cell_m / 1000) ** 2, 2)}
+    if len(dist):
+        p50, p90 = np.percentile(dist, [50, 90])
+        row.update(mean_m=round(float(dist.mean()), 1), p50_m=round(float(p50), 1),
+                   p90_m=round(float(p90), 1), max_m=round(float(dist.max()), 1))
+        for t in UNDERSERVED_THRESHOLDS_M:
+            row[f'share_over_{t}m'] = round(float((dist > t).mean()) * 100, 2)
+    return row
+
+
+def summarize(raster, codes=None, names=(), cell_m=COVERAGE_CELL_M, output=OUTPUT_SUMMARY):
+    """Bảng tóm tắt độ phủ: toàn vùng và từng quận (nếu có ranh giới)"""
+    dist = np.asarray(raster)
+    rows = [_summary_row('Toàn vùng', dist.ravel(), cell_m)]
+    if codes is not None:
+        for code, name in enumerate(names):
+            rows.append(_summary_row(name, dist[codes == code], cell_m))
+    # Quận thiếu hiệu thuốc nhất lên đầu (sau dòng toàn vùng)
+    rows[1:] = sorted(rows[1:], key=lambda r: -(r.get('p90_m') or 0))
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Khoảng cách tới hiệu thuốc gần nhất cho từng ô lưới")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File GeoJSON hiệu thuốc đã làm sạch")
+    parser.add_argument("--boundaries", type=Path, default=DISTRICT_BOUNDARIES_FILE,
+                        help="File GeoJSON ranh giới quận/huyện (tùy chọn)")
+    parser.add_argument("--cell", type=int, default=COVERAGE_CELL_M, help="Kích thước ô lưới (mét)")
+    parser.add_argument("--block", type=int, default=COVERAGE_BLOCK, help="Số ô mỗi cạnh của một khối")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình (mặc định: số CPU)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_RASTER, help="File .npy kết quả")
+    parser.add_argument("--summary", type=Path, default=OUTPUT_SUMMARY, help="File CSV tóm tắt")
+    parser.add_argument("--check", action="store_true",
+                        help="Chỉ đối chiếu phép cắt tỉa với phép quét toàn bộ trên khối ô bị che, rồi thoát")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = check_nearest_distances()
+        print(f" Kiểm tra khoảng cách gần nhất trên khối bị che: {failures} khối sai")
+        if failures:
+            raise SystemExit(1)
+        return []
+
+    raster, codes, names = compute_coverage(args.data, args.output, args.boundaries, args.cell,
+                                            args.block, args.workers)
+    rows = summarize(raster, codes, names, args.cell, args.summary)
+    print(f" Đã lưu raster khoảng cách: {args.output}")
+    print(f" Đã lưu tóm tắt: {args.summary}")
+    print("\n" + "="*60)
+    print("KHU VỰC THIẾU HIỆU THUỐC")
+    print("="*60)
+    for row in rows:
+        if row['cells']:
+            print(f"   {row['area']:<15} TB {row['mean_m']:>7.0f}m  p90 {row['p90_m']:>7.0f}m  "
+                  f">1km: {row['share_over_1000m']:>5.1f}%")
+    return rows
+
+
+if __name__ == "__main__":
+    main()
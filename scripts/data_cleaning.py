@@ -3,94 +3,79 @@ Người 1 - Dữ liệu & Tiền xử lý
 Làm sạch dữ liệu export.geojson và tạo file clean_pharmacy.geojson
 """
 
+import argparse
+import hashlib
 import json
+import math
 import re
 from pathlib import Path
 
+from columnar_cache import build_cache, write_cache
+from deduplication import AUDIT_FILE, deduplicate, deduplicate_file, write_audit
+from district_boundaries import DISTRICT_BOUNDARIES_FILE, DistrictBoundaries
+from district_normalizer import DistrictNormalizer
+from geojson_io import COORD_PRECISION, FeatureCollectionWriter, file_digest, iter_geojson_features, load_geojson
+from geometry import representative_points
+from instrumentation import add_metrics_arguments, configure_from_args, span, stage
+
 # Đường dẫn file
 INPUT_FILE = Path(__file__).parent.parent / "data" / "export.geojson"
 OUTPUT_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
 
+# File trạng thái cho chế độ làm sạch tăng dần: id OSM -> mã băm nội dung
+STATE_FILE = Path(__file__).parent.parent / "data" / "clean_state.json"
+
+# Số hiệu thuốc được gán quận theo ranh giới trong một lô
+CLEAN_BATCH_SIZE = 10000
+
 # Danh sách quận/huyện Hà Nội chuẩn
-DISTRICT_MAPPING = {
+# (bảng tra cứu không dấu, viết tắt... được DistrictNormalizer tự sinh từ danh sách này)
+HANOI_DISTRICTS = [
     # Quận nội thành
-    "ba đình": "Ba Đình",
-    "ba dinh": "Ba Đình",
-    "hoàn kiếm": "Hoàn Kiếm",
-    "hoan kiem": "Hoàn Kiếm",
-    "hai bà trưng": "Hai Bà Trưng",
-    "hai ba trung": "Hai Bà Trưng",
-    "đống đa": "Đống Đa",
-    "dong da": "Đống Đa",
-    "tây hồ": "Tây Hồ",
-    "tay ho": "Tây Hồ",
-    "cầu giấy": "Cầu Giấy",
-    "cau giay": "Cầu Giấy",
-    "thanh xuân": "Thanh Xuân",
-    "thanh xuan": "Thanh Xuân",
-    "hoàng mai": "Hoàng Mai",
-    "hoang mai": "Hoàng Mai",
-    "long biên": "Long Biên",
-    "long bien": "Long Biên",
-    "bắc từ liêm": "Bắc Từ Liêm",
-    "bac tu liem": "Bắc Từ Liêm",
-    "nam từ liêm": "Nam Từ Liêm",
-    "nam tu liem": "Nam Từ Liêm",
-    "hà đông": "Hà Đông",
-    "ha dong": "Hà Đông",
+    "Ba Đình", "Hoàn Kiếm", "Hai Bà Trưng", "Đống Đa", "Tây Hồ", "Cầu Giấy",
+    "Thanh Xuân", "Hoàng Mai", "Long Biên", "Bắc Từ Liêm", "Nam Từ Liêm", "Hà Đông",
     
     # Huyện ngoại thành
-    "sóc sơn": "Sóc Sơn",
-    "soc son": "Sóc Sơn",
-    "đông anh": "Đông Anh",
-    "dong anh": "Đông Anh",
-    "gia lâm": "Gia Lâm",
-    "gia lam": "Gia Lâm",
-    "thanh trì": "Thanh Trì",
-    "thanh tri": "Thanh Trì",
-    "thường tín": "Thường Tín",
-    "thuong tin": "Thường Tín",
-    "hoài đức": "Hoài Đức",
-    "hoai duc": "Hoài Đức",
-    "đan phượng": "Đan Phượng",
-    "dan phuong": "Đan Phượng",
-    "mê linh": "Mê Linh",
-    "me linh": "Mê Linh",
-    "phúc thọ": "Phúc Thọ",
-    "phuc tho": "Phúc Thọ",
-    "thạch thất": "Thạch Thất",
-    "thach that": "Thạch Thất",
-    "quốc oai": "Quốc Oai",
-    "quoc oai": "Quốc Oai",
-    "chương mỹ": "Chương Mỹ",
-    "chuong my": "Chương Mỹ",
-    "thanh oai": "Thanh Oai",
-    "mỹ đức": "Mỹ Đức",
-    "my duc": "Mỹ Đức",
-    "ứng hòa": "Ứng Hòa",
-    "ung hoa": "Ứng Hòa",
-    "phú xuyên": "Phú Xuyên",
-    "phu xuyen": "Phú Xuyên",
+    "Sóc Sơn", "Đông Anh", "Gia Lâm", "Thanh Trì", "Thường Tín", "Hoài Đức",
+    "Đan Phượng", "Mê Linh", "Phúc Thọ", "Thạch Thất", "Quốc Oai", "Chương Mỹ",
+    "Thanh Oai", "Mỹ Đức", "Ứng Hòa", "Phú Xuyên",
     
     # Thị xã
-    "sơn tây": "Sơn Tây",
-    "son tay": "Sơn Tây",
-}
+    "Sơn Tây",
+]
+
+# Khoảng cách chỉnh sửa tối đa khi so khớp gần đúng tên quận (0 = tắt)
+DISTRICT_FUZZY_MAX_DISTANCE = 0
+
+_district_normalizer = DistrictNormalizer(HANOI_DISTRICTS, max_distance=DISTRICT_FUZZY_MAX_DISTANCE)
+
+
+def get_district_normalizer():
+    """Bộ chuẩn hóa tên quận đang dùng"""
+    return _district_normalizer
+
+
+def set_district_normalizer(max_distance=DISTRICT_FUZZY_MAX_DISTANCE):
+    """Tạo lại bộ chuẩn hóa tên quận, ví dụ để bật so khớp gần đúng"""
+    global _district_normalizer
+    _district_normalizer = DistrictNormalizer(HANOI_DISTRICTS, max_distance=max_distance)
+    return _district_normalizer
 
 
 def normalize_district(district_name):
     """Chuẩn hóa tên quận/huyện"""
-    if not district_name or not isinstance(district_name, str):
-        return None
-    
-    # Chuyển về chữ thường và loại bỏ khoảng trắng thừa
-    district_lower = district_name.strip().lower()
-    
-    # Loại bỏ các tiền tố
-    district_lower = re.sub(r'^(quận|huyện|thị xã)\s+', '', district_lower)
-    
-    # Tra cứu trong mapping
-    return DISTRICT_MAPPING.get(district_lower, None)
+    return _district_normalizer(district_name)
+
+
+# Tiền tố hành chính của phường/xã: "Phường Cổ Nhuế 1" và "Cổ Nhuế 1" là cùng một phường
+_WARD_PREFIX = re.compile(r"^(phường|xã|thị trấn|p\.)\s*", re.IGNORECASE)
+
+
+def normalize_ward(ward_name):
+    """Chuẩn hóa tên phường/xã (bỏ tiền tố hành chính, gom khoảng trắng)"""
+    if not ward_name or not isinstance(ward_name, str):
+        return ""
+    return _WARD_PREFIX.sub("", " ".join(ward_name.split()))
 
 
 def is_pharmacy(properties):
@@ -101,6 +86,12 @@ def is_pharmacy(properties):
     return amenity == "pharmacy" or shop == "chemist"
 
 
+def get_osm_id(feature):
+    """Lấy id OSM ổn định của feature (ví dụ "node/733355005")"""
+    props = feature.get("properties", {})
+    return props.get("@id") or feature.get("id")
+
+
 def extract_pharmacy_info(feature):
     """Trích xuất thông tin cần thiết của hiệu thuốc"""
     props = feature.get("properties", {})
@@ -113,6 +104,7 @@ def extract_pharmacy_info(feature):
     addr_district = props.get("addr:district", "")
     addr_street = props.get("addr:street", "")
     addr_housenumber = props.get("addr:housenumber", "")
+    ward = normalize_ward(props.get("addr:subdistrict", props.get("addr:quarter", "")))
     
     # Chuẩn hóa quận
     normalized_district = normalize_district(addr_district)
@@ -120,81 +112,441 @@ def extract_pharmacy_info(feature):
     # Lấy giờ mở cửa
     opening_hours = props.get("opening_hours", "")
     
-    # Lấy tọa độ
-    coordinates = geometry.get("coordinates", [])
-    
     # Lấy thêm một số thông tin khác
     phone = props.get("phone", props.get("contact:phone", ""))
     website = props.get("website", props.get("contact:website", ""))
     
+    # Thương hiệu (chuỗi nhà thuốc); để trống nếu là hiệu thuốc độc lập
+    brand = props.get("brand", "")
+    
     return {
         "type": "Feature",
         "properties": {
+            "osm_id": get_osm_id(feature),
             "name": name,
             "district": normalized_district,
             "district_raw": addr_district,  # Giữ lại tên gốc để kiểm tra
+            "district_source": "tag" if normalized_district else None,
             "street": addr_street,
             "housenumber": addr_housenumber,
+            "ward": ward,
             "opening_hours": opening_hours,
             "phone": phone,
             "website": website,
+            "brand": brand,
         },
         "geometry": geometry
     }
 
 
-def clean_pharmacy_data():
-    """Hàm chính để làm sạch dữ liệu"""
+def load_district_boundaries(path=DISTRICT_BOUNDARIES_FILE):
+    """Đọc ranh giới quận/huyện nếu có file, ngược lại trả về None"""
+    if path is None or not Path(path).exists():
+        return None
+    return DistrictBoundaries.from_geojson(path, normalize=normalize_district)
+
+
+def _normalize_geometries(batch, stats):
+    """Đưa hình học của cả lô về điểm đại diện; trả về (lô còn lại, mảng lon, mảng lat)
+
+    Hiệu thuốc dạng Polygon/MultiPolygon/LineString (way, relation) được thay bằng
+    geometry Point tại điểm đại diện (luôn nằm trong hình); hình gốc được giữ trong
+    thuộc tính source_geometry và trọng tâm trong centroid. Hiệu thuốc không có hình
+    học dùng được (rỗng, tọa độ NaN) bị loại và đếm vào stats['no_geometry']. Nhờ vậy
+    các bước sau chỉ cần đọc geometry.coordinates mà không phải kiểm tra loại hình học.
+    """
+    geometries = [clean_feature['geometry'] for clean_feature in batch]
+    points, centroids = representative_points(geometries)
+    kept, keep = [], []
+    for clean_feature, geometry, point, centroid in zip(batch, geometries, points.tolist(), centroids.tolist()):
+        valid = math.isfinite(point[0]) and math.isfinite(point[1])
+        keep.append(valid)
+        if not valid:
+            stats['no_geometry'] += 1
+            continue
+        kept.append(clean_feature)
+        props = clean_feature['properties']
+        geometry_type = geometry.get('type')
+        props['geometry_type'] = geometry_type
+        if geometry_type == 'Point':
+            continue
+        props['centroid'] = [round(v, 7) for v in centroid]
+        props['source_geometry'] = geometry
+        clean_feature['geometry'] = {"type": "Point", "coordinates": [round(v, 7) for v in point]}
+    points = points[keep]
+    return kept, points[:, 0], points[:, 1]
+
+
+def _assign_districts(batch, lons, lats, boundaries, stats):
+    """Gán quận theo ranh giới cho một lô hiệu thuốc, thẻ addr:district làm dự phòng"""
+    for clean_feature, polygon_district in zip(batch, boundaries.assign(lons, lats)):
+        props = clean_feature['properties']
+        if polygon_district:
+            stats['polygon'] += 1
+            # Đối chiếu với thẻ addr:district nếu có
+            if props['district'] and props['district'] != polygon_district:
+                stats['tag_mismatch'] += 1
+            props['district'] = polygon_district
+            props['district_source'] = 'polygon'
+        elif props['district']:
+            stats['tag_fallback'] += 1
+
+
+def _count_district(clean_feature, stats):
+    district = clean_feature['properties']['district']
+    stats['has_district'] += 1
+    stats['districts'][district] = stats['districts'].get(district, 0) + 1
+
+
+def _keep_with_district(batch, stats):
+    # Chỉ giữ lại các hiệu thuốc có quận hợp lệ
+    for clean_feature in batch:
+        if clean_feature['properties']['district']:
+            _count_district(clean_feature, stats)
+            yield clean_feature
+
+
+def _finish_batch(batch, boundaries, stats):
+    batch, lons, lats = _normalize_geometries(batch, stats)
+    if boundaries is not None:
+        _assign_districts(batch, lons, lats, boundaries, stats)
+    yield from _keep_with_district(batch, stats)
+
+
+def _clean_features(features, stats, boundaries=None, batch_size=CLEAN_BATCH_SIZE):
+    """Lọc và làm sạch lần lượt từng feature, cập nhật thống kê trong stats
+
+    Hiệu thuốc được gom thành lô để tính điểm đại diện của hình học và gán quận theo
+    point-in-polygon một cách vector hóa; bộ nhớ vẫn chỉ giới hạn trong một lô.
+    """
+    batch = []
+    for feature in features:
+        stats['total'] += 1
+        if is_pharmacy(feature.get('properties', {})):
+            stats['pharmacy'] += 1
+            batch.append(extract_pharmacy_info(feature))
+            if len(batch) >= batch_size:
+                yield from _finish_batch(batch, boundaries, stats)
+                batch = []
+    if batch:
+        yield from _finish_batch(batch, boundaries, stats)
+
+
+def _remove_duplicates(decisions, stats, audit_file=AUDIT_FILE):
+    """Trừ các bản ghi trùng đã bị bỏ khỏi thống kê và ghi file kiểm tra quyết định gộp"""
+    for decision in decisions:
+        district = decision['dropped_district']
+        stats['has_district'] -= 1
+        stats['districts'][district] -= 1
+        if not stats['districts'][district]:
+            del stats['districts'][district]
+    stats['duplicates'] += len(decisions)
+    stats['audit_file'] = audit_file
+    write_audit(decisions, audit_file)
+
+
+def _print_stats(stats):
+    print(f" Số hiệu thuốc tìm thấy: {stats['pharmacy']}")
+    if stats['no_geometry']:
+        print(f" Số hiệu thuốc không có tọa độ hợp lệ (đã loại): {stats['no_geometry']}")
+    if stats['polygon'] or stats['tag_fallback']:
+        print(f" Gán quận theo ranh giới: {stats['polygon']}, theo thẻ addr:district: {stats['tag_fallback']}")
+        print(f" Số hiệu thuốc có thẻ addr:district khác ranh giới: {stats['tag_mismatch']}")
+    if stats['duplicates']:
+        print(f" Số bản ghi trùng lặp đã gộp: {stats['duplicates']} (chi tiết: {stats['audit_file']})")
+    print(f" Số hiệu thuốc có thông tin quận hợp lệ: {stats['has_district']}")
+    cache = _district_normalizer.stats()
+    print(f" Cache chuẩn hóa tên quận: {cache['hit_rate']:.1%} trúng "
+          f"({cache['hits']}/{cache['hits'] + cache['misses']}), khớp gần đúng: {cache['fuzzy_matches']}")
+    
+    # Thống kê các quận
+    district_count = stats['districts']
+    print("\n Thống kê theo quận/huyện:")
+    for district in sorted(district_count.keys()):
+        print(f"   {district}: {district_count[district]} hiệu thuốc")
+
+
+def _new_stats():
+    return {'total': 0, 'pharmacy': 0, 'has_district': 0, 'districts': {},
+            'polygon': 0, 'tag_fallback': 0, 'tag_mismatch': 0, 'duplicates': 0, 'no_geometry': 0}
+
+
+def clean_pharmacy_data(input_file=INPUT_FILE, output_file=OUTPUT_FILE, stream=False,
+                        boundaries_file=DISTRICT_BOUNDARIES_FILE, dedup=True, audit_file=AUDIT_FILE,
+                        precision=COORD_PRECISION):
+    """Hàm chính để làm sạch dữ liệu
+
+    Với stream=True, file đầu vào được đọc và file kết quả được ghi từng feature
+    một, dùng cho các file xuất Overpass cỡ quốc gia (hàng trăm MB).
+    Nếu có file ranh giới quận/huyện, quận được gán theo vị trí của hiệu thuốc.
+    Với dedup=True, các bản ghi trùng lặp (xem deduplication.py) được gộp lại và các
+    quyết định gộp được ghi vào audit_file.
+    File kết quả là JSON gọn (mỗi dòng một hiệu thuốc), tọa độ làm tròn precision chữ
+    số thập phân (None = giữ nguyên); đuôi .gz thì file được nén gzip.
+    """
+    if stream:
+        return clean_pharmacy_data_streaming(input_file, output_file, boundaries_file, dedup, audit_file,
+                                              precision)
+    
+    boundaries = load_district_boundaries(boundaries_file)
     print(" Đang đọc file dữ liệu gốc...")
     
-    # Đọc file GeoJSON
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # Đọc file GeoJSON (.geojson hoặc .geojson.gz)
+    with span("clean.load") as s:
+        data = load_geojson(input_file)
+        s.items = len(data['features'])
     
     print(f" Tổng số features: {len(data['features'])}")
     
     # Lọc và làm sạch dữ liệu
-    clean_pharmacies = []
-    pharmacy_count = 0
-    has_district_count = 0
+    stats = _new_stats()
+    with span("clean.filter") as s:
+        clean_pharmacies = list(_clean_features(data['features'], stats, boundaries))
+        s.items = stats['total']
+    if dedup:
+        with span("clean.dedup", items=len(clean_pharmacies)):
+            clean_pharmacies, decisions = deduplicate(clean_pharmacies)
+            _remove_duplicates(decisions, stats, audit_file)
+    _print_stats(stats)
     
-    for feature in data['features']:
-        if is_pharmacy(feature.get('properties', {})):
-            pharmacy_count += 1
-            clean_feature = extract_pharmacy_info(feature)
-            
-            # Chỉ giữ lại các hiệu thuốc có quận hợp lệ
-            if clean_feature['properties']['district']:
-                has_district_count += 1
-                clean_pharmacies.append(clean_feature)
+    # Lưu file: JSON gọn, mỗi dòng một hiệu thuốc, tọa độ 7 chữ số thập phân
+    print(f"\n Đang lưu file {Path(output_file).name}...")
+    with span("clean.write", items=len(clean_pharmacies)) as s:
+        with FeatureCollectionWriter(output_file, precision) as writer:
+            # Cache dạng cột lấy tọa độ đã làm tròn, khớp với file vừa ghi
+            written = [writer.write(clean_feature) for clean_feature in clean_pharmacies]
+        s.output(output_file)
+    with span("clean.cache", items=len(written)):
+        write_cache(written, output_file)
     
-    print(f" Số hiệu thuốc tìm thấy: {pharmacy_count}")
-    print(f" Số hiệu thuốc có thông tin quận hợp lệ: {has_district_count}")
+    print(f" Hoàn thành! File đã được lưu tại: {output_file}")
+    print(f" Tổng số hiệu thuốc sau khi làm sạch: {len(clean_pharmacies)}")
+    return stats
+
+
+def clean_pharmacy_data_streaming(input_file=INPUT_FILE, output_file=OUTPUT_FILE,
+                                  boundaries_file=DISTRICT_BOUNDARIES_FILE, dedup=True,
+                                  audit_file=AUDIT_FILE, precision=COORD_PRECISION):
+    """Làm sạch dữ liệu theo kiểu streaming: đọc, lọc và ghi từng feature một
+
+    Việc gộp bản ghi trùng là một lượt đọc thêm trên file kết quả, chỉ giữ tọa độ,
+    tên và số điện thoại trong bộ nhớ.
+    """
+    boundaries = load_district_boundaries(boundaries_file)
+    print(" Đang đọc file dữ liệu gốc (streaming)...")
     
-    # Thống kê các quận
-    district_count = {}
-    for pharmacy in clean_pharmacies:
-        district = pharmacy['properties']['district']
-        district_count[district] = district_count.get(district, 0) + 1
+    stats = _new_stats()
+    with span("clean.stream") as s, FeatureCollectionWriter(output_file, precision) as writer:
+        for clean_feature in _clean_features(iter_geojson_features(input_file), stats, boundaries):
+            writer.write(clean_feature)
+        s.items = stats['total']
+        s.output(output_file)
+    if dedup:
+        with span("clean.dedup", items=writer.count):
+            _remove_duplicates(deduplicate_file(output_file), stats, audit_file)
+    with span("clean.cache", items=writer.count):
+        build_cache(output_file)
     
-    print("\n Thống kê theo quận/huyện:")
-    for district in sorted(district_count.keys()):
-        print(f"   {district}: {district_count[district]} hiệu thuốc")
+    print(f" Tổng số features: {stats['total']}")
+    _print_stats(stats)
+    print(f"\n Hoàn thành! File đã được lưu tại: {output_file}")
+    print(f" Tổng số hiệu thuốc sau khi làm sạch: {writer.count - stats['duplicates']}")
+    return stats
+
+
+def feature_hash(feature):
+    """Mã băm nội dung của một feature gốc (không phụ thuộc thứ tự khóa)"""
+    payload = json.dumps(feature, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _cleaner_fingerprint(boundaries_file, dedup=True, precision=COORD_PRECISION):
+    """Dấu vân tay của cấu hình làm sạch: mã nguồn, file ranh giới, tham số so khớp
+
+    Khi dấu vân tay thay đổi, kết quả cũ không còn đúng và phải làm sạch lại toàn bộ.
+    """
+    scripts_dir = Path(__file__).parent
+    parts = [file_digest(scripts_dir / name)
+             for name in ("data_cleaning.py", "district_normalizer.py", "district_boundaries.py",
+                          "deduplication.py", "geometry.py", "geojson_io.py")]
+    parts.append(file_digest(boundaries_file))
+    parts.append(str(_district_normalizer.max_distance))
+    parts.append(str(dedup))
+    parts.append(str(precision))
+    return hashlib.sha1("|".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def _load_state(state_file, output_file, fingerprint):
+    """Đọc trạng thái lần chạy trước; None nếu không dùng được"""
+    if not Path(state_file).exists() or not Path(output_file).exists():
+        return None
+    with open(state_file, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get('fingerprint') != fingerprint or state.get('output') != str(output_file):
+        return None
+    return state
+
+
+def _save_state(state_file, output_file, fingerprint, hashes, duplicates):
+    state_file = Path(state_file)
+    tmp_path = state_file.with_name(state_file.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint, 'output': str(output_file), 'features': hashes,
+                   'duplicates': duplicates},
+                  f, ensure_ascii=False, separators=(',', ':'))
+    tmp_path.replace(state_file)
+
+
+def clean_pharmacy_data_incremental(input_file=INPUT_FILE, output_file=OUTPUT_FILE,
+                                    state_file=STATE_FILE, boundaries_file=DISTRICT_BOUNDARIES_FILE,
+                                    dedup=True, audit_file=AUDIT_FILE, precision=COORD_PRECISION):
+    """Làm sạch tăng dần: chỉ xử lý lại các hiệu thuốc được thêm, sửa hoặc xóa
+
+    File trạng thái lưu mã băm nội dung của từng hiệu thuốc theo id OSM. Các hiệu
+    thuốc không đổi được giữ nguyên từ file kết quả cũ; nếu chưa có trạng thái hợp lệ
+    (lần chạy đầu, đổi mã nguồn hoặc file ranh giới) thì làm sạch toàn bộ.
+
+    Trạng thái cũng lưu các cặp gộp trùng (id bị bỏ -> id được giữ): khi bản ghi được
+    giữ bị sửa hoặc xóa, bản ghi đã bị bỏ được làm sạch và xét trùng lại.
+    """
+    fingerprint = _cleaner_fingerprint(boundaries_file, dedup, precision)
+    state = _load_state(state_file, output_file, fingerprint)
+    if state is None:
+        print(" Chưa có trạng thái hợp lệ, làm sạch toàn bộ...")
+        state = {}
+    old_hashes = state.get('features', {})
+    duplicates = state.get('duplicates', {})
+    print(" Đang đọc file dữ liệu gốc (tăng dần)...")
     
-    # Tạo GeoJSON mới
-    clean_geojson = {
-        "type": "FeatureCollection",
-        "features": clean_pharmacies
-    }
+    # So sánh mã băm để tìm các hiệu thuốc thêm mới/thay đổi
+    hashes = {}
+    changed = []
+    duplicate_features = {}
+    total = 0
+    with span("clean.diff") as s:
+        for feature in iter_geojson_features(input_file):
+            total += 1
+            if not is_pharmacy(feature.get('properties', {})):
+                continue
+            osm_id = get_osm_id(feature)
+            if osm_id is None:
+                print(" Có hiệu thuốc không có id OSM, chuyển sang làm sạch toàn bộ")
+                return clean_pharmacy_data_streaming(input_file, output_file, boundaries_file, dedup,
+                                                     audit_file, precision)
+            h = feature_hash(feature)
+            hashes[osm_id] = h
+            if old_hashes.get(osm_id) != h:
+                changed.append(feature)
+            elif osm_id in duplicates:
+                duplicate_features[osm_id] = feature
+        s.items = total
+    deleted = old_hashes.keys() - hashes.keys()
+    changed_ids = {get_osm_id(feature) for feature in changed}
+    added = len(changed_ids - old_hashes.keys())
+    print(f" Tổng số features: {total}")
+    print(f" Thêm mới: {added}, thay đổi: {len(changed_ids) - added}, xóa: {len(deleted)}, "
+          f"không đổi: {len(hashes) - len(changed_ids)}")
     
-    # Lưu file
-    print(f"\n Đang lưu file clean_pharmacy.geojson...")
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(clean_geojson, f, ensure_ascii=False, indent=2)
+    # Bản ghi trùng đã bị bỏ mà bản ghi được giữ nay bị sửa/xóa: xét lại như bản ghi mới
+    revisit = [osm_id for osm_id, kept_id in duplicates.items()
+               if osm_id in duplicate_features and (kept_id in deleted or kept_id in changed_ids)]
+    if revisit:
+        print(f" Xét trùng lại {len(revisit)} bản ghi đã gộp trước đây")
+        changed.extend(duplicate_features[osm_id] for osm_id in revisit)
+        changed_ids.update(revisit)
+    duplicates = {osm_id: kept_id for osm_id, kept_id in duplicates.items()
+                  if osm_id in hashes and osm_id not in changed_ids}
     
-    print(f" Hoàn thành! File đã được lưu tại: {OUTPUT_FILE}")
-    print(f" Tổng số hiệu thuốc sau khi làm sạch: {len(clean_pharmacies)}")
+    if old_hashes and not changed and not deleted:
+        # Không có gì thay đổi: giữ nguyên file kết quả, chỉ đếm lại thống kê
+        stats = _new_stats()
+        stats['total'] = total
+        stats['pharmacy'] = len(hashes)
+        for clean_feature in iter_geojson_features(output_file):
+            _count_district(clean_feature, stats)
+        _print_stats(stats)
+        print(f"\n Không có thay đổi, giữ nguyên file: {output_file}")
+        return stats
+    
+    # Chỉ làm sạch lại các hiệu thuốc thêm mới/thay đổi
+    stats = _new_stats()
+    boundaries = load_district_boundaries(boundaries_file) if changed else None
+    with span("clean.reclean", items=len(changed)):
+        recleaned = {f['properties']['osm_id']: f for f in _clean_features(changed, stats, boundaries)}
+    
+    # Vá file kết quả: giữ nguyên bản ghi cũ, thay bản ghi đã sửa, bỏ bản ghi đã xóa
+    stats = _new_stats()
+    stats['total'] = total
+    stats['pharmacy'] = len(hashes)
+    with span("clean.patch") as s, FeatureCollectionWriter(output_file, precision) as writer:
+        old_features = iter_geojson_features(output_file) if old_hashes else ()
+        for clean_feature in old_features:
+            osm_id = clean_feature['properties'].get('osm_id')
+            if osm_id in deleted:
+                continue
+            if osm_id in changed_ids:
+                clean_feature = recleaned.pop(osm_id, None)
+                if clean_feature is None:
+                    continue
+            writer.write(clean_feature)
+            _count_district(clean_feature, stats)
+        # Hiệu thuốc thêm mới được ghi cuối file, theo thứ tự trong file gốc
+        for clean_feature in recleaned.values():
+            writer.write(clean_feature)
+            _count_district(clean_feature, stats)
+        s.items = writer.count
+        s.output(output_file)
+    if dedup:
+        with span("clean.dedup", items=writer.count):
+            decisions = deduplicate_file(output_file)
+            _remove_duplicates(decisions, stats, audit_file)
+        duplicates.update((d['dropped_id'], d['kept_id']) for d in decisions)
+    _save_state(state_file, output_file, fingerprint, hashes, duplicates)
+    with span("clean.cache", items=writer.count):
+        build_cache(output_file)
+    
+    _print_stats(stats)
+    print(f"\n Hoàn thành! File đã được lưu tại: {output_file}")
+    print(f" Tổng số hiệu thuốc sau khi làm sạch: {writer.count - stats['duplicates']}")
+    return stats
+
+
+def main(argv=None):
+    """Hàm chính"""
+    parser = argparse.ArgumentParser(description="Làm sạch dữ liệu hiệu thuốc từ OpenStreetMap")
+    parser.add_argument("--input", type=Path, default=INPUT_FILE, help="File GeoJSON gốc")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE, help="File GeoJSON kết quả")
+    parser.add_argument("--stream", action="store_true",
+                        help="Đọc/ghi từng feature một (cho file xuất cỡ quốc gia)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Chỉ làm sạch lại các hiệu thuốc thêm/sửa/xóa so với lần chạy trước")
+    parser.add_argument("--state", type=Path, default=STATE_FILE, help="File trạng thái cho chế độ tăng dần")
+    parser.add_argument("--boundaries", type=Path, default=DISTRICT_BOUNDARIES_FILE,
+                        help="File GeoJSON ranh giới quận/huyện để gán quận theo vị trí")
+    parser.add_argument("--fuzzy-district", type=int, default=DISTRICT_FUZZY_MAX_DISTANCE, metavar="N",
+                        help="Cho phép tên quận sai tối đa N ký tự (mặc định: tắt)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Không gộp các bản ghi trùng lặp (cùng vị trí, cùng tên/số điện thoại)")
+    parser.add_argument("--precision", type=int, default=COORD_PRECISION, metavar="N",
+                        help=f"Số chữ số thập phân của tọa độ (mặc định {COORD_PRECISION} ~ 1 cm)")
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_from_args(args)
+    
+    if args.fuzzy_district != DISTRICT_FUZZY_MAX_DISTANCE:
+        set_district_normalizer(args.fuzzy_district)
+    with stage("clean") as s:
+        s.output(args.output)
+        if args.incremental:
+            stats = clean_pharmacy_data_incremental(args.input, args.output, args.state, args.boundaries,
+                                                    dedup=not args.no_dedup, precision=args.precision)
+        else:
+            stats = clean_pharmacy_data(args.input, args.output, stream=args.stream,
+                                        boundaries_file=args.boundaries, dedup=not args.no_dedup,
+                                        precision=args.precision)
+        s.items = stats['total']
+    return stats
 
 
 if __name__ == "__main__":
-    clean_pharmacy_data()
+    main()
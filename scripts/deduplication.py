@@ -0,0 +1,213 @@
+"""
+Phát hiện hiệu thuốc trùng lặp / gần trùng trong dữ liệu đã làm sạch
+
+File xuất OSM thường có cùng một hiệu thuốc hai lần (một node và một way của tòa nhà),
+hoặc chi nhánh chuỗi với tên hơi khác nhau. Cách làm:
+- Chặn theo lưới (blocking): điểm được gán vào ô vuông DEDUP_RADIUS_M mét, chỉ so sánh
+  với các điểm trong cùng ô và các ô kề — số phép so sánh gần tuyến tính thay vì mọi cặp.
+- Hai bản ghi cách nhau không quá DEDUP_RADIUS_M được coi là trùng khi tên đã chuẩn hóa
+  (bỏ dấu, bỏ "nhà thuốc", "pharmacy"...) giống nhau đủ mức NAME_SIMILARITY, hoặc có
+  chung số điện thoại, hoặc cả hai đều không có tên và gần như trùng vị trí.
+- Các cặp trùng được gom thành cụm; mỗi cụm giữ bản ghi đầy đủ thông tin nhất.
+- Mọi quyết định gộp được ghi ra file CSV để kiểm tra lại.
+"""
+
+import csv
+import re
+from pathlib import Path
+
+import numpy as np
+
+from density import to_metres
+from distance import haversine
+from district_normalizer import fold_accents, levenshtein
+from geojson_io import FeatureCollectionWriter, iter_geojson_features
+
+AUDIT_FILE = Path(__file__).parent.parent / "results" / "dedup_audit.csv"
+
+# Khoảng cách tối đa giữa hai bản ghi trùng (mét), cũng là kích thước ô lưới chặn
+DEDUP_RADIUS_M = 30
+# Hai bản ghi không tên được coi là trùng nếu cách nhau không quá (mét)
+SAME_POINT_M = 5
+# Độ giống tối thiểu của tên đã chuẩn hóa (1 - khoảng cách chỉnh sửa / độ dài)
+NAME_SIMILARITY = 0.85
+
+# Tên giữ chỗ của bước làm sạch khi hiệu thuốc không có tên
+UNKNOWN_NAMES = {"khong ro ten", "khong ro"}
+
+# Các trường dùng để đánh giá độ đầy đủ của bản ghi
+COMPLETENESS_FIELDS = ("name", "street", "housenumber", "ward", "opening_hours", "phone", "website", "brand")
+
+AUDIT_COLUMNS = ['kept_id', 'dropped_id', 'distance_m', 'kept_name', 'dropped_name',
+                 'name_similarity', 'phone_match', 'reason']
+
+_GENERIC_WORDS = re.compile(r"\b(nha thuoc|hieu thuoc|quay thuoc|tiem thuoc|pharmacy|drugstore|chemist|nt)\b")
+_NON_WORD = re.compile(r"[^\w]+")
+_PHONE_SPLIT = re.compile(r"[;,/]")
+
+
+def normalize_name(name):
+    """Khóa so sánh tên: bỏ dấu, bỏ dấu câu và các từ chung như "nhà thuốc" """
+    folded = fold_accents(name or "")
+    if folded in UNKNOWN_NAMES:
+        return ""
+    key = " ".join(_NON_WORD.sub(" ", folded).split())
+    stripped = " ".join(_GENERIC_WORDS.sub(" ", key).split())
+    # Tên chỉ gồm từ chung ("Nhà thuốc") vẫn giữ nguyên để so sánh
+    return stripped or key
+
+
+def normalize_phones(phone):
+    """Tập số điện thoại đã chuẩn hóa (9 chữ số cuối, bỏ mã quốc gia +84)"""
+    phones = set()
+    for part in _PHONE_SPLIT.split(phone or ""):
+        digits = re.sub(r"\D", "", part)
+        if len(digits) >= 8:
+            phones.add(digits[-9:])
+    return phones
+
+
+def name_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    return 1.0 - levenshtein(a, b) / max(len(a), len(b))
+
+
+def feature_record(feature):
+    """Thông tin tối thiểu của một feature cho việc so sánh"""
+    props = feature.get('properties') or {}
+    geometry = feature.get('geometry') or {}
+    coords = geometry.get('coordinates') or []
+    if geometry.get('type') != 'Point' or len(coords) < 2:
+        coords = (float('nan'), float('nan'))
+    name_key = normalize_name(props.get('name'))
+    # Tên giữ chỗ "Không rõ tên" không được tính là có thông tin
+    completeness = sum(1 for field in COMPLETENESS_FIELDS if field != 'name' and props.get(field))
+    return {
+        'osm_id': props.get('osm_id') or "",
+        'name': props.get('name') or "",
+        'name_key': name_key,
+        'phones': normalize_phones(props.get('phone')),
+        'district': props.get('district'),
+        'completeness': completeness + bool(name_key),
+        'lon': coords[0],
+        'lat': coords[1],
+    }
+
+
+def _candidate_pairs(records, radius_m):
+    """Các cặp (i, j), i < j, nằm trong cùng ô lưới hoặc ô kề (chặn theo lưới)"""
+    lons = np.array([r['lon'] for r in records], dtype=np.float64)
+    lats = np.array([r['lat'] for r in records], dtype=np.float64)
+    xs, ys = to_metres(lons, lats)
+    valid = np.isfinite(xs) & np.isfinite(ys)
+    cells = {}
+    for i, cx, cy in zip(np.flatnonzero(valid).tolist(),
+                         np.floor(xs[valid] / radius_m).astype(np.int64).tolist(),
+                         np.floor(ys[valid] / radius_m).astype(np.int64).tolist()):
+        cells.setdefault((cx, cy), []).append(i)
+    # Mỗi cặp ô kề chỉ xét một lần: chính nó và 4 ô "phía trước"
+    for (cx, cy), members in cells.items():
+        for k, i in enumerate(members):
+            for j in members[k + 1:]:
+                yield i, j
+        for dx, dy in ((1, -1), (1, 0), (1, 1), (0, 1)):
+            for j in cells.get((cx + dx, cy + dy), ()):
+                for i in members:
+                    yield (i, j) if i < j else (j, i)
+
+
+def _match(a, b, radius_m):
+    """Lý do hai bản ghi trùng nhau (None nếu không trùng), kèm khoảng cách và độ giống tên"""
+    dist = haversine(a['lon'], a['lat'], b['lon'], b['lat'])
+    if dist > radius_m:
+        return None, dist, 0.0
+    similarity = name_similarity(a['name_key'], b['name_key'])
+    if similarity >= NAME_SIMILARITY:
+        return "name", dist, similarity
+    if a['phones'] & b['phones']:
+        return "phone", dist, similarity
+    if not a['name_key'] and not b['name_key'] and dist <= SAME_POINT_M:
+        return "same_point", dist, similarity
+    return None, dist, similarity
+
+
+def find_duplicates(records, radius_m=DEDUP_RADIUS_M):
+    """Quyết định gộp: danh sách dict (kept, dropped là chỉ số bản ghi, cùng thông tin kiểm tra)"""
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    matches = {}
+    for i, j in _candidate_pairs(records, radius_m):
+        reason, dist, similarity = _match(records[i], records[j], radius_m)
+        if reason is None:
+            continue
+        matches[(i, j)] = (reason, dist, similarity)
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    clusters = {}
+    for i, j in matches:
+        clusters.setdefault(find(i), set()).update((i, j))
+
+    decisions = []
+    for members in clusters.values():
+        # Giữ bản ghi đầy đủ nhất; hòa thì giữ bản ghi xuất hiện trước
+        kept = max(sorted(members), key=lambda i: (records[i]['completeness'], -i))
+        for dropped in sorted(members - {kept}):
+            a, b = records[kept], records[dropped]
+            reason, dist, similarity = matches.get((min(kept, dropped), max(kept, dropped))) or \
+                ("cluster",) + _match(a, b, float('inf'))[1:]
+            decisions.append({
+                'kept': kept, 'dropped': dropped,
+                'kept_id': a['osm_id'], 'dropped_id': b['osm_id'],
+                'distance_m': round(dist, 1),
+                'kept_name': a['name'], 'dropped_name': b['name'],
+                'name_similarity': round(similarity, 3),
+                'phone_match': bool(a['phones'] & b['phones']),
+                'reason': reason,
+                'dropped_district': b['district'],
+            })
+    decisions.sort(key=lambda d: d['dropped'])
+    return decisions
+
+
+def deduplicate(features, radius_m=DEDUP_RADIUS_M):
+    """Bỏ bản ghi trùng khỏi danh sách feature; trả về (feature giữ lại, quyết định gộp)"""
+    decisions = find_duplicates([feature_record(f) for f in features], radius_m)
+    dropped = {d['dropped'] for d in decisions}
+    return [f for i, f in enumerate(features) if i not in dropped], decisions
+
+
+def deduplicate_file(path, radius_m=DEDUP_RADIUS_M):
+    """Bỏ bản ghi trùng khỏi file GeoJSON (đọc/ghi streaming); trả về quyết định gộp
+
+    File chỉ được ghi lại khi có bản ghi trùng.
+    """
+    decisions = find_duplicates([feature_record(f) for f in iter_geojson_features(path)], radius_m)
+    if decisions:
+        dropped = {d['dropped'] for d in decisions}
+        # Tọa độ đã được làm tròn khi ghi file lần đầu, giữ nguyên khi ghi lại
+        with FeatureCollectionWriter(path, precision=None) as writer:
+            for i, feature in enumerate(iter_geojson_features(path)):
+                if i not in dropped:
+                    writer.write(feature)
+    return decisions
+
+
+def write_audit(decisions, path=AUDIT_FILE):
+    """Ghi các quyết định gộp ra CSV để kiểm tra"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=AUDIT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(decisions)
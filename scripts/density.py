@@ -0,0 +1,239 @@
+"""
+Lưới mật độ hiệu thuốc (hexbin / ô vuông) và bề mặt mật độ nhân (KDE)
+
+Tính trước từ clean_pharmacy.geojson để bản đồ hiển thị điểm nóng bằng lớp heatmap
+thay vì vẽ từng hiệu thuốc ở mức zoom thấp:
+- results/density_grid.geojson: ô lục giác (hoặc ô vuông) ở nhiều độ phân giải
+  (DENSITY_RESOLUTIONS_M), mỗi ô có số hiệu thuốc và mật độ trên km²; chỉ ghi ô khác 0.
+- results/density_kde.npz: raster KDE Gaussian (float32, hiệu thuốc/km²) kèm gốc tọa độ
+  và kích thước ô — map_visualization đọc file này để vẽ heatmap.
+
+Gán ô được vector hóa bằng NumPy; KDE là tích chập Gaussian tách được (theo hàng rồi
+theo cột) trên lưới đếm.
+"""
+
+import argparse
+import math
+from pathlib import Path
+
+import numpy as np
+
+from aggregation import GRID_ORIGIN_LAT, METERS_PER_DEGREE
+from columnar_cache import load_table
+from geojson_io import dumps, open_text
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+GRID_FILE = Path(__file__).parent.parent / "results" / "density_grid.geojson"
+KDE_FILE = Path(__file__).parent.parent / "results" / "density_kde.npz"
+
+# Các độ phân giải lưới (mét): với lục giác là bán kính ngoại tiếp, với ô vuông là cạnh
+DENSITY_RESOLUTIONS_M = (250, 500, 1000, 2000)
+DENSITY_SHAPE = "hex"
+
+# KDE: kích thước ô raster và độ rộng nhân Gaussian (mét)
+KDE_CELL_M = 100
+KDE_BANDWIDTH_M = 400
+# Số ô raster tối đa; vượt quá thì tự tăng kích thước ô (dữ liệu toàn quốc)
+KDE_MAX_CELLS = 4_000_000
+
+# Heatmap: bỏ các ô có mật độ dưới tỉ lệ này của giá trị lớn nhất, giới hạn số điểm
+HEAT_MIN_FRACTION = 0.05
+HEAT_MAX_POINTS = 20000
+
+_KX = METERS_PER_DEGREE * math.cos(math.radians(GRID_ORIGIN_LAT))
+_KY = METERS_PER_DEGREE
+
+
+def to_metres(lons, lats):
+    """Tọa độ phẳng (mét) theo phép chiếu equirectangular, cùng gốc với lưới thống kê"""
+    return np.asarray(lons, dtype=np.float64) * _KX, np.asarray(lats, dtype=np.float64) * _KY
+
+
+def to_lonlat(xs, ys):
+    return np.asarray(xs) / _KX, np.asarray(ys) / _KY
+
+
+def hex_cells(xs, ys, size_m):
+    """Ô lục giác (đỉnh nhọn hướng lên) chứa từng điểm: mảng (q, r) tọa độ trục"""
+    q = (math.sqrt(3) / 3 * xs - ys / 3) / size_m
+    r = (2 / 3 * ys) / size_m
+    # Làm tròn tọa độ khối (cube rounding)
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def _hex_polygon(q, r, size_m):
+    cx = size_m * math.sqrt(3) * (q + r / 2)
+    cy = size_m * 1.5 * r
+    angles = np.radians(30 + 60 * np.arange(7))
+    return to_lonlat(cx + size_m * np.cos(angles), cy + size_m * np.sin(angles))
+
+
+def _square_polygon(i, j, size_m):
+    xs = np.array([i, i + 1, i + 1, i, i]) * size_m
+    ys = np.array([j, j, j + 1, j + 1, j]) * size_m
+    return to_lonlat(xs, ys)
+
+
+def bin_counts(xs, ys, size_m, shape=DENSITY_SHAPE):
+    """Đếm số điểm trong từng ô khác 0: trả về (mảng chỉ số ô (k, 2), số lượng)"""
+    if shape == "hex":
+        a, b = hex_cells(xs, ys, size_m)
+    else:
+        a = np.floor(xs / size_m).astype(np.int64)
+        b = np.floor(ys / size_m).astype(np.int64)
+    cells, counts = np.unique(np.stack([a, b], axis=1), axis=0, return_counts=True)
+    return cells, counts
+
+
+def cell_area_km2(size_m, shape=DENSITY_SHAPE):
+    if shape == "hex":
+        return 3 * math.sqrt(3) / 2 * size_m ** 2 / 1e6
+    return size_m ** 2 / 1e6
+
+
+def density_grid(lons, lats, resolutions=DENSITY_RESOLUTIONS_M, shape=DENSITY_SHAPE):
+    """FeatureCollection các ô mật độ khác 0 ở mọi độ phân giải"""
+    xs, ys = to_metres(lons, lats)
+    polygon = _hex_polygon if shape == "hex" else _square_polygon
+    features = []
+    for size_m in resolutions:
+        cells, counts = bin_counts(xs, ys, size_m, shape)
+        area = cell_area_km2(size_m, shape)
+        for (a, b), count in zip(cells.tolist(), counts.tolist()):
+            ring_lons, ring_lats = polygon(a, b, size_m)
+            features.append({
+                "type": "Feature",
+                "properties": {"resolution_m": size_m, "shape": shape, "count": count,
+                               "per_km2": round(count / area, 3)},
+                "geometry": {"type": "Polygon",
+                             "coordinates": [[[round(x, 6), round(y, 6)]
+                                              for x, y in zip(ring_lons.tolist(), ring_lats.tolist())]]},
+            })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _gaussian_kernel(sigma_cells):
+    radius = max(1, int(math.ceil(3 * sigma_cells)))
+    offsets = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 * (offsets / sigma_cells) ** 2)
+    return weights / weights.sum()
+
+
+def _convolve_axis(grid, kernel, axis):
+    """Tích chập 1 chiều theo một trục (cộng các bản dịch chuyển có trọng số)"""
+    radius = len(kernel) // 2
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (radius, radius)
+    padded = np.pad(grid, pad)
+    out = np.zeros_like(grid)
+    n = grid.shape[axis]
+    for k, weight in enumerate(kernel):
+        out += weight * (padded[k:k + n, :] if axis == 0 else padded[:, k:k + n])
+    return out
+
+
+def kde_surface(lons, lats, cell_m=KDE_CELL_M, bandwidth_m=KDE_BANDWIDTH_M, max_cells=KDE_MAX_CELLS):
+    """Raster mật độ nhân Gaussian (hiệu thuốc/km²)
+
+    Trả về (raster float32 [hàng = y, cột = x], gốc (x0, y0) mét, kích thước ô mét).
+    """
+    xs, ys = to_metres(lons, lats)
+    margin = 3 * bandwidth_m
+    x0, y0 = xs.min() - margin, ys.min() - margin
+    width, height = xs.max() + margin - x0, ys.max() + margin - y0
+    # Tăng kích thước ô nếu raster quá lớn
+    cells = math.ceil(width / cell_m) * math.ceil(height / cell_m)
+    if cells > max_cells:
+        cell_m = math.ceil(cell_m * math.sqrt(cells / max_cells))
+        print(f"   Raster quá lớn, dùng ô {cell_m}m")
+    nx, ny = math.ceil(width / cell_m) + 1, math.ceil(height / cell_m) + 1
+
+    ix = ((xs - x0) // cell_m).astype(np.int64)
+    iy = ((ys - y0) // cell_m).astype(np.int64)
+    grid = np.bincount(iy * nx + ix, minlength=nx * ny).reshape(ny, nx).astype(np.float64)
+
+    kernel = _gaussian_kernel(bandwidth_m / cell_m)
+    grid = _convolve_axis(_convolve_axis(grid, kernel, 0), kernel, 1)
+    grid /= (cell_m / 1000.0) ** 2
+    return grid.astype(np.float32), (x0, y0), cell_m
+
+
+def save_kde(path, raster, origin, cell_m, bandwidth_m):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, raster=raster, origin=np.array(origin), cell_m=cell_m,
+                        bandwidth_m=bandwidth_m)
+
+
+def heat_points(path=KDE_FILE, min_fraction=HEAT_MIN_FRACTION, max_points=HEAT_MAX_POINTS):
+    """Điểm [lat, lon, trọng số 0..1] cho lớp heatmap từ raster KDE (None nếu chưa tính)"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        raster, (x0, y0), cell_m = data['raster'], data['origin'], float(data['cell_m'])
+    peak = float(raster.max()) if raster.size else 0.0
+    if peak <= 0:
+        return []
+    flat = raster.ravel()
+    keep = np.flatnonzero(flat >= peak * min_fraction)
+    if len(keep) > max_points:
+        keep = keep[np.argpartition(flat[keep], -max_points)[-max_points:]]
+    iy, ix = np.divmod(keep, raster.shape[1])
+    lons, lats = to_lonlat(x0 + (ix + 0.5) * cell_m, y0 + (iy + 0.5) * cell_m)
+    weights = flat[keep] / peak
+    return [[round(lat, 6), round(lon, 6), round(w, 3)]
+            for lat, lon, w in zip(lats.tolist(), lons.tolist(), weights.tolist())]
+
+
+def build_density(data_file=DATA_FILE, grid_file=GRID_FILE, kde_file=KDE_FILE,
+                  resolutions=DENSITY_RESOLUTIONS_M, shape=DENSITY_SHAPE,
+                  cell_m=KDE_CELL_M, bandwidth_m=KDE_BANDWIDTH_M):
+    """Tính lưới mật độ và raster KDE rồi ghi ra file"""
+    table = load_table(data_file)
+    lons = np.asarray(table.lon, dtype=np.float64)
+    lats = np.asarray(table.lat, dtype=np.float64)
+    valid = np.isfinite(lons) & np.isfinite(lats)
+    lons, lats = lons[valid], lats[valid]
+    print(f" Đang tính mật độ cho {len(lons)} hiệu thuốc...")
+
+    grid = density_grid(lons, lats, resolutions, shape)
+    Path(grid_file).parent.mkdir(parents=True, exist_ok=True)
+    with open_text(grid_file, 'w') as f:
+        f.write(dumps(grid))
+    print(f" Đã lưu lưới mật độ: {grid_file} ({len(grid['features'])} ô)")
+
+    if not len(lons):
+        return grid, None
+    raster, origin, used_cell = kde_surface(lons, lats, cell_m, bandwidth_m)
+    save_kde(kde_file, raster, origin, used_cell, bandwidth_m)
+    print(f" Đã lưu raster KDE: {kde_file} ({raster.shape[1]}x{raster.shape[0]} ô {used_cell}m, "
+          f"mật độ lớn nhất {raster.max():.1f}/km²)")
+    return grid, raster
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tính lưới mật độ và bề mặt KDE của hiệu thuốc")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File GeoJSON hiệu thuốc đã làm sạch")
+    parser.add_argument("--shape", choices=("hex", "square"), default=DENSITY_SHAPE, help="Hình dạng ô lưới")
+    parser.add_argument("--resolutions", type=int, nargs='+', default=list(DENSITY_RESOLUTIONS_M),
+                        help="Các độ phân giải lưới (mét)")
+    parser.add_argument("--kde-cell", type=int, default=KDE_CELL_M, help="Kích thước ô raster KDE (mét)")
+    parser.add_argument("--bandwidth", type=int, default=KDE_BANDWIDTH_M, help="Độ rộng nhân Gaussian (mét)")
+    parser.add_argument("--grid-output", type=Path, default=GRID_FILE)
+    parser.add_argument("--kde-output", type=Path, default=KDE_FILE)
+    args = parser.parse_args(argv)
+
+    build_density(args.data, args.grid_output, args.kde_output, args.resolutions, args.shape,
+                  args.kde_cell, args.bandwidth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Tính khoảng cách Haversine theo lô bằng NumPy
+
+Đây là lõi tính khoảng cách dùng chung cho phân tích buffer, chỉ mục không gian
+và các phân tích độ phủ. Thay vì gọi haversine() cho từng cặp điểm, các hàm ở đây
+nhận mảng điểm truy vấn (M điểm) và mảng hiệu thuốc (N điểm), tính toán bằng
+broadcasting và chia ma trận M×N thành các khối để bộ nhớ luôn bị giới hạn.
+"""
+
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000  # Bán kính của trái đất tính bằng mét
+
+# Số phần tử tối đa của một khối ma trận khoảng cách (~32 MB cho mỗi mảng float64)
+MAX_BLOCK_CELLS = 4_000_000
+
+
+# Công thức Haversine để tính khoảng cách giữa hai điểm vĩ độ/kinh độ (tính bằng mét)
+def haversine(lon1, lat1, lon2, lat2):
+    # chuyển đổi độ thập phân sang radian
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    # công thức haversine
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+    r = EARTH_RADIUS_M
+    return c * r
+
+
+def haversine_np(lon1, lat1, lon2, lat2):
+    """Haversine theo từng phần tử, hỗ trợ broadcasting của NumPy (đơn vị mét)"""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=np.float64))
+                              for v in (lon1, lat1, lon2, lat2))
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class HaversineEngine:
+    """Tập điểm hiệu thuốc đã tiền xử lý (radian, cos vĩ độ) cho truy vấn theo lô"""
+
+    def __init__(self, lons, lats, max_block_cells=MAX_BLOCK_CELLS):
+        self.lons = np.ascontiguousarray(lons, dtype=np.float64)
+        self.lats = np.ascontiguousarray(lats, dtype=np.float64)
+        if self.lons.shape != self.lats.shape or self.lons.ndim != 1:
+            raise ValueError("lons và lats phải là mảng 1 chiều cùng độ dài")
+        self.max_block_cells = max_block_cells
+        self._lon_rad = np.radians(self.lons)
+        self._lat_rad = np.radians(self.lats)
+        self._cos_lat = np.cos(self._lat_rad)
+
+    def __len__(self):
+        return len(self.lons)
+
+    def _rows_per_block(self, n_cols):
+        return max(1, self.max_block_cells // max(1, n_cols))
+
+    def _block(self, q_lon_rad, q_lat_rad, q_cos_lat, cols=None):
+        """Ma trận khoảng cách (mét) giữa một khối điểm truy vấn và các hiệu thuốc"""
+        lon_rad, lat_rad, cos_lat = self._lon_rad, self._lat_rad, self._cos_lat
+        if cols is not None:
+            lon_rad, lat_rad, cos_lat = lon_rad[cols], lat_rad[cols], cos_lat[cols]
+        a = np.sin((lat_rad[None, :] - q_lat_rad[:, None]) / 2) ** 2
+        a += (q_cos_lat[:, None] * cos_lat[None, :]
+              * np.sin((lon_rad[None, :] - q_lon_rad[:, None]) / 2) ** 2)
+        np.minimum(a, 1.0, out=a)
+        np.sqrt(a, out=a)
+        np.arcsin(a, out=a)
+        a *= 2 * EARTH_RADIUS_M
+        return a
+
+    def iter_blocks(self, q_lons, q_lats, cols=None):
+        """Sinh lần lượt (chỉ số hàng bắt đầu, khối khoảng cách) theo từng khối hàng"""
+        q_lons = np.atleast_1d(np.asarray(q_lons, dtype=np.float64))
+        q_lats = np.atleast_1d(np.asarray(q_lats, dtype=np.float64))
+        q_lon_rad, q_lat_rad = np.radians(q_lons), np.radians(q_lats)
+        q_cos_lat = np.cos(q_lat_rad)
+        n_cols = len(self) if cols is None else len(cols)
+        step = self._rows_per_block(n_cols)
+        for start in range(0, len(q_lons), step):
+            stop = start + step
+            yield start, self._block(q_lon_rad[start:stop], q_lat_rad[start:stop],
+                                     q_cos_lat[start:stop], cols)
+
+    def distances(self, q_lons, q_lats, cols=None):
+        """Ma trận khoảng cách đầy đủ M×N (chỉ nên dùng khi M×N vừa bộ nhớ)"""
+        q_lons = np.atleast_1d(np.asarray(q_lons, dtype=np.float64))
+        n_cols = len(self) if cols is None else len(cols)
+        out = np.empty((len(q_lons), n_cols), dtype=np.float64)
+        for start, block in self.iter_blocks(q_lons, q_lats, cols):
+            out[start:start + len(block)] = block
+        return out
+
+    def within(self, q_lons, q_lats, radius):
+        """Các cặp (điểm truy vấn, hiệu thuốc) cách nhau không quá radius mét
+
+        radius có thể là một số hoặc một mảng bán kính cho từng điểm truy vấn.
+        Trả về kết quả thưa dạng ba mảng (chỉ số truy vấn, chỉ số hiệu thuốc,
+        khoảng cách), sắp xếp theo chỉ số truy vấn rồi chỉ số hiệu thuốc.
+        """
+        q_lons = np.atleast_1d(np.asarray(q_lons, dtype=np.float64))
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), q_lons.shape)
+        rows, cols, dists = [], [], []
+        for start, block in self.iter_blocks(q_lons, q_lats):
+            r = radius[start:start + len(block), None]
+            qi, pj = np.nonzero(block <= r)
+            rows.append(qi + start)
+            cols.append(pj)
+            dists.append(block[qi, pj])
+        if not rows:
+            empty = np.empty(0, dtype=np.intp)
+            return empty, empty.copy(), np.empty(0, dtype=np.float64)
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+
+    def nearest(self, q_lons, q_lats, k=1):
+        """k hiệu thuốc gần nhất cho mỗi điểm truy vấn
+
+        Trả về (chỉ số, khoảng cách) dạng mảng M×k, mỗi hàng sắp xếp tăng dần.
+        """
+        q_lons = np.atleast_1d(np.asarray(q_lons, dtype=np.float64))
+        k = min(k, len(self))
+        idx = np.empty((len(q_lons), k), dtype=np.intp)
+        dist = np.empty((len(q_lons), k), dtype=np.float64)
+        if k == 0:
+            return idx, dist
+        for start, block in self.iter_blocks(q_lons, q_lats):
+            stop = start + len(block)
+            if k < block.shape[1]:
+                part = np.argpartition(block, k - 1, axis=1)[:, :k]
+            else:
+                part = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+            part_dist = np.take_along_axis(block, part, axis=1)
+            order = np.lexsort((part, part_dist), axis=1)
+            idx[start:stop] = np.take_along_axis(part, order, axis=1)
+            dist[start:stop] = np.take_along_axis(part_dist, order, axis=1)
+        return idx, dist
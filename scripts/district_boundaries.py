@@ -0,0 +1,141 @@
+"""
+Gán quận/huyện cho hiệu thuốc theo ranh giới hành chính (point-in-polygon)
+
+Đọc file GeoJSON ranh giới quận/huyện (Polygon/MultiPolygon), sau đó xác định
+mỗi điểm nằm trong quận nào. Thẻ addr:district chỉ còn dùng làm phương án dự phòng
+khi điểm nằm ngoài mọi ranh giới, hoặc để đối chiếu.
+
+Để xử lý hàng trăm nghìn điểm nhanh:
+- Lọc sơ bộ bằng hộp bao (bounding box) của từng đa giác, tính theo lô bằng NumPy.
+- Chỉ các điểm nằm trong hộp bao mới được kiểm tra bằng thuật toán ray casting,
+  vector hóa trên các cặp (điểm, cạnh) có khoảng vĩ độ chồng nhau.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from geojson_io import load_geojson
+
+# File ranh giới quận/huyện Hà Nội (GeoJSON, mỗi feature là một quận/huyện)
+DISTRICT_BOUNDARIES_FILE = Path(__file__).parent.parent / "data" / "hanoi_districts.geojson"
+
+# Các thuộc tính có thể chứa tên quận/huyện trong file ranh giới
+NAME_PROPERTIES = ("district", "name", "name:vi", "NAME_2", "ten_huyen")
+
+# Số cặp (điểm, cạnh) tối đa trong một lần tính
+MAX_BLOCK_CELLS = 2_000_000
+
+
+def polygon_rings(geometry):
+    """Danh sách các đa giác, mỗi đa giác là danh sách vòng (ring) dạng mảng (k, 2)"""
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates", [])
+    if gtype == "Polygon":
+        polygons = [coords]
+    elif gtype == "MultiPolygon":
+        polygons = coords
+    else:
+        return []
+    return [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon if len(ring) >= 3]
+            for polygon in polygons]
+
+
+class DistrictBoundaries:
+    """Tập ranh giới quận/huyện, hỗ trợ gán quận cho nhiều điểm cùng lúc"""
+
+    def __init__(self, features, normalize=None):
+        self.names = []
+        # Mỗi phần (part) là một Polygon đơn: chỉ số tên, hộp bao và mảng cạnh
+        self._part_name = []
+        self._part_bbox = []
+        self._part_edges = []
+        for feature in features:
+            props = feature.get("properties") or {}
+            raw_name = next((props[key] for key in NAME_PROPERTIES if props.get(key)), None)
+            if not raw_name:
+                continue
+            name = (normalize(raw_name) if normalize else None) or raw_name
+            if name not in self.names:
+                self.names.append(name)
+            name_idx = self.names.index(name)
+            for rings in polygon_rings(feature.get("geometry") or {}):
+                if not rings:
+                    continue
+                # Gom tất cả cạnh của các vòng (kể cả lỗ) — quy tắc chẵn/lẻ xử lý lỗ tự động
+                starts = np.concatenate([ring for ring in rings])
+                ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+                outer = rings[0]
+                self._part_name.append(name_idx)
+                self._part_bbox.append((outer[:, 0].min(), outer[:, 1].min(),
+                                        outer[:, 0].max(), outer[:, 1].max()))
+                self._part_edges.append((starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]))
+        self._bbox = np.array(self._part_bbox, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def from_geojson(cls, path=DISTRICT_BOUNDARIES_FILE, normalize=None):
+        """Đọc file GeoJSON ranh giới"""
+        data = load_geojson(path)
+        return cls(data.get("features", []), normalize=normalize)
+
+    def __len__(self):
+        return len(self._part_name)
+
+    @staticmethod
+    def _contains(edges, xs, ys):
+        """Ray casting vector hóa: mảng bool cho biết điểm nào nằm trong đa giác
+
+        Điểm được sắp xếp theo vĩ độ, nhờ đó mỗi cạnh chỉ được ghép với các điểm
+        nằm trong khoảng vĩ độ của nó (tìm bằng searchsorted) thay vì mọi điểm.
+        """
+        x1, y1, x2, y2 = edges
+        order = np.argsort(ys, kind='stable')
+        sorted_ys = ys[order]
+        # Cạnh cắt đường ngang qua điểm khi min(y1, y2) <= y < max(y1, y2)
+        lo = np.searchsorted(sorted_ys, np.minimum(y1, y2), side='left')
+        hi = np.searchsorted(sorted_ys, np.maximum(y1, y2), side='left')
+        counts = hi - lo
+        crossings = np.zeros(len(xs), dtype=np.int64)
+        ends = np.cumsum(counts)
+        start_edge = 0
+        while start_edge < len(counts):
+            # Gom các cạnh sao cho số cặp (điểm, cạnh) trong một lần tính bị giới hạn
+            base = ends[start_edge - 1] if start_edge else 0
+            stop_edge = max(start_edge + 1,
+                            int(np.searchsorted(ends, base + MAX_BLOCK_CELLS, side='right')))
+            edge_ids = np.arange(start_edge, stop_edge)
+            n_pairs = counts[edge_ids]
+            total = int(n_pairs.sum())
+            start_edge = stop_edge
+            if not total:
+                continue
+            pair_edge = np.repeat(edge_ids, n_pairs)
+            offsets = np.cumsum(n_pairs) - n_pairs
+            pair_point = order[lo[pair_edge] + np.arange(total) - np.repeat(offsets, n_pairs)]
+            py = ys[pair_point]
+            ex1, ey1 = x1[pair_edge], y1[pair_edge]
+            x_at = ex1 + (py - ey1) * (x2[pair_edge] - ex1) / (y2[pair_edge] - ey1)
+            # Giao điểm nằm bên phải điểm thì tính là một lần cắt
+            hit = xs[pair_point] < x_at
+            crossings += np.bincount(pair_point[hit], minlength=len(xs))
+        return crossings % 2 == 1
+
+    def assign_codes(self, lons, lats):
+        """Chỉ số quận (theo self.names) cho từng điểm, -1 nếu nằm ngoài mọi ranh giới"""
+        xs = np.asarray(lons, dtype=np.float64)
+        ys = np.asarray(lats, dtype=np.float64)
+        codes = np.full(len(xs), -1, dtype=np.int32)
+        for part, (name_idx, edges) in enumerate(zip(self._part_name, self._part_edges)):
+            min_x, min_y, max_x, max_y = self._bbox[part]
+            # Lọc sơ bộ bằng hộp bao, bỏ qua điểm đã được gán
+            candidates = np.flatnonzero((codes < 0) & (xs >= min_x) & (xs <= max_x)
+                                        & (ys >= min_y) & (ys <= max_y))
+            if not len(candidates):
+                continue
+            hit = self._contains(edges, xs[candidates], ys[candidates])
+            codes[candidates[hit]] = name_idx
+        return codes
+
+    def assign(self, lons, lats):
+        """Tên quận cho từng điểm (None nếu nằm ngoài mọi ranh giới)"""
+        return [self.names[c] if c >= 0 else None for c in self.assign_codes(lons, lats).tolist()]
@@ -0,0 +1,146 @@
+"""
+Chuẩn hóa tên quận/huyện
+
+DistrictNormalizer xây bảng tra cứu một lần từ danh sách tên chuẩn, sau đó:
+- Chuẩn hóa Unicode (NFC/NFD đều được) và bỏ dấu tiếng Việt, nên "Đống Đa",
+  "dong da" và chuỗi NFD đều khớp cùng một khóa.
+- Bỏ tiền tố/hậu tố hành chính: "Quận", "Q.", "Huyện", "Thị xã", "District", "Hà Nội"...
+- Ghi nhớ (LRU cache) các chuỗi thô đã gặp — file xuất lặp lại vài trăm giá trị
+  trên hàng triệu dòng — và báo cáo tỉ lệ trúng cache.
+- Tùy chọn so khớp gần đúng theo khoảng cách chỉnh sửa (Levenshtein) qua BK-tree.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# Số chuỗi thô tối đa được ghi nhớ
+CACHE_SIZE = 4096
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+_PREFIX = re.compile(r"^(quan|huyen|thi xa|tx|q|h)\s+")
+_SUFFIX = re.compile(r"\s+(district|town|urban district|(thanh pho |tp )?ha ?noi|hanoi city)$")
+
+
+def fold_accents(text):
+    """Bỏ dấu tiếng Việt, chuyển về chữ thường và gom khoảng trắng"""
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    stripped = stripped.replace("đ", "d").replace("Đ", "D")
+    return _SPACES.sub(" ", stripped.lower()).strip()
+
+
+def district_key(text):
+    """Khóa tra cứu của một tên quận: bỏ dấu, bỏ dấu câu, bỏ tiền tố/hậu tố hành chính"""
+    key = _PUNCTUATION.sub(" ", fold_accents(text))
+    key = _SPACES.sub(" ", key).strip()
+    key = _SUFFIX.sub("", key)
+    key = _PREFIX.sub("", key)
+    return key
+
+
+def levenshtein(a, b):
+    """Khoảng cách chỉnh sửa giữa hai chuỗi"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class _BKTree:
+    """BK-tree: tìm các khóa trong phạm vi khoảng cách chỉnh sửa cho trước"""
+
+    def __init__(self, words):
+        self._root = None
+        for word in words:
+            self._add(word)
+
+    def _add(self, word):
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node = self._root
+        while True:
+            d = levenshtein(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                return
+            node = child
+
+    def search(self, word, max_distance):
+        """Danh sách (khoảng cách, khóa) có khoảng cách không vượt quá max_distance"""
+        if self._root is None:
+            return []
+        result = []
+        stack = [self._root]
+        while stack:
+            key, children = stack.pop()
+            d = levenshtein(word, key)
+            if d <= max_distance:
+                result.append((d, key))
+            for child_d, child in children.items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    stack.append(child)
+        return sorted(result)
+
+
+class DistrictNormalizer:
+    """Chuẩn hóa tên quận/huyện thô về tên chuẩn"""
+
+    def __init__(self, canonical_names, max_distance=0, cache_size=CACHE_SIZE):
+        self.canonical_names = list(canonical_names)
+        self.max_distance = max_distance
+        self._lookup = {}
+        for name in self.canonical_names:
+            key = district_key(name)
+            self._lookup[key] = name
+            # Cho phép viết liền không dấu cách: "DongDa", "dongda"
+            self._lookup.setdefault(key.replace(" ", ""), name)
+        self._bktree = _BKTree(self._lookup) if max_distance > 0 else None
+        self.fuzzy_matches = 0
+        self._cached = lru_cache(maxsize=cache_size)(self._normalize_uncached)
+
+    def _normalize_uncached(self, raw):
+        key = district_key(raw)
+        if not key:
+            return None
+        name = self._lookup.get(key) or self._lookup.get(key.replace(" ", ""))
+        if name or self._bktree is None:
+            return name
+        # So khớp gần đúng: chỉ nhận khi kết quả tốt nhất là duy nhất
+        matches = self._bktree.search(key, self.max_distance)
+        if not matches:
+            return None
+        best = matches[0][0]
+        names = {self._lookup[k] for d, k in matches if d == best}
+        if len(names) != 1:
+            return None
+        self.fuzzy_matches += 1
+        return names.pop()
+
+    def __call__(self, district_name):
+        """Tên quận chuẩn, hoặc None nếu không nhận dạng được"""
+        if not district_name or not isinstance(district_name, str):
+            return None
+        return self._cached(district_name)
+
+    def stats(self):
+        """Thống kê cache: số lần trúng, trượt, tỉ lệ trúng và số lần khớp gần đúng"""
+        info = self._cached.cache_info()
+        total = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_rate': info.hits / total if total else 0.0,
+            'cached': info.currsize,
+            'fuzzy_matches': self.fuzzy_matches,
+        }
@@ -0,0 +1,264 @@
+"""
+Đọc/ghi GeoJSON dùng chung cho các bước của pipeline
+
+- dumps/loads: mã hóa/giải mã JSON gọn (không thụt lề, không khoảng trắng thừa) bằng
+  orjson nếu đã cài, nếu không thì dùng thư viện json chuẩn. Đặt biến môi trường
+  PHARMACY_JSON=stdlib để luôn dùng thư viện chuẩn.
+- open_text: mở file văn bản UTF-8, tự nén/giải nén gzip nếu đuôi file là .gz
+  (ví dụ clean_pharmacy.geojson.gz).
+- iter_geojson_features: đọc lần lượt từng feature của FeatureCollection mà không
+  nạp cả file vào bộ nhớ.
+- load_geojson: đọc cả một file GeoJSON (file nhỏ: ranh giới, điểm trung tâm...).
+- FeatureCollectionWriter: ghi FeatureCollection ra file từng feature một, tọa độ
+  làm tròn COORD_PRECISION chữ số thập phân (7 chữ số ~ 1 cm).
+- file_digest: mã băm nội dung file, dùng để kiểm tra dữ liệu có thay đổi không.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Kích thước mỗi lần đọc khi đọc file theo kiểu streaming (1 MB)
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Số chữ số thập phân của tọa độ khi ghi GeoJSON (None = giữ nguyên)
+COORD_PRECISION = 7
+
+# Mức nén gzip cho file .gz (6: cân bằng giữa tốc độ và dung lượng)
+GZIP_LEVEL = 6
+
+if os.environ.get("PHARMACY_JSON", "").lower() == "stdlib":
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+_DECODER = json.JSONDecoder()
+
+
+def dumps(value):
+    """Chuỗi JSON gọn của value (UTF-8 giữ nguyên, không escape tiếng Việt)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except TypeError:
+            # orjson không hỗ trợ một số kiểu (số nguyên quá 64 bit, khóa không phải chuỗi...)
+            pass
+    return _ENCODER.encode(value)
+
+
+def loads(text):
+    """Giải mã một chuỗi (hoặc bytes) JSON"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return _DECODER.decode(text.decode('utf-8') if isinstance(text, bytes) else text)
+
+
+def is_gzip(path):
+    return Path(path).suffix.lower() == ".gz"
+
+
+def open_text(path, mode='r', compressed=None):
+    """Mở file văn bản UTF-8; file .gz (hoặc compressed=True) được nén/giải nén trong suốt"""
+    if is_gzip(path) if compressed is None else compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=GZIP_LEVEL)
+    return open(path, mode, encoding='utf-8')
+
+
+def load_geojson(path):
+    """Đọc cả một file GeoJSON (hoặc .geojson.gz) vào bộ nhớ"""
+    with open_text(path) as f:
+        return loads(f.read())
+
+
+def round_coordinates(coordinates, precision=COORD_PRECISION):
+    """Làm tròn mọi tọa độ (mảng lồng nhau bất kỳ) tới precision chữ số thập phân"""
+    if precision is None:
+        return coordinates
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [round(c, precision) for c in coordinates]
+    return [round_coordinates(part, precision) for part in coordinates]
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+class _StreamReader:
+    """Bộ đệm đọc file theo từng khối, dùng cho việc giải mã JSON tăng dần"""
+
+    def __init__(self, f, chunk_size=STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Đọc thêm một khối, bỏ phần đã xử lý để bộ nhớ không tăng"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Trả về ký tự khác khoảng trắng tiếp theo (không tiêu thụ)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"GeoJSON không hợp lệ: cần '{char}' tại vị trí {self.pos}")
+        self.pos += 1
+
+    def decode(self, decoder):
+        """Giải mã một giá trị JSON hoàn chỉnh, đọc thêm dữ liệu nếu cần"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # Số ở cuối bộ đệm có thể bị cắt ngang, đọc thêm để chắc chắn
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_line_features(f):
+    """Feature của file do FeatureCollectionWriter ghi (mỗi dòng một feature)
+
+    Trả về None nếu file không theo định dạng đó (con trỏ file được đặt lại đầu file).
+    Mỗi dòng đầu chỉ được đọc tối đa độ dài dòng mong đợi + 1 ký tự, để file JSON một
+    dòng (đã thu gọn) không bị nạp cả vào bộ nhớ khi dò định dạng.
+    """
+    if [f.readline(len(expected) + 1) for expected in _WRITER_HEADER] != _WRITER_HEADER:
+        f.seek(0)
+        return None
+    
+    def features():
+        for line in f:
+            line = line.rstrip()
+            if line in ("]", "}", ""):
+                continue
+            yield loads(line[:-1] if line.endswith(",") else line)
+    return features()
+
+
+def iter_geojson_features(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Đọc lần lượt từng feature của một FeatureCollection mà không nạp cả file
+
+    Chỉ một feature (và một khối dữ liệu thô) nằm trong bộ nhớ tại mỗi thời điểm,
+    nên bộ nhớ sử dụng không phụ thuộc vào kích thước file đầu vào. File do
+    FeatureCollectionWriter ghi (mỗi dòng một feature) được đọc theo dòng và giải mã
+    bằng loads (orjson nếu có); các file khác dùng bộ giải mã tăng dần của json.
+    """
+    decoder = json.JSONDecoder()
+    with open_text(path) as f:
+        lines = _iter_line_features(f)
+        if lines is not None:
+            yield from lines
+            return
+        reader = _StreamReader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode(decoder)
+            reader.expect(':')
+            if key == "features":
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield reader.decode(decoder)
+                        if reader.peek() == ',':
+                            reader.pos += 1
+                            continue
+                        reader.expect(']')
+                        break
+            else:
+                # Bỏ qua các khóa khác (generator, copyright, timestamp...)
+                reader.decode(decoder)
+            if reader.peek() == ',':
+                reader.pos += 1
+                continue
+            reader.expect('}')
+            return
+
+
+# Phần đầu file do FeatureCollectionWriter ghi, theo từng dòng
+_WRITER_HEADER = ['{\n', '"type": "FeatureCollection",\n', '"features": [\n']
+
+
+class FeatureCollectionWriter:
+    """Ghi FeatureCollection ra file từng feature một
+
+    Mỗi feature là một dòng JSON gọn (dumps), tọa độ làm tròn precision chữ số thập
+    phân; đuôi .gz thì file được nén gzip. Dữ liệu được ghi vào file tạm rồi đổi tên
+    khi hoàn tất, để file kết quả cũ không bị hỏng nếu quá trình làm sạch dừng giữa chừng.
+    """
+
+    def __init__(self, path, precision=COORD_PRECISION):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.precision = precision
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        self._f = open_text(self.tmp_path, 'w', compressed=is_gzip(self.path))
+        self._f.write("".join(_WRITER_HEADER))
+        return self
+
+    def write(self, feature):
+        """Ghi một feature; trả về feature đúng như đã ghi (tọa độ đã làm tròn)"""
+        if self.count:
+            self._f.write(",\n")
+        geometry = feature.get('geometry')
+        if self.precision is not None and geometry and geometry.get('coordinates') is not None:
+            feature = {**feature, 'geometry': {**geometry, 'coordinates': round_coordinates(
+                geometry['coordinates'], self.precision)}}
+        self._f.write(dumps(feature))
+        self.count += 1
+        return feature
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._f.write("\n]\n}\n")
+        self._f.close()
+        if exc_type is None:
+            self.tmp_path.replace(self.path)
+        else:
+            self.tmp_path.unlink(missing_ok=True)
+        return False
+
+
+def file_digest(path):
+    """Mã băm SHA-1 của nội dung file (đọc theo khối), None nếu file không tồn tại"""
+    if path is None or not Path(path).exists():
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
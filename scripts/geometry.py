@@ -0,0 +1,164 @@
+"""
+Chuẩn hóa hình học của hiệu thuốc về một điểm đại diện
+
+File xuất Overpass với "out geom" có hiệu thuốc dạng Polygon/MultiPolygon (way, relation
+vẽ theo tòa nhà) hoặc LineString, trong khi mọi bước sau (bản đồ, buffer, chỉ mục không
+gian, cache dạng cột) chỉ cần một cặp [lon, lat]. Ở bước làm sạch, cả lô hình học được
+xử lý một lần:
+- Trọng tâm (centroid) của đa giác theo công thức shoelace, vector hóa trên mọi cạnh
+  của cả lô (lỗ được trừ diện tích; MultiPolygon gộp theo diện tích các phần).
+- Điểm đại diện luôn nằm trong hình: trọng tâm nếu nó nằm trong đa giác (kiểm tra
+  chẵn/lẻ vector hóa), ngược lại là trung điểm đoạn dài nhất của đường ngang qua trọng
+  tâm phần lớn nhất (đa giác lõm hình chữ U, chữ L...).
+- LineString: trọng tâm theo độ dài, điểm đại diện là điểm giữa của đường dài nhất;
+  MultiPoint: trung bình các điểm, điểm đại diện là điểm gần trung bình nhất.
+"""
+
+import numpy as np
+
+from district_boundaries import polygon_rings
+
+
+def _line_parts(geometry):
+    """Danh sách mảng (k, 2) của các đường/tập điểm không phải đa giác"""
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+    if gtype in ("LineString", "MultiPoint"):
+        parts = [coords]
+    elif gtype == "MultiLineString":
+        parts = coords
+    else:
+        return []
+    return [np.asarray(part, dtype=np.float64)[:, :2] for part in parts if part]
+
+
+def _polygon_points(geometries, indices, points, centroids):
+    """Trọng tâm và điểm đại diện của các đa giác geometries[i], i thuộc indices"""
+    starts, ends, edge_feature, edge_part, edge_sign = [], [], [], [], []
+    part_feature = []
+    for i in indices:
+        for rings in polygon_rings(geometries[i]):
+            if not rings:
+                continue
+            part = len(part_feature)
+            part_feature.append(i)
+            for k, ring in enumerate(rings):
+                starts.append(ring)
+                ends.append(np.roll(ring, -1, axis=0))
+                edge_feature.append(np.full(len(ring), i))
+                edge_part.append(np.full(len(ring), part))
+                # Vòng đầu là biên ngoài, các vòng sau là lỗ
+                edge_sign.append(np.full(len(ring), 1.0 if k == 0 else -1.0))
+    if not part_feature:
+        return
+    start, end = np.concatenate(starts), np.concatenate(ends)
+    edge_feature, edge_part = np.concatenate(edge_feature), np.concatenate(edge_part)
+    n = len(points)
+
+    # Tọa độ tương đối so với một đỉnh của hình, tránh mất độ chính xác khi nhân chéo
+    origin = np.zeros((n, 2))
+    features, first_edge = np.unique(edge_feature, return_index=True)
+    origin[features] = start[first_edge]
+    x1, y1 = (start - origin[edge_feature]).T
+    x2, y2 = (end - origin[edge_feature]).T
+    cross = x1 * y2 - x2 * y1
+
+    # Diện tích có dấu của từng vòng -> lấy trị tuyệt đối, lỗ mang dấu âm
+    ring_ids = np.concatenate(([0], np.cumsum([len(s) for s in starts])[:-1]))
+    ring_area = np.add.reduceat(cross, ring_ids) / 2
+    orientation = np.repeat(np.sign(ring_area), [len(s) for s in starts])
+    weight = np.concatenate(edge_sign) * orientation
+    area = cross * weight / 2
+    mx = (x1 + x2) * cross * weight / 6
+    my = (y1 + y2) * cross * weight / 6
+
+    feature_area = np.bincount(edge_feature, weights=area, minlength=n)
+    part_area = np.bincount(edge_part, weights=area, minlength=len(part_feature))
+    part_my = np.bincount(edge_part, weights=my, minlength=len(part_feature))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cx = np.bincount(edge_feature, weights=mx, minlength=n) / feature_area
+        cy = np.bincount(edge_feature, weights=my, minlength=n) / feature_area
+        part_cy = part_my / part_area
+    # Đa giác suy biến (diện tích 0): dùng trung bình các đỉnh
+    degenerate = ~(feature_area > 0)
+    if degenerate.any():
+        counts = np.bincount(edge_feature, minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cx[degenerate] = (np.bincount(edge_feature, weights=x1, minlength=n) / counts)[degenerate]
+            cy[degenerate] = (np.bincount(edge_feature, weights=y1, minlength=n) / counts)[degenerate]
+
+    # Kiểm tra chẵn/lẻ: trọng tâm có nằm trong hình của chính nó không
+    px, py = cx[edge_feature], cy[edge_feature]
+    spans = (y1 > py) != (y2 > py)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    crossings = np.bincount(edge_feature[spans & (px < x_at)], minlength=n)
+    inside = crossings % 2 == 1
+
+    idx = np.asarray(indices)
+    centroids[idx] = np.column_stack((cx[idx], cy[idx])) + origin[idx]
+    points[idx] = centroids[idx]
+
+    # Trọng tâm nằm ngoài (đa giác lõm): lấy đoạn dài nhất trên đường ngang qua phần lớn nhất
+    outside = idx[~inside[idx] & ~degenerate[idx]]
+    if not len(outside):
+        return
+    part_feature = np.asarray(part_feature)
+    for i in outside.tolist():
+        parts = np.flatnonzero(part_feature == i)
+        part = parts[np.argmax(part_area[parts])]
+        on_part = edge_part == part
+        y = part_cy[part]
+        ex1, ey1, ex2, ey2 = x1[on_part], y1[on_part], x2[on_part], y2[on_part]
+        hits = (ey1 > y) != (ey2 > y)
+        xs = np.sort(ex1[hits] + (y - ey1[hits]) * (ex2[hits] - ex1[hits]) / (ey2[hits] - ey1[hits]))
+        if len(xs) < 2:
+            continue
+        lefts, rights = xs[0::2], xs[1::2]
+        widest = np.argmax(rights - lefts[:len(rights)])
+        points[i] = ((lefts[widest] + rights[widest]) / 2, y) + origin[i]
+
+
+def representative_points(geometries):
+    """Điểm đại diện và trọng tâm của một lô hình học GeoJSON
+
+    Trả về hai mảng (n, 2) [lon, lat]: điểm đại diện (luôn nằm trên/trong hình) và trọng
+    tâm. Hình học rỗng hoặc không hỗ trợ cho NaN.
+    """
+    n = len(geometries)
+    points = np.full((n, 2), np.nan)
+    centroids = np.full((n, 2), np.nan)
+    polygons = []
+    for i, geometry in enumerate(geometries):
+        geometry = geometry or {}
+        gtype = geometry.get("type")
+        coords = geometry.get("coordinates") or []
+        if gtype == "Point":
+            if len(coords) >= 2:
+                points[i] = centroids[i] = coords[:2]
+        elif gtype in ("Polygon", "MultiPolygon"):
+            polygons.append(i)
+        else:
+            parts = _line_parts(geometry)
+            if not parts:
+                continue
+            vertices = np.concatenate(parts)
+            lengths = [np.hypot(*(part[1:] - part[:-1]).T) for part in parts]
+            if gtype == "MultiPoint" or not sum(float(length.sum()) for length in lengths):
+                centroids[i] = vertices.mean(axis=0)
+                points[i] = vertices[np.argmin(np.hypot(*(vertices - centroids[i]).T))]
+                continue
+            # Trọng tâm theo độ dài: trung điểm các đoạn, trọng số là độ dài đoạn
+            midpoints = np.concatenate([(part[:-1] + part[1:]) / 2 for part in parts])
+            centroids[i] = np.average(midpoints, axis=0, weights=np.concatenate(lengths))
+            # Điểm đại diện: điểm giữa (theo chiều dài) của đường dài nhất
+            longest = int(np.argmax([length.sum() for length in lengths]))
+            part, length = parts[longest], lengths[longest]
+            cumulative = np.cumsum(length)
+            half = cumulative[-1] / 2
+            k = min(int(np.searchsorted(cumulative, half)), len(length) - 1)
+            t = (half - (cumulative[k] - length[k])) / length[k]
+            points[i] = part[k] + t * (part[k + 1] - part[k])
+    if polygons:
+        _polygon_points(geometries, polygons, points, centroids)
+    return points, centroids
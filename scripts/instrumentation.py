@@ -0,0 +1,289 @@
+"""
+Đo đạc các bước của pipeline: thời gian, thông lượng, bộ nhớ, kích thước file kết quả
+
+Mỗi đoạn công việc được bọc trong một span:
+
+    with span("clean.load") as s:
+        data = json.load(f)
+        s.items = len(data['features'])
+        s.output(path)
+
+Khi span kết thúc, một bản ghi được tạo với thời gian chạy, số phần tử xử lý mỗi giây,
+RSS hiện tại và RSS đỉnh của tiến trình, kích thước các file kết quả và span cha.
+Span lồng nhau được theo dõi riêng cho từng luồng (run_all chạy các bước song song).
+
+Mặc định bản ghi chỉ được giữ trong bộ nhớ (không tốn chi phí ghi). Bật bằng
+configure() hoặc biến môi trường:
+- PHARMACY_METRICS=path.jsonl     mỗi span một dòng JSON (nối thêm)
+- PHARMACY_METRICS_PROM=path.prom file văn bản Prometheus (node_exporter textfile),
+                                  ghi lại sau mỗi span với số liệu gộp theo tên span
+- PHARMACY_PROFILE=cprofile|tracemalloc
+                                  lập hồ sơ cho span cấp bước (stage()), lưu vào
+                                  PHARMACY_PROFILE_DIR (mặc định results/profiles/)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+PROFILE_DIR = Path(__file__).parent.parent / "results" / "profiles"
+
+# Tiền tố tên metric Prometheus
+METRIC_PREFIX = "pharmacy"
+# Số dòng cấp phát lớn nhất ghi ra khi lập hồ sơ tracemalloc
+TRACEMALLOC_TOP = 25
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+
+def rss_mb(peak=True):
+    """RSS đỉnh của tiến trình, hoặc RSS hiện tại nếu peak=False (MB); None nếu không đo được"""
+    if not peak:
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+        except (OSError, ValueError, AttributeError):
+            pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS trả về byte, Linux trả về KB
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 1024
+
+
+class Span:
+    """Một đoạn công việc đang được đo; gán items và gọi output() trong khi chạy"""
+
+    def __init__(self, name, parent=None, labels=None):
+        self.name = name
+        self.parent = parent
+        self.labels = labels or {}
+        self.items = None
+        self.outputs = []
+        self.record = None
+
+    def output(self, *paths):
+        """Khai báo file kết quả; kích thước được đo khi span kết thúc"""
+        self.outputs.extend(Path(p) for p in paths)
+
+
+class Recorder:
+    """Thu thập bản ghi span và ghi ra JSONL / Prometheus nếu được cấu hình"""
+
+    def __init__(self):
+        self.records = []
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self.profiler = None
+        self.profile_dir = PROFILE_DIR
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tracemalloc_users = 0
+
+    def configure(self, jsonl=None, prometheus=None, profile=None, profile_dir=None):
+        """Bật đầu ra JSONL/Prometheus và lập hồ sơ (giữ nguyên giá trị cũ nếu truyền None)"""
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"profile phải là một trong {PROFILERS}, nhận được {profile!r}")
+        self.jsonl_path = Path(jsonl) if jsonl else self.jsonl_path
+        self.prometheus_path = Path(prometheus) if prometheus else self.prometheus_path
+        self.profiler = profile or self.profiler
+        self.profile_dir = Path(profile_dir) if profile_dir else self.profile_dir
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, items=None, profile=False, **labels):
+        """Đo một đoạn công việc; profile=True bật lập hồ sơ nếu đã cấu hình (chỉ span ngoài cùng)"""
+        stack = self._stack()
+        current = Span(name, stack[-1].name if stack else None, labels)
+        current.items = items
+        # Chỉ lập hồ sơ span cấp bước ngoài cùng trong luồng, tránh lồng profiler
+        profiler = self._start_profile() if profile and self.profiler and \
+            not any(getattr(s, 'profiled', False) for s in stack) else None
+        current.profiled = profiler is not None
+        stack.append(current)
+        status = "ok"
+        start = time.perf_counter()
+        try:
+            yield current
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            if profiler is not None:
+                self._stop_profile(profiler, name)
+            self._finish(current, seconds, status)
+
+    def _finish(self, current, seconds, status):
+        output_bytes = {str(p): p.stat().st_size for p in current.outputs if p.exists()}
+        rss, peak = rss_mb(peak=False), rss_mb()
+        if rss is not None and peak is not None:
+            # ru_maxrss và /proc/self/statm được cập nhật theo hai cách khác nhau
+            peak = max(peak, rss)
+        record = {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'span': current.name,
+            'parent': current.parent,
+            'status': status,
+            'seconds': round(seconds, 6),
+            'items': current.items,
+            'items_per_sec': round(current.items / seconds, 1) if current.items and seconds > 0 else None,
+            'rss_mb': _round(rss),
+            'peak_rss_mb': _round(peak),
+            'output_bytes': output_bytes or None,
+            'thread': threading.current_thread().name,
+            'pid': os.getpid(),
+            **({'labels': current.labels} if current.labels else {}),
+        }
+        current.record = record
+        with self._lock:
+            self.records.append(record)
+            if self.jsonl_path:
+                self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if self.prometheus_path:
+                self._write_prometheus()
+
+    def _start_profile(self):
+        if self.profiler == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+: chỉ một profiler được bật cùng lúc (các bước chạy song song)
+                print(" Đang có profiler khác chạy, bỏ qua lập hồ sơ bước này")
+                return None
+            return profiler
+        import tracemalloc
+        with self._lock:
+            self._tracemalloc_users += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # Mỗi bước có ảnh chụp gốc riêng để chỉ báo phần cấp phát của nó
+            return tracemalloc.take_snapshot()
+
+    def _stop_profile(self, profiler, name):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+        if self.profiler == "cprofile":
+            profiler.disable()
+            path = self.profile_dir / f"{safe}.prof"
+            profiler.dump_stats(path)
+        else:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            stats = snapshot.compare_to(profiler, 'lineno')[:TRACEMALLOC_TOP]
+            path = self.profile_dir / f"{safe}.tracemalloc.txt"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"# {name}: Python đang giữ {current / 2**20:.1f} MB, đỉnh {peak / 2**20:.1f} MB\n")
+                for stat in stats:
+                    f.write(f"{stat}\n")
+            with self._lock:
+                self._tracemalloc_users -= 1
+                if not self._tracemalloc_users:
+                    tracemalloc.stop()
+        print(f" Hồ sơ {self.profiler} của {name}: {path}")
+
+    def _write_prometheus(self):
+        """Ghi số liệu gộp theo tên span ở định dạng văn bản Prometheus (ghi file tạm rồi đổi tên)"""
+        totals = {}
+        for record in self.records:
+            entry = totals.setdefault(record['span'], {'count': 0, 'seconds': 0.0, 'items': 0,
+                                                        'errors': 0, 'peak_rss_mb': 0.0, 'outputs': {}})
+            entry['count'] += 1
+            entry['seconds'] += record['seconds']
+            entry['items'] += record['items'] or 0
+            entry['errors'] += record['status'] != "ok"
+            entry['peak_rss_mb'] = max(entry['peak_rss_mb'], record['peak_rss_mb'] or 0)
+            entry['last_rate'] = record['items_per_sec']
+            entry['outputs'].update(record['output_bytes'] or {})
+
+        # Mỗi metric là một nhóm liền nhau: HELP, TYPE rồi các mẫu theo từng span
+        families = [
+            ("span_seconds_total", "counter", "Tổng thời gian chạy của span (giây)",
+             lambda e: [("", f"{e['seconds']:.6f}")]),
+            ("span_runs_total", "counter", "Số lần span được chạy", lambda e: [("", e['count'])]),
+            ("span_errors_total", "counter", "Số lần span kết thúc do lỗi", lambda e: [("", e['errors'])]),
+            ("span_items_total", "counter", "Tổng số phần tử span đã xử lý", lambda e: [("", e['items'])]),
+            ("span_items_per_second", "gauge", "Thông lượng của lần chạy gần nhất",
+             lambda e: [("", e['last_rate'])] if e['last_rate'] is not None else []),
+            ("span_peak_rss_bytes", "gauge", "RSS đỉnh của tiến trình khi span kết thúc",
+             lambda e: [("", int(e['peak_rss_mb'] * 2**20))]),
+            ("output_bytes", "gauge", "Kích thước file kết quả",
+             lambda e: [(f',path="{_escape(path)}"', size) for path, size in e['outputs'].items()]),
+        ]
+        lines = []
+        for metric, kind, help_text, samples in families:
+            metric = f"{METRIC_PREFIX}_{metric}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, entry in totals.items():
+                for extra, value in samples(entry):
+                    lines.append(f'{metric}{{span="{_escape(name)}"{extra}}} {value}')
+
+        self.prometheus_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.prometheus_path.with_name(self.prometheus_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        tmp_path.replace(self.prometheus_path)
+
+
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+recorder = Recorder()
+recorder.configure(jsonl=os.environ.get("PHARMACY_METRICS"),
+                   prometheus=os.environ.get("PHARMACY_METRICS_PROM"),
+                   profile=os.environ.get("PHARMACY_PROFILE") or None,
+                   profile_dir=os.environ.get("PHARMACY_PROFILE_DIR"))
+
+
+def configure(jsonl=None, prometheus=None, profile=None, profile_dir=None):
+    """Cấu hình bộ thu dùng chung (xem Recorder.configure)"""
+    recorder.configure(jsonl, prometheus, profile, profile_dir)
+
+
+def add_metrics_arguments(parser):
+    """Thêm các tùy chọn --metrics/--prometheus/--profile vào một argparse parser"""
+    group = parser.add_argument_group("đo đạc")
+    group.add_argument("--metrics", type=Path, metavar="FILE",
+                       help="Ghi số đo từng bước ra file JSON lines (nối thêm)")
+    group.add_argument("--prometheus", type=Path, metavar="FILE",
+                       help="Ghi số đo gộp ra file văn bản Prometheus")
+    group.add_argument("--profile", choices=PROFILERS,
+                       help=f"Lập hồ sơ từng bước bằng cProfile hoặc tracemalloc (lưu vào {PROFILE_DIR})")
+
+
+def configure_from_args(args):
+    """Cấu hình bộ thu dùng chung từ kết quả parse_args() của add_metrics_arguments"""
+    recorder.configure(args.metrics, args.prometheus, args.profile)
+
+
+def span(name, items=None, **labels):
+    """Đo một đoạn công việc bằng bộ thu dùng chung; items là số phần tử đã xử lý (nếu biết trước)"""
+    return recorder.span(name, items, **labels)
+
+
+def stage(name, items=None, **labels):
+    """Span cấp bước: như span() nhưng được lập hồ sơ khi bật PHARMACY_PROFILE/--profile"""
+    return recorder.span(name, items, profile=True, **labels)
@@ -0,0 +1,193 @@
+"""
+Kiểm thử tải cho dịch vụ truy vấn (query_service.py)
+
+Mở nhiều kết nối keep-alive đồng thời, gửi hỗn hợp truy vấn radius/nearest/districts
+tại các điểm ngẫu nhiên trong nội thành Hà Nội và báo cáo độ trễ p50/p90/p99,
+thông lượng và số lỗi (tổng và theo từng endpoint).
+
+    python load_test.py --requests 5000 --concurrency 32
+    python load_test.py --serve            # tự khởi động dịch vụ ở cổng trống rồi đo
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from query_service import DATA_FILE, DEFAULT_HOST, DEFAULT_PORT
+
+# Vùng lấy điểm truy vấn (nội thành, nơi hiệu thuốc dày đặc)
+QUERY_BBOX = (105.75, 20.95, 105.90, 21.08)
+# Tỷ lệ các loại truy vấn
+MIX = {'radius': 0.5, 'nearest': 0.3, 'radius_open': 0.1, 'nearest_open': 0.05, 'districts': 0.05}
+RADII = (300, 500, 1000, 2000)
+PERCENTILES = (50, 90, 99)
+# Thời gian chờ dịch vụ khởi động (giây)
+STARTUP_TIMEOUT_S = 30
+
+
+def build_targets(count, seed=0):
+    """Danh sách (loại, đường dẫn) ngẫu nhiên theo tỷ lệ MIX"""
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(list(MIX), size=count, p=np.array(list(MIX.values())) / sum(MIX.values()))
+    lons = rng.uniform(QUERY_BBOX[0], QUERY_BBOX[2], count)
+    lats = rng.uniform(QUERY_BBOX[1], QUERY_BBOX[3], count)
+    radii = rng.choice(RADII, size=count)
+    ks = rng.integers(1, 11, size=count)
+    targets = []
+    for kind, lon, lat, r, k in zip(kinds.tolist(), lons.tolist(), lats.tolist(), radii.tolist(), ks.tolist()):
+        point = f"lat={lat:.6f}&lon={lon:.6f}"
+        if kind == 'radius':
+            targets.append((kind, f"/radius?{point}&r={r}"))
+        elif kind == 'radius_open':
+            targets.append((kind, f"/radius?{point}&r={r}&open=now"))
+        elif kind == 'nearest':
+            targets.append((kind, f"/nearest?{point}&k={k}"))
+        elif kind == 'nearest_open':
+            targets.append((kind, f"/nearest?{point}&k={k}&open=Su+02:00"))
+        else:
+            targets.append((kind, "/districts"))
+    return targets
+
+
+async def _fetch(reader, writer, host, path):
+    """Gửi một GET trên kết nối keep-alive; trả về (mã HTTP, body)"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode('latin-1').split("\r\n")
+    status = int(lines[0].split()[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    body = await reader.readexactly(length)
+    return status, body
+
+
+async def _worker(host, port, targets, cursor, samples):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while cursor[0] < len(targets):
+            kind, path = targets[cursor[0]]
+            cursor[0] += 1
+            start = time.perf_counter()
+            try:
+                status, _ = await _fetch(reader, writer, host, path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                samples.append((kind, time.perf_counter() - start, 0))
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            samples.append((kind, time.perf_counter() - start, status))
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, targets, concurrency):
+    """Chạy toàn bộ targets với concurrency kết nối; trả về (mẫu, thời gian thực)"""
+    cursor = [0]
+    samples = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_worker(host, port, targets, cursor, samples) for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """Thống kê độ trễ (ms) tổng và theo từng loại truy vấn"""
+    def stats(rows):
+        latencies = np.array([latency for _, latency, _ in rows]) * 1000
+        result = {'requests': len(rows), 'errors': sum(1 for *_, status in rows if status != 200)}
+        if len(rows):
+            for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+                result[f'p{p}_ms'] = round(float(value), 2)
+            result['max_ms'] = round(float(latencies.max()), 2)
+        return result
+
+    report = stats(samples)
+    report['seconds'] = round(elapsed, 3)
+    report['requests_per_sec'] = round(len(samples) / elapsed, 1) if elapsed else None
+    report['by_kind'] = {kind: stats([row for row in samples if row[0] == kind])
+                         for kind in MIX if any(row[0] == kind for row in samples)}
+    return report
+
+
+def print_report(report):
+    columns = ["requests", "errors"] + [f"p{p}_ms" for p in PERCENTILES] + ["max_ms"]
+    print(f"\n {report['requests']} request trong {report['seconds']}s "
+          f"({report['requests_per_sec']} request/s), {report['errors']} lỗi")
+    print(f"   {'loại':<14}" + "".join(f"{name:>10}" for name in columns))
+    for kind, row in [('tất cả', report)] + list(report['by_kind'].items()):
+        print(f"   {kind:<14}" + "".join(f"{row.get(name, '-'):>10}" for name in columns))
+
+
+def _free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_ready(host, port, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Dịch vụ dừng khi khởi động (mã {process.returncode})")
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Dịch vụ không sẵn sàng sau {STARTUP_TIMEOUT_S}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kiểm thử tải dịch vụ truy vấn hiệu thuốc")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--requests", type=int, default=5000, help="Tổng số request")
+    parser.add_argument("--concurrency", type=int, default=32, help="Số kết nối đồng thời")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=200, help="Số request chạy trước, không tính vào kết quả")
+    parser.add_argument("--serve", action="store_true",
+                        help="Tự khởi động query_service.py ở một cổng trống và dừng sau khi đo")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File dữ liệu cho dịch vụ (khi dùng --serve)")
+    parser.add_argument("--output", type=Path, help="Ghi báo cáo ra file JSON")
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.serve:
+        args.port = _free_port(args.host)
+        process = subprocess.Popen([sys.executable, str(Path(__file__).parent / "query_service.py"),
+                                    "--data", str(args.data), "--host", args.host, "--port", str(args.port)])
+    try:
+        if process is not None:
+            _wait_until_ready(args.host, args.port, process)
+        print(f" Kiểm thử tải http://{args.host}:{args.port}: {args.requests} request, "
+              f"{args.concurrency} kết nối")
+        if args.warmup:
+            asyncio.run(run_load(args.host, args.port, build_targets(args.warmup, args.seed + 1), args.concurrency))
+        samples, elapsed = asyncio.run(
+            run_load(args.host, args.port, build_targets(args.requests, args.seed), args.concurrency))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = summarize(samples, elapsed)
+    print_report(report)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\n Đã lưu báo cáo: {args.output}")
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
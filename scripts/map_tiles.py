@@ -0,0 +1,357 @@
+"""
+Xuất bản đồ hiệu thuốc dạng kim tự tháp tile GeoJSON z/x/y
+
+Thay vì một file HTML chứa mọi marker, dữ liệu được cắt thành các tile GeoJSON
+theo lưới Web Mercator (tiles/{z}/{x}/{y}.geojson):
+- Ở các mức zoom thấp, hiệu thuốc được gom cụm sẵn phía server theo ô lưới trong
+  từng tile (mỗi cụm là một điểm có thuộc tính count).
+- Từ mức CLUSTER_MAX_ZOOM + 1 trở lên, mỗi hiệu thuốc là một điểm kèm thông tin.
+- index.html là trình xem Leaflet mỏng, chỉ tải các tile đang hiển thị.
+
+Chạy:
+    python map_tiles.py                 # xuất ra results/tiles/
+    python map_tiles.py --serve         # xuất rồi mở server tĩnh tại http://localhost:8000
+    python map_tiles.py --benchmark     # so sánh với bản đồ folium hiện tại
+"""
+
+import argparse
+import json
+import math
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from columnar_cache import load_table
+from geojson_io import dumps, load_geojson
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+OUTPUT_DIR = Path(__file__).parent.parent / "results" / "tiles"
+
+HANOI_CENTER = [21.0285, 105.8542]
+
+MIN_ZOOM = 5
+MAX_ZOOM = 16
+# Mức zoom cuối cùng còn gom cụm
+CLUSTER_MAX_ZOOM = 13
+# Mỗi tile 256px được chia thành 2^CELL_BITS x 2^CELL_BITS ô gom cụm (mặc định ô 64px)
+CELL_BITS = 2
+
+TILE_SIZE = 256
+MAX_LAT = 85.0511287798
+
+# Cột thông tin của từng hiệu thuốc trong tile chi tiết
+DETAIL_COLUMNS = ("name", "district", "street", "opening_hours", "phone")
+
+
+def mercator_xy(lons, lats):
+    """Tọa độ Web Mercator chuẩn hóa trong [0, 1) (x từ trái sang, y từ trên xuống)"""
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_LAT, MAX_LAT)
+    x = (lons + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lats))) / math.pi) / 2.0
+    eps = np.nextafter(1.0, 0.0)
+    return np.clip(x, 0.0, eps), np.clip(y, 0.0, eps)
+
+
+def _point(lon, lat, props):
+    return {"type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, 7), round(lat, 7)]},
+            "properties": props}
+
+
+def _cluster_zoom(z, xs, ys, lons, lats, names):
+    """Gom cụm ở mức zoom z; trả về dict (x, y) tile -> danh sách feature"""
+    cells = 1 << (z + CELL_BITS)
+    cx = (xs * cells).astype(np.int64)
+    cy = (ys * cells).astype(np.int64)
+    keys, inverse, counts = np.unique(cx * cells + cy, return_inverse=True, return_counts=True)
+    # Tâm cụm là trung bình tọa độ các hiệu thuốc trong ô
+    mean_lon = np.bincount(inverse, weights=lons) / counts
+    mean_lat = np.bincount(inverse, weights=lats) / counts
+    # Hiệu thuốc đại diện của mỗi ô (để hiện tên khi cụm chỉ có một điểm)
+    first = np.full(len(keys), len(lons), dtype=np.int64)
+    np.minimum.at(first, inverse, np.arange(len(lons)))
+
+    tiles = {}
+    for key, count, lon, lat, i in zip(keys.tolist(), counts.tolist(), mean_lon.tolist(),
+                                       mean_lat.tolist(), first.tolist()):
+        tile = ((key // cells) >> CELL_BITS, (key % cells) >> CELL_BITS)
+        props = {"count": count}
+        if count == 1:
+            props["name"] = names[i]
+        tiles.setdefault(tile, []).append(_point(lon, lat, props))
+    return tiles
+
+
+def _detail_zoom(z, xs, ys, lons, lats, columns):
+    """Mỗi hiệu thuốc là một điểm; trả về dict (x, y) tile -> danh sách feature"""
+    n = 1 << z
+    tx = (xs * n).astype(np.int64).tolist()
+    ty = (ys * n).astype(np.int64).tolist()
+    tiles = {}
+    for i, (x, y, lon, lat) in enumerate(zip(tx, ty, lons.tolist(), lats.tolist())):
+        props = {"id": i, "count": 1}
+        props.update({col: columns[col][i] for col in DETAIL_COLUMNS})
+        tiles.setdefault((x, y), []).append(_point(lon, lat, props))
+    return tiles
+
+
+def _write_json(path, value):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(dumps(value))
+    return path.stat().st_size
+
+
+def export_tiles(data_file=DATA_FILE, output_dir=OUTPUT_DIR, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM,
+                 cluster_max_zoom=CLUSTER_MAX_ZOOM):
+    """Ghi kim tự tháp tile GeoJSON và trình xem index.html vào output_dir
+
+    Chỉ các tile có dữ liệu mới được ghi. Trả về thông tin xuất (số tile, dung lượng).
+    """
+    output_dir = Path(output_dir)
+    table = load_table(data_file)
+    lons = np.asarray(table.lon, dtype=np.float64)
+    lats = np.asarray(table.lat, dtype=np.float64)
+    valid = np.isfinite(lons) & np.isfinite(lats)
+    lons, lats = lons[valid], lats[valid]
+    columns = {col: [v for v, ok in zip(table.column(col), valid.tolist()) if ok]
+               for col in DETAIL_COLUMNS}
+    columns["name"] = [name or 'Không rõ' for name in columns["name"]]
+    columns["district"] = [d or 'Không rõ' for d in columns["district"]]
+    xs, ys = mercator_xy(lons, lats)
+
+    # Xóa tile cũ để không còn tile thừa từ lần xuất trước
+    for z_dir in output_dir.glob("[0-9]*"):
+        if z_dir.is_dir():
+            shutil.rmtree(z_dir)
+
+    zooms = {}
+    total_bytes = 0
+    for z in range(min_zoom, max_zoom + 1):
+        if z <= cluster_max_zoom:
+            tiles = _cluster_zoom(z, xs, ys, lons, lats, columns["name"])
+        else:
+            tiles = _detail_zoom(z, xs, ys, lons, lats, columns)
+        for (x, y), features in tiles.items():
+            total_bytes += _write_json(output_dir / str(z) / str(x) / f"{y}.geojson",
+                                       {"type": "FeatureCollection", "features": features})
+        if tiles:
+            tile_xs = [x for x, _ in tiles]
+            tile_ys = [y for _, y in tiles]
+            zooms[z] = {"tiles": len(tiles), "bounds": [min(tile_xs), min(tile_ys), max(tile_xs), max(tile_ys)]}
+
+    index = {
+        "count": int(len(lons)),
+        "min_zoom": min_zoom,
+        "max_zoom": max_zoom,
+        "cluster_max_zoom": cluster_max_zoom,
+        "bounds": [float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())] if len(lons) else None,
+        "zooms": {str(z): info for z, info in zooms.items()},
+    }
+    _write_json(output_dir / "index.json", index)
+    viewer = output_dir / "index.html"
+    with open(viewer, 'w', encoding='utf-8') as f:
+        f.write(viewer_html(min_zoom, max_zoom))
+    return {
+        "tiles": sum(info["tiles"] for info in zooms.values()),
+        "tile_bytes": total_bytes,
+        "viewer": viewer,
+        "viewer_bytes": viewer.stat().st_size,
+        "index": index,
+    }
+
+
+def viewer_html(min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, center=HANOI_CENTER, zoom=11):
+    """Trang Leaflet mỏng: chỉ tải các tile nằm trong khung nhìn hiện tại"""
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Hiệu thuốc Hà Nội</title>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map {{ height: 100%; margin: 0; }}
+.pharmacy-cluster {{ background: rgba(25, 118, 210, 0.8); color: white; border-radius: 50%;
+    text-align: center; font: bold 12px Arial; border: 2px solid white; }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var MIN_ZOOM = {min_zoom}, MAX_ZOOM = {max_zoom};
+var map = L.map('map').setView({json.dumps(center)}, {zoom});
+L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+    attribution: '&copy; OpenStreetMap contributors'
+}}).addTo(map);
+
+var tileCache = {{}};   // "z/x/y" -> Promise<FeatureCollection | null>
+var shown = {{}};       // "z/x/y" -> layer đang hiển thị
+
+function escapeHtml(text) {{
+    return String(text).replace(/[&<>"']/g, function(c) {{
+        return {{'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}}[c];
+    }});
+}}
+
+function fetchTile(key) {{
+    if (!tileCache[key]) {{
+        // Tile không tồn tại nghĩa là không có hiệu thuốc
+        tileCache[key] = fetch(key + '.geojson')
+            .then(function(r) {{ return r.ok ? r.json() : null; }})
+            .catch(function() {{ return null; }});
+    }}
+    return tileCache[key];
+}}
+
+function pointLayer(feature, latlng) {{
+    var p = feature.properties;
+    if (p.count > 1) {{
+        var size = 24 + Math.min(24, Math.round(Math.log(p.count) * 4));
+        return L.marker(latlng, {{icon: L.divIcon({{
+            className: 'pharmacy-cluster', iconSize: [size, size],
+            html: '<span style="line-height:' + size + 'px">' + p.count + '</span>'
+        }})}}).on('click', function() {{ map.setView(latlng, map.getZoom() + 2); }});
+    }}
+    var circle = L.circleMarker(latlng, {{radius: 6, color: '#1976D2', fillOpacity: 0.7}});
+    if (p.name) circle.bindTooltip(escapeHtml(p.name));
+    if (p.id !== undefined) {{
+        circle.bindPopup('<b>' + escapeHtml(p.name) + '</b><br>' + escapeHtml(p.street || '') +
+            '<br>' + escapeHtml(p.district) + '<br>Giờ mở: ' + escapeHtml(p.opening_hours || '') +
+            '<br>SĐT: ' + escapeHtml(p.phone || ''));
+    }}
+    return circle;
+}}
+
+function refresh() {{
+    var z = Math.max(MIN_ZOOM, Math.min(MAX_ZOOM, map.getZoom()));
+    var bounds = map.getBounds();
+    var nw = map.project(bounds.getNorthWest(), z).divideBy(256).floor();
+    var se = map.project(bounds.getSouthEast(), z).divideBy(256).floor();
+    var n = 1 << z;
+    var wanted = {{}};
+    for (var x = Math.max(0, nw.x); x <= Math.min(n - 1, se.x); x++) {{
+        for (var y = Math.max(0, nw.y); y <= Math.min(n - 1, se.y); y++) {{
+            wanted[z + '/' + x + '/' + y] = true;
+        }}
+    }}
+    Object.keys(shown).forEach(function(key) {{
+        if (!wanted[key]) {{ map.removeLayer(shown[key]); delete shown[key]; }}
+    }});
+    Object.keys(wanted).forEach(function(key) {{
+        if (shown[key]) return;
+        shown[key] = L.layerGroup().addTo(map);
+        fetchTile(key).then(function(data) {{
+            if (data && shown[key]) shown[key].addLayer(L.geoJSON(data, {{pointToLayer: pointLayer}}));
+        }});
+    }});
+}}
+
+map.on('moveend', refresh);
+refresh();
+</script>
+</body>
+</html>
+"""
+
+
+def _first_view_tiles(index, center=HANOI_CENTER, zoom=11, width=1280, height=800):
+    """Các tile (z, x, y) mà trình xem tải cho khung nhìn đầu tiên"""
+    z = max(index["min_zoom"], min(index["max_zoom"], zoom))
+    x, y = mercator_xy([center[1]], [center[0]])
+    px, py = float(x[0]) * TILE_SIZE * (1 << z), float(y[0]) * TILE_SIZE * (1 << z)
+    half_w, half_h = width / 2 * (1 << z) / (1 << zoom), height / 2 * (1 << z) / (1 << zoom)
+    n = 1 << z
+    return [(z, tx, ty)
+            for tx in range(max(0, int((px - half_w) // TILE_SIZE)), min(n - 1, int((px + half_w) // TILE_SIZE)) + 1)
+            for ty in range(max(0, int((py - half_h) // TILE_SIZE)), min(n - 1, int((py + half_h) // TILE_SIZE)) + 1)]
+
+
+def benchmark(data_file=DATA_FILE):
+    """So sánh bản đồ folium (inline và --compact) với kim tự tháp tile
+
+    Thời gian hiển thị đầu tiên được ước lượng phía Python bằng lượng dữ liệu trang
+    phải tải và phân tích trước khi vẽ (HTML + các tile của khung nhìn đầu tiên) và
+    số đối tượng Leaflet cần tạo, vì không chạy trình duyệt trong benchmark.
+    """
+    import map_visualization
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        n = len(load_table(data_file))
+        for label, compact in (("folium inline", False), ("folium --compact", True)):
+            html_path = tmp / f"map_{int(compact)}.html"
+            start = time.perf_counter()
+            # Không vẽ heatmap: raster KDE tính từ dữ liệu mặc định, còn tile không có lớp này
+            map_visualization.create_map(html_path, compact=compact, heatmap=False, data_file=data_file)
+            build_time = time.perf_counter() - start
+            size = html_path.stat().st_size
+            rows.append((label, build_time, size, size, 2 * n))
+
+        start = time.perf_counter()
+        info = export_tiles(data_file, tmp / "tiles")
+        build_time = time.perf_counter() - start
+        first_bytes = info["viewer_bytes"]
+        first_objects = 0
+        for z, x, y in _first_view_tiles(info["index"]):
+            path = tmp / "tiles" / str(z) / str(x) / f"{y}.geojson"
+            if path.exists():
+                first_bytes += path.stat().st_size
+                first_objects += len(load_geojson(path)["features"])
+        rows.append(("tiles", build_time, info["viewer_bytes"] + info["tile_bytes"], first_bytes, first_objects))
+
+    print(f"\n Benchmark với {n} hiệu thuốc (khung nhìn đầu tiên: zoom 11, 1280x800)")
+    print(f"   {'Chế độ':<18} {'Tạo (s)':>9} {'Tổng (KB)':>11} {'Tải lần đầu (KB)':>17} {'Đối tượng vẽ':>13}")
+    for label, build_time, total, first, objects in rows:
+        print(f"   {label:<18} {build_time:>9.2f} {total / 1024:>11.1f} {first / 1024:>17.1f} {objects:>13}")
+    return rows
+
+
+def serve(directory=OUTPUT_DIR, port=8000):
+    """Server tĩnh cục bộ cho thư mục tile (fetch() không chạy được với file://)"""
+    import functools
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(directory))
+    with ThreadingHTTPServer(("127.0.0.1", port), handler) as server:
+        print(f" Mở http://localhost:{port}/index.html (Ctrl+C để dừng)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xuất bản đồ hiệu thuốc dạng tile GeoJSON z/x/y")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File GeoJSON hiệu thuốc đã làm sạch")
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR, help="Thư mục tile")
+    parser.add_argument("--min-zoom", type=int, default=MIN_ZOOM)
+    parser.add_argument("--max-zoom", type=int, default=MAX_ZOOM)
+    parser.add_argument("--cluster-max-zoom", type=int, default=CLUSTER_MAX_ZOOM,
+                        help="Mức zoom cuối cùng còn gom cụm")
+    parser.add_argument("--serve", action="store_true", help="Mở server tĩnh sau khi xuất")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--benchmark", action="store_true", help="So sánh với bản đồ folium hiện tại")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark(args.data)
+        return
+
+    start = time.perf_counter()
+    info = export_tiles(args.data, args.output, args.min_zoom, args.max_zoom, args.cluster_max_zoom)
+    print(f" Đã xuất {info['tiles']} tile ({info['tile_bytes'] / 1024:.1f} KB) "
+          f"trong {time.perf_counter() - start:.2f}s")
+    print(f" Trình xem: {info['viewer']}")
+    if args.serve:
+        serve(args.output, args.port)
+
+
+if __name__ == "__main__":
+    main()
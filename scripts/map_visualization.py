@@ -6,18 +6,23 @@ Chức năng chính:
 - Hiển thị tất cả hiệu thuốc lên bản đồ với marker, popup thông tin chi tiết.
 - Gom cụm marker (MarkerCluster) để bản đồ không bị rối, hiển thị số lượng hiệu thuốc ở từng khu vực.
 - Phân lớp theo quận, mỗi quận một màu khác nhau.
-- Thêm chức năng tìm kiếm hiện đại: tìm theo tên, địa chỉ, zoom vào vị trí hiệu thuốc.
+- Lớp heatmap mật độ từ raster KDE đã tính sẵn (density.py), nếu có.
+- Thêm chức năng tìm kiếm hiện đại: tìm theo tên, địa chỉ (không phân biệt dấu), zoom vào vị trí hiệu thuốc.
+  Chỉ mục tìm kiếm (n-gram đã bỏ dấu) được dựng sẵn khi tạo bản đồ.
 - Thêm thống kê tổng số hiệu thuốc, số quận.
 - Xuất ra file HTML để mở trên trình duyệt và tương tác trực tiếp.
 
 Đây là bước cuối cùng để trình bày, tra cứu và phân tích dữ liệu hiệu thuốc một cách trực quan.
 """
 
-import json
-import folium
-from folium.plugins import MarkerCluster
+import argparse
 from pathlib import Path
 
+from columnar_cache import load_table
+from district_normalizer import fold_accents
+from geojson_io import dumps
+from instrumentation import add_metrics_arguments, configure_from_args, span, stage
+
 # Cấu hình
 DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
 OUTPUT_MAP = Path(__file__).parent.parent / "results" / "pharmacies_map.html"
@@ -31,59 +36,70 @@ COLORS = {
     'Hoàng Mai': 'beige', 'Nam Từ Liêm': 'cadetblue'
 }
 
+# Độ dài n-gram của chỉ mục tìm kiếm; truy vấn ngắn hơn dùng chỉ mục tiền tố của từ
+SEARCH_NGRAM = 3
+# Thời gian chờ sau lần gõ phím cuối trước khi tìm (ms)
+SEARCH_DEBOUNCE_MS = 150
 
-def create_map():
-    """Tạo bản đồ hiệu thuốc"""
-    print("  Đang tạo bản đồ...")
-    
-    # Đọc dữ liệu
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    pharmacies = data['features']
-    print(f" Tìm thấy {len(pharmacies)} hiệu thuốc")
-    
-    # Tạo bản đồ
-    m = folium.Map(location=HANOI_CENTER, zoom_start=11, tiles='OpenStreetMap')
-    
-    # Thêm tile layer khác
-    folium.TileLayer('CartoDB positron', name='Light Map').add_to(m)
-    
-    # Tạo marker cluster
-    marker_cluster = MarkerCluster(name='Tất cả hiệu thuốc').add_to(m)
-    
+
+def build_search_index(pharmacies):
+    """Chỉ mục tìm kiếm dựng sẵn cho ô tìm kiếm trên bản đồ
+
+    Văn bản tìm kiếm của mỗi hiệu thuốc (tên, quận, đường) được bỏ dấu bằng
+    fold_accents; các trường ngăn cách bằng xuống dòng để truy vấn không khớp vắt
+    qua hai trường. Trả về dict:
+    - text: văn bản đã bỏ dấu của từng hiệu thuốc (dùng để xác nhận kết quả)
+    - grams: n-gram -> danh sách chỉ số hiệu thuốc chứa n-gram đó
+    - prefixes: tiền tố (ngắn hơn n) của từng từ -> danh sách chỉ số
+    """
+    texts, grams, prefixes = [], {}, {}
+    for i, pharmacy in enumerate(pharmacies):
+        fields = (pharmacy['name'] or 'Không rõ', pharmacy['district'] or 'Không rõ', pharmacy['street'] or '')
+        text = "\n".join(fold_accents(field) for field in fields)
+        texts.append(text)
+        for gram in {text[j:j + SEARCH_NGRAM] for j in range(len(text) - SEARCH_NGRAM + 1)}:
+            if "\n" not in gram:
+                grams.setdefault(gram, []).append(i)
+        words = text.split()
+        for prefix in {word[:k] for word in words for k in range(1, min(len(word), SEARCH_NGRAM - 1) + 1)}:
+            prefixes.setdefault(prefix, []).append(i)
+    return {'n': SEARCH_NGRAM, 'text': texts, 'grams': grams, 'prefixes': prefixes}
+
+
+def _popup_html(name, address, district, hours, phone):
+    """Popup HTML đơn giản"""
+    return f"""
+        <div style="font-family: Arial; width: 250px;">
+            <h4 style="color: #1976D2; margin: 0 0 10px 0;"> {name}</h4>
+            <p><b> Địa chỉ:</b> {address}</p>
+            <p><b> Quận:</b> {district}</p>
+            <p><b> Giờ mở:</b> {hours}</p>
+            <p><b> SĐT:</b> {phone}</p>
+        </div>
+        """
+
+
+def _add_inline_markers(m, marker_cluster, pharmacies):
+    """Tạo marker/CircleMarker bằng folium cho từng hiệu thuốc (mỗi marker mang popup riêng)"""
+    import folium
     # Tạo feature group cho từng quận
     district_groups = {}
     
-    # Danh sách marker cho Search
-    search_markers = []
-    
     # Thêm marker
     for pharmacy in pharmacies:
-        props = pharmacy['properties']
-        coords = pharmacy['geometry']['coordinates']
-        lat, lon = coords[1], coords[0]
+        lat, lon = pharmacy['lat'], pharmacy['lon']
         
         # Thông tin
-        name = props.get('name', 'Không rõ')
-        district = props.get('district', 'Không rõ')
-        street = props.get('street', '')
-        hours = props.get('opening_hours', 'Không có thông tin')
-        phone = props.get('phone', 'Không có')
+        name = pharmacy['name'] or 'Không rõ'
+        district = pharmacy['district'] or 'Không rõ'
+        street = pharmacy['street']
+        hours = pharmacy['opening_hours']
+        phone = pharmacy['phone']
         
         # Địa chỉ
         address = f"{street}, {district}" if street else district
         
-        # Popup HTML đơn giản
-        popup_html = f"""
-        <div style="font-family: Arial; width: 250px;">
-            <h4 style="color: #1976D2; margin: 0 0 10px 0;"> {name}</h4>
-            <p><b> Địa chỉ:</b> {address}</p>
-            <p><b> Quận:</b> {district}</p>
-            <p><b> Giờ mở:</b> {hours}</p>
-            <p><b> SĐT:</b> {phone}</p>
-        </div>
-        """
+        popup_html = _popup_html(name, address, district, hours, phone)
         
         # Màu sắc
         color = COLORS.get(district, 'gray')
@@ -101,7 +117,6 @@ def create_map():
             icon=folium.Icon(color=color, icon='plus-sign', prefix='glyphicon')
         )
         marker.add_to(marker_cluster) 
-        search_markers.append({'marker': marker, 'name': name, 'address': address})
         
         # Thêm vào group quận
         folium.CircleMarker(
@@ -114,29 +129,220 @@ def create_map():
             fillColor=color,
             fillOpacity=0.7
         ).add_to(district_groups[district])
+    
+    return district_groups
+
+
+def build_payload(pharmacies):
+    """Gói dữ liệu hiệu thuốc thành các mảng theo cột (mỗi giá trị chỉ xuất hiện một lần)"""
+    districts = {}
+    codes = []
+    for pharmacy in pharmacies:
+        district = pharmacy['district'] or 'Không rõ'
+        codes.append(districts.setdefault(district, len(districts)))
+    return {
+        'districts': list(districts),
+        'colors': [COLORS.get(d, 'gray') for d in districts],
+        'district': codes,
+        'name': [p['name'] or 'Không rõ' for p in pharmacies],
+        'street': [p['street'] for p in pharmacies],
+        'hours': [p['opening_hours'] for p in pharmacies],
+        'phone': [p['phone'] for p in pharmacies],
+        'lat': [round(p['lat'], 7) for p in pharmacies],
+        'lon': [round(p['lon'], 7) for p in pharmacies],
+    }
+
+
+def _script_json(value):
+    """JSON an toàn để nhúng trong thẻ <script>"""
+    return dumps(value).replace('</', '<\\/')
+
+
+def _add_compact_layers(m, marker_cluster, pharmacies):
+    """Nhúng dữ liệu một lần, marker và popup được tạo phía trình duyệt
+
+    Trả về (các feature group theo quận, biểu thức JS tạo mảng pharmaciesData).
+    """
+    import folium
+    payload = build_payload(pharmacies)
+    
+    # Feature group rỗng cho từng quận để LayerControl hiển thị; marker được thêm bằng JS
+    district_groups = {}
+    for district in payload['districts']:
+        district_groups[district] = folium.FeatureGroup(name=f'📍 {district}')
+        district_groups[district].add_to(m)
+    group_names = ', '.join(group.get_name() for group in district_groups.values())
+    
+    compact_js = f"""
+    <script>
+    var pharmacyPayload = {_script_json(payload)};
+    
+    // Bản ghi đầy đủ cho tìm kiếm và popup, dựng từ payload
+    function decodePharmacyPayload(d) {{
+        return d.name.map(function(name, i) {{
+            return {{
+                name: name, district: d.districts[d.district[i]], street: d.street[i],
+                phone: d.phone[i], hours: d.hours[i], lat: d.lat[i], lon: d.lon[i]
+            }};
+        }});
+    }}
+    
+    function escapeHtml(text) {{
+        return String(text).replace(/[&<>"']/g, function(c) {{
+            return {{'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}}[c];
+        }});
+    }}
+    
+    function pharmacyPopupHtml(p) {{
+        var address = p.street ? p.street + ', ' + p.district : p.district;
+        return '<div style="font-family: Arial; width: 250px;">' +
+            '<h4 style="color: #1976D2; margin: 0 0 10px 0;"> ' + escapeHtml(p.name) + '</h4>' +
+            '<p><b> Địa chỉ:</b> ' + escapeHtml(address) + '</p>' +
+            '<p><b> Quận:</b> ' + escapeHtml(p.district) + '</p>' +
+            '<p><b> Giờ mở:</b> ' + escapeHtml(p.hours) + '</p>' +
+            '<p><b> SĐT:</b> ' + escapeHtml(p.phone) + '</p></div>';
+    }}
+    
+    // Popup chỉ được tạo khi người dùng click lần đầu
+    function bindLazyPopup(layer, p) {{
+        layer.once('click', function() {{
+            layer.bindPopup(pharmacyPopupHtml(p), {{maxWidth: 300}}).openPopup();
+        }});
+    }}
+    
+    document.addEventListener('DOMContentLoaded', function() {{
+        var d = pharmacyPayload;
+        var data = decodePharmacyPayload(d);
+        var groups = [{group_names}];
+        var icons = {{}};
+        var markers = [];
+        data.forEach(function(p, i) {{
+            var color = d.colors[d.district[i]];
+            if (!icons[color]) {{
+                icons[color] = L.AwesomeMarkers.icon({{
+                    icon: 'plus-sign', prefix: 'glyphicon', markerColor: color, iconColor: 'white'
+                }});
+            }}
+            var marker = L.marker([p.lat, p.lon], {{icon: icons[color]}}).bindTooltip(p.name);
+            bindLazyPopup(marker, p);
+            markers.push(marker);
+            
+            var circle = L.circleMarker([p.lat, p.lon], {{
+                radius: 6, color: color, fill: true, fillColor: color, fillOpacity: 0.7
+            }}).bindTooltip(p.name);
+            bindLazyPopup(circle, p);
+            groups[d.district[i]].addLayer(circle);
+        }});
+        // Thêm hàng loạt vào cluster (nhanh hơn nhiều so với thêm từng marker)
+        {marker_cluster.get_name()}.addLayers(markers);
+    }});
+    </script>
+    """
+    m.get_root().html.add_child(folium.Element(compact_js))
+    return district_groups, "decodePharmacyPayload(pharmacyPayload)"
+
+
+def _add_heatmap(m):
+    """Lớp heatmap từ raster KDE đã tính sẵn (results/density_kde.npz); bỏ qua nếu chưa có"""
+    from folium.plugins import HeatMap
+    from density import KDE_FILE, heat_points
+    
+    points = heat_points(KDE_FILE)
+    if not points:
+        return None
+    print(f" Thêm lớp heatmap mật độ ({len(points)} ô)")
+    return HeatMap(points, name='🔥 Mật độ hiệu thuốc', radius=18, blur=15, min_opacity=0.3).add_to(m)
+
+
+def create_map(output_map=OUTPUT_MAP, compact=False, heatmap=True, data_file=DATA_FILE):
+    """Tạo bản đồ hiệu thuốc
+
+    Với compact=True, dữ liệu hiệu thuốc được nhúng vào trang đúng một lần dưới dạng
+    mảng theo cột; marker, cluster, lớp theo quận và popup (tạo khi click) được dựng
+    phía trình duyệt. File HTML nhỏ hơn nhiều khi có nhiều hiệu thuốc.
+    Với heatmap=True, lớp mật độ được vẽ từ raster KDE (không từ từng điểm).
+    """
+    # folium chỉ được nạp khi thật sự vẽ bản đồ (import module này vẫn nhanh)
+    import folium
+    from folium.plugins import MarkerCluster
+    
+    print("  Đang tạo bản đồ...")
+    
+    # Đọc dữ liệu (từ cache dạng cột, không phân tích lại GeoJSON)
+    with span("map.load") as s:
+        pharmacies = load_table(data_file).records()
+        s.items = len(pharmacies)
+    print(f" Tìm thấy {len(pharmacies)} hiệu thuốc")
+    
+    # Tạo bản đồ
+    m = folium.Map(location=HANOI_CENTER, zoom_start=11, tiles='OpenStreetMap')
+    
+    # Thêm tile layer khác
+    folium.TileLayer('CartoDB positron', name='Light Map').add_to(m)
+    
+    # Tạo marker cluster
+    marker_cluster = MarkerCluster(name='Tất cả hiệu thuốc').add_to(m)
+    
+    with span("map.markers", items=len(pharmacies), compact=compact):
+        if compact:
+            district_groups, search_data_js = _add_compact_layers(m, marker_cluster, pharmacies)
+        else:
+            district_groups = _add_inline_markers(m, marker_cluster, pharmacies)
+            search_data_js = None
 
+    if heatmap:
+        with span("map.heatmap"):
+            _add_heatmap(m)
+    
     # Layer control
     folium.LayerControl(collapsed=False).add_to(m)
     
     # Thêm chức năng tìm kiếm hiện đại với autocomplete và zoom
-    search_data = []
-    for pharmacy in pharmacies:
-        props = pharmacy['properties']
-        coords = pharmacy['geometry']['coordinates']
-        search_data.append({
-            'name': props.get('name', 'Không rõ'),
-            'district': props.get('district', 'Không rõ'),
-            'street': props.get('street', ''),
-            'phone': props.get('phone', 'Không có'),
-            'hours': props.get('opening_hours', 'Không có thông tin'),
-            'lat': coords[1],
-            'lon': coords[0]
-        })
+    if search_data_js is None:
+        search_data = []
+        for pharmacy in pharmacies:
+            search_data.append({
+                'name': pharmacy['name'] or 'Không rõ',
+                'district': pharmacy['district'] or 'Không rõ',
+                'street': pharmacy['street'],
+                'phone': pharmacy['phone'],
+                'hours': pharmacy['opening_hours'],
+                'lat': pharmacy['lat'],
+                'lon': pharmacy['lon']
+            })
+        search_data_js = _script_json(search_data)
     
     # Tạo JavaScript cho tìm kiếm hiện đại
     search_js = f"""
     <script>
-    var pharmaciesData = {json.dumps(search_data, ensure_ascii=False)};
+    var pharmaciesData = {search_data_js};
+    var pharmacySearchIndex = {_script_json(build_search_index(pharmacies))};
+    
+    // Bỏ dấu giống fold_accents phía Python: "Đống Đa" -> "dong da"
+    function foldSearchText(text) {{
+        return text.normalize('NFD').replace(/[\\u0300-\\u036f]/g, '')
+            .replace(/đ/g, 'd').replace(/Đ/g, 'D').toLowerCase().replace(/\\s+/g, ' ').trim();
+    }}
+    
+    // Tìm theo chỉ mục: chỉ duyệt danh sách ứng viên ngắn nhất, không quét toàn bộ dữ liệu
+    function searchPharmacies(query, limit) {{
+        var idx = pharmacySearchIndex;
+        var candidates;
+        if (query.length < idx.n) {{
+            // Truy vấn ngắn: khớp đầu từ, không cần xác nhận lại
+            return (idx.prefixes[query] || []).slice(0, limit).map(function(i) {{ return pharmaciesData[i]; }});
+        }}
+        for (var j = 0; j + idx.n <= query.length; j++) {{
+            var postings = idx.grams[query.substr(j, idx.n)];
+            if (!postings) return [];
+            if (!candidates || postings.length < candidates.length) candidates = postings;
+        }}
+        var matches = [];
+        for (var k = 0; k < candidates.length && matches.length < limit; k++) {{
+            if (idx.text[candidates[k]].indexOf(query) !== -1) matches.push(pharmaciesData[candidates[k]]);
+        }}
+        return matches;
+    }}
     
     // Đợi DOM load xong
     document.addEventListener('DOMContentLoaded', function() {{
@@ -164,8 +370,15 @@ def create_map():
         var clearBtn = document.getElementById('clear-search');
         
         // Tìm kiếm và hiển thị kết quả
+        // Chỉ tìm khi người dùng ngừng gõ một khoảng ngắn
+        var searchTimer = null;
         searchInput.addEventListener('input', function(e) {{
-        var query = e.target.value.toLowerCase().trim();
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(function() {{ runSearch(e.target.value); }}, {SEARCH_DEBOUNCE_MS});
+        }});
+        
+        function runSearch(value) {{
+        var query = foldSearchText(value);
         
         if (query.length === 0) {{
             searchResults.style.display = 'none';
@@ -175,12 +388,8 @@ def create_map():
         
         clearBtn.style.display = 'block';
         
-        // Lọc kết quả
-        var matches = pharmaciesData.filter(function(p) {{
-            return p.name.toLowerCase().includes(query) || 
-                   p.district.toLowerCase().includes(query) ||
-                   p.street.toLowerCase().includes(query);
-        }}).slice(0, 10); // Giới hạn 10 kết quả
+        // Lọc kết quả qua chỉ mục
+        var matches = searchPharmacies(query, 10); // Giới hạn 10 kết quả
         
         if (matches.length === 0) {{
             searchResults.innerHTML = '<div style="padding: 15px; color: #999; text-align: center;">Không tìm thấy kết quả</div>';
@@ -244,10 +453,11 @@ def create_map():
                 }}, 300);
             }});
         }});
-    }});
+    }}
         
         // Nút clear
         clearBtn.addEventListener('click', function() {{
+            clearTimeout(searchTimer);
             searchInput.value = '';
             searchResults.style.display = 'none';
             clearBtn.style.display = 'none';
@@ -279,13 +489,30 @@ def create_map():
     m.get_root().html.add_child(folium.Element(legend_html))
     
     # Lưu
-    m.save(str(OUTPUT_MAP))
-    print(f" Đã lưu: {OUTPUT_MAP}")
+    with span("map.save", items=len(pharmacies)) as s:
+        m.save(str(output_map))
+        s.output(output_map)
+    print(f" Đã lưu: {output_map}")
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Hàm chính"""
+    parser = argparse.ArgumentParser(description="Tạo bản đồ tương tác hiệu thuốc Hà Nội")
+    parser.add_argument("--output", type=Path, default=OUTPUT_MAP, help="File HTML kết quả")
+    parser.add_argument("--compact", action="store_true",
+                        help="Nhúng dữ liệu một lần, dựng marker/popup phía trình duyệt (file nhỏ hơn)")
+    parser.add_argument("--no-heatmap", action="store_true", help="Không thêm lớp heatmap mật độ")
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_from_args(args)
+    
     print("="*60)
     print("TRỰC QUAN HÓA BẢN ĐỒ HIỆU THUỐC HÀ NỘI")
     print("="*60)
-    create_map()
+    with stage("map"):
+        create_map(args.output, compact=args.compact, heatmap=not args.no_heatmap)
     print("\n Hoàn thành!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Phân tích giờ mở cửa (thẻ opening_hours của OSM) thành bitmap theo tuần
+
+Mỗi giá trị opening_hours được biên dịch một lần thành bitmap 7 x 96 ô 15 phút
+(thứ Hai..Chủ nhật x 00:00..23:45), nén còn 84 byte. Kiểm tra "mở cửa lúc X" cho
+mọi hiệu thuốc là một phép AND bit vector hóa trên mảng (N, 84).
+
+Hỗ trợ tập con thường gặp của cú pháp OSM:
+- "24/7"
+- ngày: Mo, Tu, We, Th, Fr, Sa, Su (chấp nhận cả Mon, Sun...), khoảng "Mo-Fr",
+  khoảng vòng "Sa-Mo", danh sách "Mo,We,Fr"
+- giờ: "07:00-22:00", nhiều khoảng "08:00-12:00,13:30-17:00", qua đêm "22:00-02:00",
+  "24:00", "10:00+" (mở đến hết ngày)
+- "off" / "closed", nhiều quy tắc ngăn bởi ";" (quy tắc sau ghi đè các ngày nó chọn)
+- quy tắc chỉ dành cho ngày lễ (PH) được bỏ qua
+
+Giá trị nằm ngoài tập con này (tháng, sunrise...) được coi là không rõ (None).
+"""
+
+import os
+import re
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+DAYS = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BITMAP_BYTES = 7 * SLOTS_PER_DAY // 8
+
+# Đổi khi thay đổi trình phân tích: bitmap đã lưu trong cache sẽ được tính lại
+PARSER_VERSION = 1
+
+_DAY_ALIASES = {name.lower(): i for i, name in enumerate(DAYS)}
+_DAY_ALIASES.update({name.lower(): i for i, name in enumerate(
+    ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"))})
+
+_RULE_SEPARATOR = re.compile(r"\s*(?:;|\|\|)\s*")
+_DAY_TOKEN = r"(?:PH|SH|[A-Za-z]{2,3})(?![A-Za-z])"
+_DAY_RANGE = rf"{_DAY_TOKEN}(?:\s*-\s*{_DAY_TOKEN})?"
+_RULE = re.compile(rf"^(?P<days>{_DAY_RANGE}(?:\s*,\s*{_DAY_RANGE})*)?\s*(?P<times>.*)$")
+_TIME_SPAN = re.compile(r"^(\d{1,2}):(\d{2})\s*(?:-\s*(\d{1,2}):(\d{2})|(\+))$")
+
+
+class OpeningHoursError(ValueError):
+    """Giá trị opening_hours nằm ngoài tập cú pháp được hỗ trợ"""
+
+
+def _parse_days(text):
+    """Tập chỉ số ngày (0 = thứ Hai); None nếu quy tắc chỉ dành cho ngày lễ"""
+    days = set()
+    holiday_only = True
+    for part in text.split(","):
+        bounds = [token.strip() for token in part.split("-")]
+        if bounds[0].upper() in ("PH", "SH"):
+            continue
+        holiday_only = False
+        try:
+            start = _DAY_ALIASES[bounds[0].lower()]
+            end = _DAY_ALIASES[bounds[-1].lower()]
+        except KeyError as e:
+            raise OpeningHoursError(f"ngày không hợp lệ: {e.args[0]}") from None
+        # Khoảng vòng qua cuối tuần, ví dụ Sa-Mo hoặc Su-Sa
+        days.update((start + k) % 7 for k in range((end - start) % 7 + 1))
+    return None if holiday_only else days
+
+
+def _parse_times(text):
+    """Danh sách khoảng (phút bắt đầu, phút kết thúc); kết thúc có thể > 1440 nếu qua đêm"""
+    spans = []
+    for part in text.split(","):
+        match = _TIME_SPAN.match(part.strip())
+        if not match:
+            raise OpeningHoursError(f"giờ không hợp lệ: {part.strip()!r}")
+        start = int(match.group(1)) * 60 + int(match.group(2))
+        if match.group(5):
+            end = 24 * 60
+        else:
+            end = int(match.group(3)) * 60 + int(match.group(4))
+            if end <= start:
+                end += 24 * 60
+        if start > 24 * 60 or end > 48 * 60:
+            raise OpeningHoursError(f"giờ không hợp lệ: {part.strip()!r}")
+        spans.append((start, end))
+    return spans
+
+
+def parse_opening_hours(value):
+    """Bitmap bool (7, 96) của một giá trị opening_hours
+
+    Ném OpeningHoursError nếu giá trị nằm ngoài tập cú pháp được hỗ trợ.
+    """
+    week = np.zeros((7, SLOTS_PER_DAY), dtype=bool)
+    for rule in _RULE_SEPARATOR.split(value.strip()):
+        if not rule:
+            continue
+        if rule == "24/7":
+            week[:] = True
+            continue
+        if rule.lower() in ("off", "closed"):
+            week[:] = False
+            continue
+        match = _RULE.match(rule)
+        days_text, times = match.group("days"), match.group("times").strip()
+        # Quy tắc không ghi ngày áp dụng cho cả tuần
+        days = _parse_days(days_text) if days_text else set(range(7))
+        if days is None:
+            continue
+        for day in days:
+            week[day] = False
+        if times.lower() in ("off", "closed"):
+            continue
+        spans = [(0, 24 * 60)] if not times or times == "24/7" else _parse_times(times)
+        flat = week.reshape(-1)
+        for day in days:
+            for start, end in spans:
+                first = day * SLOTS_PER_DAY + start // SLOT_MINUTES
+                last = day * SLOTS_PER_DAY + -(-end // SLOT_MINUTES)
+                # Phần qua đêm của Chủ nhật quay về thứ Hai
+                slots = np.arange(first, last) % flat.size
+                flat[slots] = True
+    return week
+
+
+@lru_cache(maxsize=4096)
+def compile_opening_hours(value):
+    """Bitmap nén 84 byte (bytes) của một giá trị; None nếu trống hoặc không phân tích được"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return np.packbits(parse_opening_hours(value).reshape(-1)).tobytes()
+    except OpeningHoursError:
+        return None
+
+
+def time_slot(day, time_text=None):
+    """Chỉ số ô 15 phút trong tuần
+
+    day có thể là datetime, hoặc tên ngày ("Su", "Sun") / chỉ số (0 = thứ Hai) kèm
+    time_text dạng "HH:MM".
+    """
+    if isinstance(day, datetime):
+        return day.weekday() * SLOTS_PER_DAY + (day.hour * 60 + day.minute) // SLOT_MINUTES
+    if isinstance(day, str):
+        day = _DAY_ALIASES[day.strip().lower()]
+    hours, minutes = (int(part) for part in time_text.split(":"))
+    return int(day) * SLOTS_PER_DAY + (hours * 60 + minutes) // SLOT_MINUTES
+
+
+def parse_when(text):
+    """Thời điểm từ chuỗi dòng lệnh: "now" hoặc "Su 02:00" -> chỉ số ô trong tuần"""
+    text = text.strip()
+    if text.lower() == "now":
+        return time_slot(datetime.now())
+    day, time_text = text.split()
+    return time_slot(day, time_text)
+
+
+class OpeningHoursIndex:
+    """Bitmap giờ mở cửa của mọi hiệu thuốc: mảng (N, 84) uint8 và mặt nạ "đã biết giờ"
+
+    open_at() trả về mảng bool cho tất cả hiệu thuốc bằng một phép AND bit, có thể dùng
+    trực tiếp để lọc kết quả truy vấn bán kính (open_mask[i]).
+    """
+
+    def __init__(self, values):
+        compiled = [compile_opening_hours(value) for value in values]
+        self.known = np.array([bits is not None for bits in compiled], dtype=bool)
+        empty = bytes(BITMAP_BYTES)
+        self.bits = np.frombuffer(b"".join(bits or empty for bits in compiled),
+                                  dtype=np.uint8).reshape(len(compiled), BITMAP_BYTES)
+
+    @classmethod
+    def from_table(cls, table):
+        """Tạo từ PharmacyTable; bitmap được lưu cạnh cache dạng cột để chỉ biên dịch một lần"""
+        path = table.data_dir / f"opening_hours.v{PARSER_VERSION}.npz"
+        source_hash = table.meta.get('source_hash') or ''
+        if path.exists():
+            with np.load(path) as data:
+                if str(data['source_hash']) == source_hash:
+                    index = cls.__new__(cls)
+                    index.bits, index.known = data['bits'], data['known']
+                    return index
+        index = cls(table.column('opening_hours'))
+        # Ghi file tạm rồi đổi tên: các bước chạy song song có thể cùng tạo bitmap này
+        fd, tmp_path = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, bits=index.bits, known=index.known, source_hash=source_hash)
+        os.replace(tmp_path, path)
+        return index
+
+    def __len__(self):
+        return len(self.bits)
+
+    def open_at(self, slot, unknown=False):
+        """Mảng bool: hiệu thuốc nào mở cửa tại ô slot (xem time_slot/parse_when)
+
+        unknown: giá trị trả về cho hiệu thuốc không có/không phân tích được giờ mở cửa.
+        """
+        slot = int(slot) % (7 * SLOTS_PER_DAY)
+        is_open = (self.bits[:, slot >> 3] & (0x80 >> (slot & 7))) != 0
+        if unknown:
+            is_open |= ~self.known
+        return is_open
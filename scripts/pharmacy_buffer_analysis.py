@@ -1,23 +1,33 @@
 """
 Tìm tất cả hiệu thuốc trong bán kính X mét quanh một điểm (lat, lon)
+
+Có thể chạy cho một điểm (mặc định: Bệnh viện Bạch Mai) hoặc theo lô cho nhiều điểm
+trung tâm và nhiều bán kính cùng lúc:
+
+    python pharmacy_buffer_analysis.py --centres ../data/hospitals.csv --radius 500 1000 2000
+
+Dữ liệu hiệu thuốc chỉ được đọc một lần, các truy vấn được chia cho nhiều tiến trình,
+kết quả ghi ra bảng CSV/Parquet. Vẽ bản đồ buffer là bước tùy chọn (--map).
+
+Có thể chỉ tính các hiệu thuốc đang mở cửa tại một thời điểm:
+
+    python pharmacy_buffer_analysis.py --radius 2000 --open-at "Su 02:00"
 """
 
-import json
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
-from math import radians, cos, sin, asin, sqrt
-import folium
-
-# Công thức Haversine để tính khoảng cách giữa hai điểm vĩ độ/kinh độ (tính bằng mét)
-def haversine(lon1, lat1, lon2, lat2):
-    # chuyển đổi độ thập phân sang radian
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    # công thức haversine
-    dlon = lon2 - lon1 
-    dlat = lat2 - lat1 
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a)) 
-    r = 6371000  # Bán kính của trái đất tính bằng mét
-    return c * r
+
+import numpy as np
+
+from columnar_cache import load_table
+from geojson_io import load_geojson
+from instrumentation import add_metrics_arguments, configure_from_args, span, stage
+from opening_hours import OpeningHoursIndex, parse_when
+from spatial_index import PharmacyIndex
 
 # Cấu hình
 DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
@@ -31,74 +41,304 @@ RADIUS_M = 1000  # bán kính (mét)
 # File HTML kết quả
 OUTPUT_MAP = Path(__file__).parent.parent / "results" / "pharmacies_buffer_map.html"
 
-with open(DATA_FILE, 'r', encoding='utf-8') as f:
-    data = json.load(f)
+# File bảng kết quả khi chạy theo lô
+OUTPUT_TABLE = Path(__file__).parent.parent / "results" / "buffer_analysis.csv"
+
+# Cột của bảng kết quả
+RESULT_COLUMNS = ['centre_id', 'radius_m', 'count', 'nearest_distance_m', 'pharmacy_ids']
+
+# Số điểm trung tâm mỗi tiến trình xử lý trong một lần gửi việc
+CENTRES_PER_TASK = 256
+
+
+def load_pharmacies(data_file=DATA_FILE):
+    """Đọc dữ liệu hiệu thuốc đã làm sạch (bảng dạng cột từ cache)"""
+    return load_table(data_file)
+
+
+def pharmacy_ids(table):
+    """Id ổn định của từng hiệu thuốc: id OSM nếu có, nếu không thì dùng vị trí trong file"""
+    return [osm_id or f"#{i}" for i, osm_id in enumerate(table.column('osm_id'))]
+
 
-pharmacies = data['features']
+def open_mask(table, open_at=None):
+    """Mặt nạ bool các hiệu thuốc mở cửa tại open_at ("Su 02:00", "now"); None nếu không lọc"""
+    if not open_at:
+        return None
+    return OpeningHoursIndex.from_table(table).open_at(parse_when(open_at))
 
 
-# Tìm hiệu thuốc trong bán kính
-in_radius = []
-for pharmacy in pharmacies:
-    coords = pharmacy['geometry']['coordinates']  # Lấy tọa độ (kinh độ, vĩ độ) của hiệu thuốc
-    lon, lat = coords[0], coords[1] # Gán kinh độ cho lon, vĩ độ cho lat
-    dist = haversine(CENTER_LON, CENTER_LAT, lon, lat)# Tính khoảng cách từ điểm trung tâm đến hiệu thuốc (đơn vị mét)
-    if dist <= RADIUS_M: # Nếu khoảng cách nhỏ hơn hoặc bằng bán kính cho trước
+def find_in_radius(index, table, ids, center_lat, center_lon, radius_m, mask=None):
+    """Tìm hiệu thuốc trong bán kính (dùng chỉ mục không gian thay cho quét tuần tự)
+
+    mask: mảng bool (ví dụ từ open_mask) — chỉ giữ các hiệu thuốc có mask[i] đúng.
+    """
+    districts = table.district_names()
+    in_radius = []
+    for i, dist in index.within_radius(center_lat, center_lon, radius_m):
+        if mask is not None and not mask[i]:
+            continue
         in_radius.append({ # Thêm hiệu thuốc vào danh sách in_radius với các thông tin:
-            'name': pharmacy['properties'].get('name', 'Không rõ'), # Tên hiệu thuốc (nếu không có thì ghi 'Không rõ')
-            'district': pharmacy['properties'].get('district', 'Không rõ'),
-            'street': pharmacy['properties'].get('street', ''),
+            'id': ids[i],
+            'name': table.get('name', i) or 'Không rõ', # Tên hiệu thuốc (nếu không có thì ghi 'Không rõ')
+            'district': districts[i] or 'Không rõ',
+            'street': table.get('street', i),
             'distance_m': round(dist, 1),
-            'lat': lat, # Vĩ độ
-            'lon': lon # Kinh độ
+            'lat': float(index.lats[i]), # Vĩ độ
+            'lon': float(index.lons[i]) # Kinh độ
+        })
+    return in_radius
+
+
+def load_centres(path):
+    """Đọc danh sách điểm trung tâm từ file CSV (cột id, lat, lon) hoặc GeoJSON (Point)
+
+    Trả về danh sách (centre_id, lat, lon).
+    """
+    path = Path(path)
+    centres = []
+    if path.name.lower().endswith(('.geojson', '.json', '.geojson.gz', '.json.gz')):
+        for i, feature in enumerate(load_geojson(path)['features']):
+            props = feature.get('properties') or {}
+            lon, lat = feature['geometry']['coordinates'][:2]
+            centre_id = props.get('id') or props.get('@id') or feature.get('id') or props.get('name') or str(i)
+            centres.append((str(centre_id), float(lat), float(lon)))
+        return centres
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            centre_id = row.get('centre_id') or row.get('id') or row.get('name') or str(i)
+            lat = row.get('lat', row.get('latitude'))
+            lon = row.get('lon', row.get('lng', row.get('longitude')))
+            if lat is None or lon is None:
+                raise ValueError(f"{path}: thiếu cột lat/lon ở dòng {i + 2}")
+            centres.append((centre_id, float(lat), float(lon)))
+    return centres
+
+
+def query_centre(index, ids, centre, radii, mask=None):
+    """Trả lời mọi bán kính cho một điểm trung tâm bằng một truy vấn ở bán kính lớn nhất
+
+    Với mask, chỉ tính các hiệu thuốc có mask[i] đúng (khoảng cách gần nhất cũng vậy).
+    """
+    centre_id, lat, lon = centre
+    hits = sorted(index.within_radius(lat, lon, max(radii)), key=lambda item: (item[1], item[0]))
+    if mask is None:
+        nearest = index.nearest(lat, lon, 1)
+    else:
+        hits = [(i, dist) for i, dist in hits if mask[i]]
+        nearest = hits[:1]
+        # Hiệu thuốc mở cửa gần nhất có thể nằm ngoài bán kính lớn nhất
+        open_cols = np.flatnonzero(mask & index.valid) if not nearest else ()
+        if len(open_cols):
+            dists = index.engine.distances(lon, lat, open_cols)[0]
+            nearest = [(None, float(dists.min()))]
+    nearest_distance = round(nearest[0][1], 1) if nearest else None
+    rows = []
+    for radius in radii:
+        inside = [i for i, dist in hits if dist <= radius]
+        rows.append({
+            'centre_id': centre_id,
+            'radius_m': radius,
+            'count': len(inside),
+            'nearest_distance_m': nearest_distance,
+            'pharmacy_ids': ';'.join(ids[i] for i in inside),
         })
+    return rows
+
+
+# Trạng thái của mỗi tiến trình con: chỉ mục được xây một lần khi tiến trình khởi động
+_worker_state = {}
+
+
+def _init_worker(data_file, open_at=None):
+    table = load_pharmacies(data_file)
+    _worker_state['index'] = PharmacyIndex(table.lon, table.lat)
+    _worker_state['ids'] = pharmacy_ids(table)
+    _worker_state['mask'] = open_mask(table, open_at)
+
 
-print(f"Có {len(in_radius)} hiệu thuốc trong bán kính {RADIUS_M}m quanh điểm ({CENTER_LAT}, {CENTER_LON})")
-for p in in_radius:
-    print(f"- {p['name']} ({p['district']}, {p['street']}) - {p['distance_m']}m")
-
-# Trực quan hóa trên bản đồ Folium
-m = folium.Map(location=[CENTER_LAT, CENTER_LON], zoom_start=15, tiles='OpenStreetMap')
-
-# Vẽ buffer (vòng tròn bán kính)
-folium.Circle(
-    location=[CENTER_LAT, CENTER_LON],
-    radius=RADIUS_M,
-    color='red',
-    fill=True,
-    fill_opacity=0.1,
-    popup=f"Bán kính {RADIUS_M}m"
-).add_to(m)
-
-# Marker điểm trung tâm
-folium.Marker(
-    location=[CENTER_LAT, CENTER_LON],
-    icon=folium.Icon(color='red', icon='star'),
-    popup="Điểm trung tâm"
-).add_to(m)
-
-# Marker các hiệu thuốc trong bán kính (màu xanh đậm)
-for p in in_radius:
+def _query_chunk(centres, radii):
+    index, ids, mask = _worker_state['index'], _worker_state['ids'], _worker_state['mask']
+    rows = []
+    for centre in centres:
+        rows.extend(query_centre(index, ids, centre, radii, mask))
+    return rows
+
+
+def run_batch(centres, radii, data_file=DATA_FILE, workers=None, open_at=None):
+    """Phân tích buffer cho nhiều điểm trung tâm và nhiều bán kính
+
+    Trả về danh sách dòng kết quả (centre_id, radius_m, count, nearest_distance_m,
+    pharmacy_ids) theo thứ tự điểm trung tâm rồi bán kính. Với open_at ("Su 02:00"),
+    chỉ tính các hiệu thuốc mở cửa tại thời điểm đó.
+    """
+    radii = sorted(set(radii))
+    chunks = [centres[i:i + CENTRES_PER_TASK] for i in range(0, len(centres), CENTRES_PER_TASK)]
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(chunks))
+
+    if workers <= 1 or len(chunks) <= 1:
+        _init_worker(data_file, open_at)
+        return [row for chunk in chunks for row in _query_chunk(chunk, radii)]
+
+    rows = []
+    # spawn thay vì fork: run_all chạy bước này trong một luồng, song song với các bước khác;
+    # fork một tiến trình nhiều luồng có thể sao chép khóa đang bị giữ và treo tiến trình con
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data_file, open_at), mp_context=get_context('spawn')) as executor:
+        for chunk_rows in executor.map(_query_chunk, chunks, [radii] * len(chunks)):
+            rows.extend(chunk_rows)
+    return rows
+
+
+def write_results(rows, output):
+    """Ghi bảng kết quả ra CSV, hoặc Parquet nếu đuôi file là .parquet"""
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if output.suffix.lower() == '.parquet':
+        import pandas as pd
+        pd.DataFrame(rows, columns=RESULT_COLUMNS).to_parquet(output, index=False)
+        return
+    with open(output, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def render_buffer_map(table, index, ids, in_radius, center_lat, center_lon, radius_m, output_map=OUTPUT_MAP,
+                      closed=(), open_at=None):
+    """Trực quan hóa hiệu thuốc trong/ngoài bán kính trên bản đồ Folium
+
+    closed: hiệu thuốc trong bán kính nhưng bị loại bởi bộ lọc --open-at (vẽ màu riêng,
+    không lẫn với hiệu thuốc ngoài bán kính).
+    """
+    import folium
+
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=15, tiles='OpenStreetMap')
+
+    # Vẽ buffer (vòng tròn bán kính)
+    folium.Circle(
+        location=[center_lat, center_lon],
+        radius=radius_m,
+        color='red',
+        fill=True,
+        fill_opacity=0.1,
+        popup=f"Bán kính {radius_m}m" + (f"<br>Màu xanh: mở cửa lúc {open_at}<br>Màu cam: đóng cửa" if open_at else "")
+    ).add_to(m)
+
+    # Marker điểm trung tâm
     folium.Marker(
-        location=[p['lat'], p['lon']],
-        popup=f" {p['name']}<br> {p['street']}, {p['district']}<br> {p['distance_m']}m",
-        icon=folium.Icon(color='blue', icon='plus-sign', prefix='glyphicon')
+        location=[center_lat, center_lon],
+        icon=folium.Icon(color='red', icon='star'),
+        popup="Điểm trung tâm"
     ).add_to(m)
 
-# Marker các hiệu thuốc ngoài bán kính (màu xám nhạt)
-for pharmacy in pharmacies:
-    coords = pharmacy['geometry']['coordinates']
-    lon, lat = coords[0], coords[1]
-    if not any(abs(lat-p['lat'])<1e-6 and abs(lon-p['lon'])<1e-6 for p in in_radius):
+    # Marker các hiệu thuốc trong bán kính (màu xanh đậm)
+    for p in in_radius:
+        folium.Marker(
+            location=[p['lat'], p['lon']],
+            popup=f" {p['name']}<br> {p['street']}, {p['district']}<br> {p['distance_m']}m",
+            icon=folium.Icon(color='blue', icon='plus-sign', prefix='glyphicon')
+        ).add_to(m)
+
+    # Marker các hiệu thuốc trong bán kính nhưng đóng cửa lúc open_at (màu cam)
+    for p in closed:
+        folium.Marker(
+            location=[p['lat'], p['lon']],
+            popup=f" {p['name']}<br> {p['street']}, {p['district']}<br> {p['distance_m']}m"
+                  f"<br> Đóng cửa lúc {open_at}",
+            icon=folium.Icon(color='orange', icon='minus-sign', prefix='glyphicon')
+        ).add_to(m)
+
+    # Marker các hiệu thuốc ngoài bán kính (màu xám nhạt)
+    # Phân loại trong/ngoài bằng id trong một lần duyệt, không so sánh tọa độ
+    inside_ids = {p['id'] for p in in_radius} | {p['id'] for p in closed}
+    names = table.column('name')
+    for i in range(len(table)):
+        if ids[i] in inside_ids or not index.valid[i]:
+            continue
         folium.CircleMarker(
-            location=[lat, lon],
+            location=[float(index.lats[i]), float(index.lons[i])],
             radius=4,
             color='gray',
             fill=True,
             fill_opacity=0.3,
-            popup=pharmacy['properties'].get('name', 'Không rõ')
+            popup=names[i] or 'Không rõ'
         ).add_to(m)
 
-# Lưu bản đồ
-m.save(str(OUTPUT_MAP))
-print(f"\n Đã lưu bản đồ buffer: {OUTPUT_MAP}")
+    # Lưu bản đồ
+    m.save(str(output_map))
+    print(f"\n Đã lưu bản đồ buffer: {output_map}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phân tích hiệu thuốc trong bán kính quanh các điểm trung tâm")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File GeoJSON hiệu thuốc đã làm sạch")
+    parser.add_argument("--centres", type=Path,
+                        help="File CSV (id, lat, lon) hoặc GeoJSON các điểm trung tâm")
+    parser.add_argument("--lat", type=float, default=CENTER_LAT, help="Vĩ độ điểm trung tâm (khi không có --centres)")
+    parser.add_argument("--lon", type=float, default=CENTER_LON, help="Kinh độ điểm trung tâm (khi không có --centres)")
+    parser.add_argument("--radius", type=float, nargs='+', default=[RADIUS_M], help="Một hoặc nhiều bán kính (mét)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_TABLE, help="File kết quả .csv hoặc .parquet")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình (mặc định: số CPU)")
+    parser.add_argument("--open-at", default=None,
+                        help='Chỉ tính hiệu thuốc mở cửa tại thời điểm này, ví dụ "Su 02:00" hoặc "now"')
+    parser.add_argument("--map", action="store_true",
+                        help="Vẽ bản đồ buffer cho điểm trung tâm đầu tiên và bán kính nhỏ nhất")
+    parser.add_argument("--map-output", type=Path, default=OUTPUT_MAP, help="File HTML bản đồ buffer")
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_from_args(args)
+
+    radii = [int(r) if float(r).is_integer() else r for r in args.radius]
+    if args.centres:
+        centres = load_centres(args.centres)
+    else:
+        centres = [('center', args.lat, args.lon)]
+    print(f" Đang phân tích {len(centres)} điểm trung tâm x {len(set(radii))} bán kính...")
+
+    if args.open_at:
+        print(f" Chỉ tính hiệu thuốc mở cửa lúc {args.open_at}")
+    with stage("buffer", items=len(centres) * len(radii)):
+        with span("buffer.query", items=len(centres) * len(radii)):
+            rows = run_batch(centres, radii, args.data, args.workers, args.open_at)
+        with span("buffer.write", items=len(rows)) as s:
+            write_results(rows, args.output)
+            s.output(args.output)
+    print(f" Đã lưu bảng kết quả: {args.output} ({len(rows)} dòng)")
+
+    if len(centres) == 1:
+        for row in rows:
+            print(f"Có {row['count']} hiệu thuốc trong bán kính {row['radius_m']}m "
+                  f"quanh điểm ({centres[0][1]}, {centres[0][2]})")
+
+    if args.map:
+        with span("buffer.map") as s:
+            table = load_pharmacies(args.data)
+            index = PharmacyIndex(table.lon, table.lat)
+            ids = pharmacy_ids(table)
+            _, center_lat, center_lon = centres[0]
+            radius_m = min(radii)
+            in_radius = find_in_radius(index, table, ids, center_lat, center_lon, radius_m)
+            closed = []
+            mask = open_mask(table, args.open_at)
+            if mask is not None:
+                # Hiệu thuốc trong bán kính nhưng đóng cửa được vẽ riêng, không lẫn vào nhóm ngoài bán kính
+                open_ids = {p['id'] for p in find_in_radius(index, table, ids, center_lat, center_lon,
+                                                            radius_m, mask)}
+                closed = [p for p in in_radius if p['id'] not in open_ids]
+                in_radius = [p for p in in_radius if p['id'] in open_ids]
+            for p in in_radius:
+                print(f"- {p['name']} ({p['district']}, {p['street']}) - {p['distance_m']}m")
+            render_buffer_map(table, index, ids, in_radius, center_lat, center_lon, radius_m, args.map_output,
+                              closed, args.open_at)
+            s.items = len(in_radius)
+            s.output(args.map_output)
+
+    return rows
+
+
+if __name__ == "__main__":
+    main()
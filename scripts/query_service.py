@@ -0,0 +1,406 @@
+"""
+Dịch vụ truy vấn hiệu thuốc chạy lâu dài (HTTP + asyncio, chỉ dùng thư viện chuẩn)
+
+clean_pharmacy.geojson được đọc một lần vào bộ nhớ (chỉ mục KD-tree, bitmap giờ mở
+cửa, thống kê theo quận); mỗi request chỉ là một truy vấn trên dữ liệu đã nạp:
+
+    GET /radius?lat=21.0021&lon=105.852&r=1000[&open=now|Su+02:00][&limit=50]
+    GET /nearest?lat=21.0021&lon=105.852&k=5[&open=now]
+    GET /districts
+    GET /health
+
+Kết quả trả về dạng JSON. Các truy vấn radius/nearest đến cùng lúc được gom thành lô:
+trong khi một lô đang được tính (ở luồng phụ, event loop vẫn nhận request), các request
+mới xếp hàng và được trả lời chung ở lô kế tiếp, truy vấn trùng nhau chỉ tính một lần.
+
+Khi bước làm sạch ghi file mới (ghi file tạm rồi đổi tên), dịch vụ phát hiện thay đổi
+theo stat của file, nạp dữ liệu mới ở luồng phụ rồi thay cả bộ dữ liệu bằng một phép
+gán: mỗi request dùng trọn một phiên bản dữ liệu, không bao giờ thấy dữ liệu nửa cũ nửa
+mới. Nếu nạp lỗi, dịch vụ tiếp tục phục vụ dữ liệu cũ.
+
+    python query_service.py --port 8765
+"""
+
+import argparse
+import asyncio
+import heapq
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http import HTTPStatus
+from operator import itemgetter
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from geojson_io import dumps, iter_geojson_features
+from instrumentation import add_metrics_arguments, configure_from_args, span
+from opening_hours import OpeningHoursIndex, parse_when
+from spatial_index import PharmacyIndex
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Chu kỳ kiểm tra file dữ liệu có thay đổi không (giây)
+RELOAD_INTERVAL_S = 1.0
+# Số truy vấn tối đa trong một lô
+MAX_BATCH = 256
+# Giới hạn tham số để một request không chiếm hết dịch vụ
+MAX_RADIUS_M = 50_000
+MAX_K = 100
+DEFAULT_LIMIT = 100
+# Số mặt nạ "mở cửa lúc X" được giữ lại (theo ô 15 phút)
+OPEN_MASK_CACHE = 32
+# Kích thước tối đa của dòng yêu cầu/header
+MAX_HEADER_BYTES = 16 * 1024
+
+
+class QueryError(ValueError):
+    """Tham số truy vấn không hợp lệ (trả về HTTP 400)"""
+
+
+class Snapshot:
+    """Một phiên bản dữ liệu đã nạp: chỉ mục, thuộc tính, giờ mở cửa; không thay đổi sau khi tạo"""
+
+    def __init__(self, features, source=None, stat=None):
+        self.source = str(source) if source else None
+        self.stat = stat
+        self.loaded_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        props = [feature.get('properties') or {} for feature in features]
+        lons = [feature['geometry']['coordinates'][0] for feature in features]
+        lats = [feature['geometry']['coordinates'][1] for feature in features]
+        self.index = PharmacyIndex(lons, lats)
+        self.ids = [p.get('osm_id') or f"#{i}" for i, p in enumerate(props)]
+        self.names = [p.get('name') or 'Không rõ' for p in props]
+        self.districts = [p.get('district') or None for p in props]
+        self.streets = [p.get('street') or '' for p in props]
+        self.phones = [p.get('phone') or '' for p in props]
+        self.opening_hours = [p.get('opening_hours') or '' for p in props]
+        self.hours = OpeningHoursIndex(self.opening_hours)
+        self.district_counts = dict(Counter(d or 'Không rõ' for d in self.districts).most_common())
+        self._open_masks = {}
+
+    @classmethod
+    def load(cls, path=DATA_FILE):
+        """Đọc file GeoJSON đã làm sạch (file được thay bằng đổi tên nên luôn đọc được bản đầy đủ)"""
+        stat = file_stat(path)
+        return cls(list(iter_geojson_features(path)), path, stat)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def open_mask(self, when):
+        """Mặt nạ bool hiệu thuốc mở cửa lúc when ("now", "Su 02:00"); None nếu không lọc"""
+        if not when:
+            return None
+        try:
+            slot = parse_when(when)
+        except (ValueError, KeyError):
+            raise QueryError(f'open phải là "now" hoặc dạng "Su 02:00", nhận được {when!r}')
+        mask = self._open_masks.get(slot)
+        if mask is None:
+            if len(self._open_masks) >= OPEN_MASK_CACHE:
+                self._open_masks.pop(next(iter(self._open_masks)))
+            mask = self._open_masks[slot] = self.hours.open_at(slot)
+        return mask
+
+    def pharmacy(self, i, distance_m):
+        return {
+            'id': self.ids[i],
+            'name': self.names[i],
+            'district': self.districts[i] or 'Không rõ',
+            'street': self.streets[i],
+            'phone': self.phones[i],
+            'opening_hours': self.opening_hours[i],
+            'lat': float(self.index.lats[i]),
+            'lon': float(self.index.lons[i]),
+            'distance_m': round(distance_m, 1),
+        }
+
+    def radius(self, lat, lon, r, open_at=None, limit=DEFAULT_LIMIT):
+        """Hiệu thuốc trong bán kính r mét, gần nhất trước; count là tổng số (trước limit)"""
+        mask = self.open_mask(open_at)
+        hits = self.index.within_radius(lat, lon, r)
+        if mask is not None:
+            hits = [(i, dist) for i, dist in hits if mask[i]]
+        # hits đã theo thứ tự chỉ số; nsmallest ổn định nên khoảng cách bằng nhau vẫn theo chỉ số
+        nearest = heapq.nsmallest(limit, hits, key=itemgetter(1))
+        return {'count': len(hits), 'pharmacies': [self.pharmacy(i, dist) for i, dist in nearest]}
+
+    def nearest(self, lat, lon, k, open_at=None):
+        """k hiệu thuốc gần nhất (chỉ tính hiệu thuốc mở cửa nếu có open_at)"""
+        mask = self.open_mask(open_at)
+        if mask is None:
+            hits = self.index.nearest(lat, lon, k)
+        else:
+            # Hiệu thuốc mở cửa gần nhất có thể ở rất xa: quét vector hóa trên tập đang mở
+            cols = np.flatnonzero(mask & self.index.valid)
+            dists = self.index.engine.distances(lon, lat, cols)[0]
+            order = np.lexsort((cols, dists))[:k]
+            hits = list(zip(cols[order].tolist(), dists[order].tolist()))
+        return {'count': len(hits), 'pharmacies': [self.pharmacy(i, dist) for i, dist in hits]}
+
+    def answer(self, kind, params):
+        if kind == 'radius':
+            return self.radius(**params)
+        return self.nearest(**params)
+
+    def answer_batch(self, queries):
+        """Trả lời một lô (kind, params); truy vấn trùng nhau chỉ tính một lần
+
+        Trả về danh sách (kết quả, lỗi) theo thứ tự của queries.
+        """
+        done = {}
+        results = []
+        for kind, params in queries:
+            key = (kind, tuple(sorted(params.items())))
+            if key not in done:
+                try:
+                    done[key] = (self.answer(kind, params), None)
+                except Exception as e:
+                    done[key] = (None, e)
+            results.append(done[key])
+        return results
+
+
+def file_stat(path):
+    """Dấu hiệu nhận biết file đã được thay (inode, kích thước, thời gian sửa); None nếu chưa có"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _float(params, name, low, high, default=None):
+    value = params.get(name, [default])[0]
+    if value is None:
+        raise QueryError(f"thiếu tham số {name}")
+    try:
+        value = float(value)
+    except ValueError:
+        raise QueryError(f"{name} phải là số, nhận được {value!r}")
+    if not (low <= value <= high):
+        raise QueryError(f"{name} phải nằm trong [{low}, {high}]")
+    return value
+
+
+def parse_query(kind, query):
+    """Tham số của truy vấn radius/nearest từ query string"""
+    params = parse_qs(query)
+    parsed = {
+        'lat': _float(params, 'lat', -90, 90),
+        'lon': _float(params, 'lon', -180, 180),
+        'open_at': params.get('open', [None])[0],
+    }
+    if kind == 'radius':
+        parsed['r'] = _float(params, 'r', 0, MAX_RADIUS_M, 1000)
+        parsed['limit'] = int(_float(params, 'limit', 0, 10_000, DEFAULT_LIMIT))
+    else:
+        parsed['k'] = int(_float(params, 'k', 1, MAX_K, 1))
+    return parsed
+
+
+class QueryBatcher:
+    """Gom các truy vấn đến cùng lúc thành lô, tính ở luồng phụ trên cùng một phiên bản dữ liệu"""
+
+    def __init__(self, service, max_batch=MAX_BATCH):
+        self.service = service
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.queries = 0
+
+    async def submit(self, kind, params):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, params, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # Lấy thêm mọi truy vấn đã xếp hàng (đến trong lúc lô trước đang được tính)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            snapshot = self.service.snapshot
+            try:
+                results = await loop.run_in_executor(
+                    None, snapshot.answer_batch, [(kind, params) for kind, params, _ in batch])
+            except Exception as e:
+                results = [(None, e)] * len(batch)
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, _, future), (result, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+class QueryService:
+    """Dịch vụ HTTP: định tuyến request, gom lô truy vấn, nạp lại dữ liệu khi file thay đổi"""
+
+    def __init__(self, data_file=DATA_FILE, reload_interval=RELOAD_INTERVAL_S, max_batch=MAX_BATCH):
+        self.data_file = Path(data_file)
+        self.reload_interval = reload_interval
+        self.batcher = QueryBatcher(self, max_batch)
+        self.snapshot = None
+        self.reloads = 0
+        self._failed_stat = None
+        self.started = time.monotonic()
+        self._tasks = []
+
+    def load(self):
+        """Nạp dữ liệu lần đầu (đồng bộ, trước khi mở cổng)"""
+        with span("service.load") as s:
+            self.snapshot = Snapshot.load(self.data_file)
+            s.items = len(self.snapshot)
+        print(f" Đã nạp {len(self.snapshot)} hiệu thuốc từ {self.data_file}")
+
+    async def reload(self):
+        """Nạp phiên bản mới ở luồng phụ rồi thay bằng một phép gán; lỗi thì giữ phiên bản cũ"""
+        loop = asyncio.get_running_loop()
+        stat = file_stat(self.data_file)
+        try:
+            with span("service.reload") as s:
+                snapshot = await loop.run_in_executor(None, Snapshot.load, self.data_file)
+                s.items = len(snapshot)
+        except Exception as e:
+            # Ghi nhớ file lỗi để không thử lại cho đến khi file được thay lần nữa
+            self._failed_stat = stat
+            print(f" Nạp lại {self.data_file} lỗi, tiếp tục dùng dữ liệu cũ: {e!r}")
+            return False
+        self.snapshot = snapshot
+        self.reloads += 1
+        print(f" Đã nạp lại {len(snapshot)} hiệu thuốc ({snapshot.loaded_at})")
+        return True
+
+    async def watch(self):
+        """Kiểm tra định kỳ file dữ liệu; nạp lại khi file được thay"""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            stat = file_stat(self.data_file)
+            if stat is not None and stat not in (self.snapshot.stat, self._failed_stat):
+                await self.reload()
+
+    async def handle_request(self, method, target):
+        """Trả về (mã HTTP, dict kết quả) cho một request"""
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if method not in ("GET", "HEAD"):
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"không hỗ trợ {method}"}
+        if path in ("/radius", "/nearest"):
+            kind = path[1:]
+            try:
+                return HTTPStatus.OK, await self.batcher.submit(kind, parse_query(kind, url.query))
+            except QueryError as e:
+                return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+        if path == "/districts":
+            snapshot = self.snapshot
+            return HTTPStatus.OK, {'total': len(snapshot), 'districts': snapshot.district_counts}
+        if path == "/health":
+            snapshot = self.snapshot
+            return HTTPStatus.OK, {
+                'status': 'ok', 'pharmacies': len(snapshot), 'source': snapshot.source,
+                'loaded_at': snapshot.loaded_at, 'reloads': self.reloads,
+                'uptime_s': round(time.monotonic() - self.started, 1),
+                'batches': self.batcher.batches, 'batched_queries': self.batcher.queries,
+            }
+        return HTTPStatus.NOT_FOUND, {'error': f"không có endpoint {path}",
+                                      'endpoints': ["/radius", "/nearest", "/districts", "/health"]}
+
+    async def handle_connection(self, reader, writer):
+        """Một kết nối HTTP/1.1, hỗ trợ keep-alive"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await _send(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, {'error': "header quá lớn"},
+                                keep_alive=False)
+                    break
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split()
+                except ValueError:
+                    await _send(writer, HTTPStatus.BAD_REQUEST, {'error': "dòng yêu cầu không hợp lệ"},
+                                keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == "HTTP/1.1" else connection == 'keep-alive'
+                try:
+                    status, body = await self.handle_request(method, target)
+                except Exception as e:
+                    status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(e)}
+                await _send(writer, status, body, keep_alive, head_only=method == "HEAD")
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        """Chạy dịch vụ cho đến khi bị hủy; ready (asyncio.Event) được bật khi đã mở cổng"""
+        if self.snapshot is None:
+            self.load()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        self._tasks = [asyncio.create_task(self.batcher.run()), asyncio.create_task(self.watch())]
+        addresses = ", ".join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}" for sock in server.sockets)
+        print(f" Dịch vụ truy vấn đang chạy tại {addresses}")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+
+async def _send(writer, status, body, keep_alive=True, head_only=False):
+    payload = dumps(body).encode('utf-8')
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + (b"" if head_only else payload))
+    await writer.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP truy vấn hiệu thuốc (bán kính, gần nhất, theo quận)")
+    parser.add_argument("--data", type=Path, default=DATA_FILE, help="File GeoJSON hiệu thuốc đã làm sạch")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Địa chỉ lắng nghe (mặc định chỉ máy cục bộ)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Cổng lắng nghe")
+    parser.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL_S,
+                        help="Chu kỳ kiểm tra file dữ liệu thay đổi (giây)")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="Số truy vấn tối đa trong một lô")
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_from_args(args)
+
+    service = QueryService(args.data, args.reload_interval, args.max_batch)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n Đã dừng dịch vụ")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,308 @@
 """
 Script tổng hợp - Chạy toàn bộ pipeline phân tích hiệu thuốc Hà Nội
 Chạy file này để thực hiện tất cả các bước: làm sạch, phân tích, và tạo bản đồ
+
+Các bước được mô tả thành đồ thị phụ thuộc:
+
+    làm sạch dữ liệu -> { phân tích & thống kê, mật độ -> bản đồ tương tác, phân tích buffer,
+                          độ phủ }
+
+Mỗi bước chạy ngay trong tiến trình hiện tại (không khởi động lại Python), khai báo
+file đầu vào/đầu ra, và được bỏ qua nếu mã băm đầu vào giống lần chạy thành công
+trước đó. Các bước độc lập chạy song song.
 """
 
-import subprocess
+import argparse
+import ast
+import json
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-def run_script(script_name, description):
-    """Chạy một script Python"""
+import instrumentation
+from geojson_io import file_digest
+
+SCRIPTS_DIR = Path(__file__).parent
+DATA_DIR = SCRIPTS_DIR.parent / "data"
+RESULTS_DIR = SCRIPTS_DIR.parent / "results"
+
+# Trạng thái lần chạy thành công gần nhất của từng bước (mã băm đầu vào)
+STATE_FILE = RESULTS_DIR / ".pipeline_state.json"
+
+CLEAN_FILE = DATA_DIR / "clean_pharmacy.geojson"
+
+
+class Stage:
+    """Một bước của pipeline"""
+
+    def __init__(self, name, description, run, inputs, outputs, deps=()):
+        self.name = name
+        self.description = description
+        self.run = run
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.deps = list(deps)
+
+    def input_hashes(self):
+        """Mã băm nội dung của các file đầu vào (None nếu file không tồn tại)"""
+        return {str(p): file_digest(p) for p in self.inputs}
+
+    def outputs_exist(self):
+        return all(p.exists() for p in self.outputs)
+
+
+def _run_cleaning():
+    import data_cleaning
+    data_cleaning.clean_pharmacy_data()
+
+
+def _run_analysis():
+    import analysis
+    analysis.main([])
+
+
+def _run_density():
+    import density
+    density.main([])
+
+
+def _run_map():
+    import map_visualization
+    map_visualization.create_map()
+
+
+def _run_buffer():
+    import pharmacy_buffer_analysis
+    pharmacy_buffer_analysis.main(['--map'])
+
+
+def _run_coverage():
+    import coverage
+    coverage.main([])
+
+
+def _imported_modules(path):
+    """Tên các module được import trong một file (kể cả import bên trong hàm)"""
+    tree = ast.parse(path.read_text(encoding='utf-8'), filename=str(path))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name.split('.')[0]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            yield node.module.split('.')[0]
+
+
+def _scripts(*names):
+    """Các script của dự án mà names cần khi chạy: chính chúng và mọi module được import (đệ quy)
+
+    Danh sách được suy ra từ mã nguồn nên luôn khớp với import thật; sửa bất kỳ module nào
+    trong đó đều làm bước tương ứng chạy lại.
+    """
+    found = []
+    todo = [SCRIPTS_DIR / name for name in names]
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.append(path)
+        for module in _imported_modules(path):
+            candidate = SCRIPTS_DIR / f"{module}.py"
+            if candidate.exists() and candidate not in found:
+                todo.append(candidate)
+    return sorted(found)
+
+
+def build_stages():
+    """Đồ thị các bước: làm sạch -> {phân tích, mật độ -> bản đồ, buffer, độ phủ}"""
+    from aggregation import DISTRICT_STATS_FILE
+    from district_boundaries import DISTRICT_BOUNDARIES_FILE
+
+    return [
+        Stage("cleaning", "Bước 1: Làm sạch và tiền xử lý dữ liệu", _run_cleaning,
+              inputs=[DATA_DIR / "export.geojson", DISTRICT_BOUNDARIES_FILE,
+                      *_scripts("data_cleaning.py")],
+              outputs=[CLEAN_FILE]),
+        Stage("analysis", "Bước 2: Phân tích và thống kê", _run_analysis,
+              inputs=[CLEAN_FILE, DISTRICT_STATS_FILE,
+                      *_scripts("analysis.py")],
+              outputs=[RESULTS_DIR / "pharmacy_by_district.csv", RESULTS_DIR / "aggregates.csv",
+                       RESULTS_DIR / "chart_district.png"],
+              deps=["cleaning"]),
+        Stage("density", "Bước 3a: Tính lưới mật độ và KDE", _run_density,
+              inputs=[CLEAN_FILE, *_scripts("density.py")],
+              outputs=[RESULTS_DIR / "density_grid.geojson", RESULTS_DIR / "density_kde.npz"],
+              deps=["cleaning"]),
+        Stage("map", "Bước 3: Tạo bản đồ tương tác", _run_map,
+              inputs=[CLEAN_FILE, RESULTS_DIR / "density_kde.npz",
+                      *_scripts("map_visualization.py")],
+              outputs=[RESULTS_DIR / "pharmacies_map.html"],
+              deps=["cleaning", "density"]),
+        Stage("buffer", "Bước 4: Phân tích hiệu thuốc trong bán kính", _run_buffer,
+              inputs=[CLEAN_FILE, *_scripts("pharmacy_buffer_analysis.py")],
+              outputs=[RESULTS_DIR / "buffer_analysis.csv", RESULTS_DIR / "pharmacies_buffer_map.html"],
+              deps=["cleaning"]),
+        Stage("coverage", "Bước 5: Độ phủ - khoảng cách tới hiệu thuốc gần nhất", _run_coverage,
+              inputs=[CLEAN_FILE, DISTRICT_BOUNDARIES_FILE,
+                      *_scripts("coverage.py")],
+              outputs=[RESULTS_DIR / "coverage_distance.npy", RESULTS_DIR / "coverage_summary.csv"],
+              deps=["cleaning"]),
+    ]
+
+
+def _load_state(state_file):
+    if not Path(state_file).exists():
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(state_file, state):
+    state_file = Path(state_file)
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_file.with_name(state_file.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    tmp_path.replace(state_file)
+
+
+def run_stage(stage, last_hashes=None, force=False):
+    """Chạy một bước; trả về (trạng thái, thời gian chạy tính bằng giây, mã băm đầu vào)
+
+    Trạng thái là "done", "skipped" (đầu vào không đổi) hoặc "failed".
+    """
+    start = time.perf_counter()
+    hashes = stage.input_hashes()
+    if not force and last_hashes == hashes and stage.outputs_exist():
+        print(f" {stage.description} - đầu vào không đổi, bỏ qua")
+        return "skipped", time.perf_counter() - start, hashes
+
     print("\n" + "="*60)
-    print(f" {description}")
+    print(f" {stage.description}")
     print("="*60)
-    
-    script_path = Path(__file__).parent / script_name
-    
     try:
-        result = subprocess.run(
-            [sys.executable, str(script_path)],
-            check=True,
-            capture_output=False
-        )
-        print(f" {description} - HOÀN THÀNH!")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f" Lỗi khi chạy {script_name}: {e}")
-        return False
+        with instrumentation.stage(f"pipeline.{stage.name}") as span:
+            span.output(*stage.outputs)
+            stage.run()
     except Exception as e:
-        print(f" Lỗi không xác định: {e}")
-        return False
+        print(f" Lỗi khi chạy {stage.name}: {e!r}")
+        return "failed", time.perf_counter() - start, None
+
+    print(f" {stage.description} - HOÀN THÀNH!")
+    return "done", time.perf_counter() - start, hashes
+
+
+def check_dependencies(stages):
+    """Báo lỗi (ValueError) nếu một bước phụ thuộc vào bước không tồn tại hoặc có vòng phụ thuộc"""
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Bước {stage.name} phụ thuộc vào bước không tồn tại: {', '.join(unknown)}")
+    # Duyệt theo chiều sâu: gặp lại một bước đang nằm trên đường đi nghĩa là có vòng
+    visiting, visited = [], set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError(f"Vòng phụ thuộc giữa các bước: {' -> '.join(cycle)}")
+        visiting.append(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.pop()
+        visited.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+
+
+def run_pipeline(stages, state_file=STATE_FILE, force=False, jobs=None):
+    """Chạy các bước theo thứ tự phụ thuộc, các bước độc lập chạy song song
+
+    Trả về dict tên bước -> (trạng thái, thời gian chạy).
+    """
+    check_dependencies(stages)
+    state = _load_state(state_file)
+    results = {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs or len(stages)) as executor:
+        while pending or running:
+            # Khởi chạy mọi bước đã đủ điều kiện
+            for stage in list(pending):
+                dep_status = [results.get(dep, (None,))[0] for dep in stage.deps]
+                if any(s == "failed" or s == "blocked" for s in dep_status):
+                    pending.remove(stage)
+                    results[stage.name] = ("blocked", 0.0)
+                    print(f"\n  Bỏ qua {stage.description}: bước phụ thuộc bị lỗi")
+                elif all(s in ("done", "skipped") for s in dep_status):
+                    # Đầu vào do bước trước tạo ra đã sẵn sàng, mã băm được tính lúc này
+                    pending.remove(stage)
+                    future = executor.submit(run_stage, stage, state.get(stage.name), force)
+                    running[future] = stage
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                status, elapsed, hashes = future.result()
+                results[stage.name] = (status, elapsed)
+                if status == "done":
+                    state[stage.name] = hashes
+                    _save_state(state_file, state)
+    return results
 
 
 def main():
     """Hàm chính - chạy toàn bộ pipeline"""
+    parser = argparse.ArgumentParser(description="Chạy toàn bộ pipeline phân tích hiệu thuốc")
+    parser.add_argument("--force", action="store_true", help="Chạy lại mọi bước kể cả khi đầu vào không đổi")
+    parser.add_argument("--jobs", type=int, default=None, help="Số bước chạy song song tối đa")
+    instrumentation.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+
     print("╔" + "="*58 + "╗")
     print("║" + " "*58 + "║")
     print("║" + "   PHÂN TÍCH HỆ THỐNG HIỆU THUỐC HÀ NỘI  ".center(58) + "║")
     print("║" + "  Pipeline tự động - Chạy tất cả các bước  ".center(58) + "║")
     print("║" + " "*58 + "║")
     print("╚" + "="*58 + "╝")
-    
-    # Danh sách các bước
-    steps = [
-        ("data_cleaning.py", "Bước 1: Làm sạch và tiền xử lý dữ liệu"),
-        ("analysis.py", "Bước 2: Phân tích và thống kê"),
-        ("map_visualization.py", "Bước 3: Tạo bản đồ tương tác"),
-    ]
-    
-    success_count = 0
-    total_steps = len(steps)
-    
-    # Chạy từng bước
-    for script_name, description in steps:
-        if run_script(script_name, description):
-            success_count += 1
-        else:
-            print(f"\n  Pipeline dừng tại: {description}")
-            break
-    
+
+    stages = build_stages()
+    total_start = time.perf_counter()
+    with instrumentation.span("pipeline") as span:
+        results = run_pipeline(stages, force=args.force, jobs=args.jobs)
+        span.items = sum(1 for status, _ in results.values() if status == "done")
+    total_time = time.perf_counter() - total_start
+
     # Tổng kết
+    labels = {"done": "hoàn thành", "skipped": "bỏ qua (không đổi)",
+              "failed": "LỖI", "blocked": "không chạy"}
+    success_count = sum(1 for status, _ in results.values() if status in ("done", "skipped"))
+    total_steps = len(stages)
     print("\n" + "="*60)
     print(" TỔNG KẾT")
     print("="*60)
-    print(f" Hoàn thành: {success_count}/{total_steps} bước")
-    
+    for stage in stages:
+        status, elapsed = results[stage.name]
+        print(f"   {stage.name:<10} {labels[status]:<20} {elapsed:8.2f}s")
+    print(f" Hoàn thành: {success_count}/{total_steps} bước ({total_time:.2f}s)")
+
     if success_count == total_steps:
         print("\n Pipeline hoàn thành thành công!")
         print("\n Các file kết quả:")
         print("   • data/clean_pharmacy.geojson - Dữ liệu đã làm sạch")
         print("   • results/pharmacy_by_district.csv - Thống kê CSV")
+        print("   • results/aggregates.csv - Thống kê nhiều chiều (quận, phường, ô lưới, chuỗi)")
         print("   • results/chart_district.png - Biểu đồ phân tích")
+        print("   • results/density_grid.geojson, results/density_kde.npz - Lưới mật độ, KDE")
         print("   • results/pharmacies_map.html - Bản đồ tương tác")
+        print("   • results/buffer_analysis.csv, results/pharmacies_buffer_map.html - Phân tích buffer")
+        print("   • results/coverage_summary.csv - Khu vực thiếu hiệu thuốc (raster: coverage_distance.npy)")
         print("\n Mở file pharmacies_map.html để xem bản đồ!")
     else:
         print("\n Pipeline chưa hoàn thành. Vui lòng kiểm tra lỗi ở trên.")
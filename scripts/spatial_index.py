@@ -0,0 +1,173 @@
+"""
+Chỉ mục không gian cho dữ liệu hiệu thuốc
+
+Xây dựng một lần từ clean_pharmacy.geojson, sau đó trả lời nhanh hai loại truy vấn:
+- within_radius(lat, lon, r): các hiệu thuốc trong bán kính r mét
+- nearest(lat, lon, k): k hiệu thuốc gần nhất
+
+Các điểm được chuyển sang tọa độ 3D trên mặt cầu đơn vị và lưu trong KD-tree.
+Khoảng cách dây cung (chord) tăng đơn điệu theo khoảng cách Haversine, nên cây
+dùng chord để cắt nhánh, còn kết quả cuối cùng được lọc lại bằng lõi Haversine
+của distance.py — cùng công thức với phép quét tuần tự cũ.
+"""
+
+import heapq
+from math import radians, cos, sin
+from pathlib import Path
+
+import numpy as np
+
+from distance import EARTH_RADIUS_M, HaversineEngine
+from geojson_io import load_geojson
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "clean_pharmacy.geojson"
+
+# Số điểm tối đa trong một lá của KD-tree
+LEAF_SIZE = 16
+
+# Nới ngưỡng chord một chút để sai số làm tròn không loại nhầm điểm nằm sát biên
+_CHORD_EPS = 1e-9
+
+# Giữ chỗ cho điểm không hợp lệ để chỉ số vẫn khớp số thứ tự dòng (không nằm trong cây)
+_NAN_XYZ = (float('nan'),) * 3
+
+
+def _to_xyz(lat, lon):
+    """Chuyển vĩ độ/kinh độ sang tọa độ 3D trên mặt cầu đơn vị"""
+    lat, lon = radians(lat), radians(lon)
+    cos_lat = cos(lat)
+    return (cos_lat * cos(lon), cos_lat * sin(lon), sin(lat))
+
+
+def _chord_for_distance(distance_m):
+    """Độ dài dây cung (trên mặt cầu đơn vị) ứng với khoảng cách mặt cầu distance_m"""
+    angle = min(distance_m / EARTH_RADIUS_M, 3.141592653589793)
+    return 2 * sin(angle / 2)
+
+
+class PharmacyIndex:
+    """KD-tree trên tọa độ 3D, dùng cho truy vấn bán kính và k điểm gần nhất
+
+    Điểm có tọa độ không hữu hạn (NaN/inf) không được đưa vào cây (valid[i] sai) và không
+    bao giờ xuất hiện trong kết quả; chỉ số trả về vẫn là số thứ tự dòng ban đầu.
+    """
+
+    def __init__(self, lons, lats, features=None, leaf_size=LEAF_SIZE):
+        self.engine = HaversineEngine(lons, lats)
+        self.lons = self.engine.lons
+        self.lats = self.engine.lats
+        self.features = features
+        self.leaf_size = leaf_size
+        self.valid = np.isfinite(self.lons) & np.isfinite(self.lats)
+        self._xyz = [_to_xyz(lat, lon) if ok else _NAN_XYZ
+                     for lon, lat, ok in zip(self.lons.tolist(), self.lats.tolist(), self.valid.tolist())]
+        ids = np.flatnonzero(self.valid).tolist()
+        self._root = self._build(ids, 0) if ids else None
+
+    @classmethod
+    def from_features(cls, features, **kwargs):
+        """Tạo chỉ mục từ danh sách feature GeoJSON dạng Point"""
+        lons, lats = [], []
+        for feature in features:
+            coords = feature['geometry']['coordinates']
+            lons.append(coords[0])
+            lats.append(coords[1])
+        return cls(lons, lats, features=features, **kwargs)
+
+    @classmethod
+    def from_geojson(cls, path=DATA_FILE, **kwargs):
+        """Đọc file GeoJSON đã làm sạch và tạo chỉ mục"""
+        return cls.from_features(load_geojson(path)['features'], **kwargs)
+
+    def __len__(self):
+        return len(self._xyz)
+
+    def _build(self, ids, depth):
+        """Xây cây đệ quy: lá là danh sách chỉ số, nút trong là (trục, giá trị chia, trái, phải)"""
+        if len(ids) <= self.leaf_size:
+            return ids
+        # Chọn trục có độ trải rộng lớn nhất để cây cân bằng tốt hơn
+        xyz = self._xyz
+        axis = max(range(3), key=lambda a: max(xyz[i][a] for i in ids) - min(xyz[i][a] for i in ids))
+        ids.sort(key=lambda i: xyz[i][axis])
+        mid = len(ids) // 2
+        split = xyz[ids[mid]][axis]
+        return (axis, split, self._build(ids[:mid], depth + 1), self._build(ids[mid:], depth + 1))
+
+    def _candidates_within_chord(self, q, chord):
+        """Các chỉ số có khoảng cách dây cung tới q không vượt quá chord"""
+        chord_sq = chord * chord
+        xyz = self._xyz
+        result = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                for i in node:
+                    p = xyz[i]
+                    dx, dy, dz = p[0] - q[0], p[1] - q[1], p[2] - q[2]
+                    if dx * dx + dy * dy + dz * dz <= chord_sq:
+                        result.append(i)
+                continue
+            axis, split, left, right = node
+            diff = q[axis] - split
+            if diff - chord <= 0:
+                stack.append(left)
+            if diff + chord >= 0:
+                stack.append(right)
+        return result
+
+    def within_radius(self, lat, lon, r):
+        """Các hiệu thuốc trong bán kính r mét quanh (lat, lon)
+
+        Trả về danh sách (chỉ số, khoảng cách mét) theo thứ tự chỉ số tăng dần,
+        giống thứ tự của phép quét tuần tự.
+        """
+        if self._root is None or r < 0:
+            return []
+        q = _to_xyz(lat, lon)
+        chord = _chord_for_distance(r) * (1 + _CHORD_EPS) + _CHORD_EPS
+        cols = np.array(sorted(self._candidates_within_chord(q, chord)), dtype=np.intp)
+        if not len(cols):
+            return []
+        dists = self.engine.distances(lon, lat, cols)[0]
+        keep = dists <= r
+        return list(zip(cols[keep].tolist(), dists[keep].tolist()))
+
+    def nearest(self, lat, lon, k=1):
+        """k hiệu thuốc gần (lat, lon) nhất
+
+        Trả về danh sách (chỉ số, khoảng cách mét) sắp xếp theo khoảng cách tăng dần.
+        """
+        if self._root is None or k <= 0:
+            return []
+        q = _to_xyz(lat, lon)
+        xyz = self._xyz
+        # Max-heap (lưu giá trị âm) gồm k ứng viên tốt nhất theo bình phương chord
+        heap = []
+        stack = [(0.0, self._root)]
+        while stack:
+            bound, node = stack.pop()
+            if len(heap) == k and bound > -heap[0][0]:
+                continue
+            if isinstance(node, list):
+                for i in node:
+                    p = xyz[i]
+                    dx, dy, dz = p[0] - q[0], p[1] - q[1], p[2] - q[2]
+                    d_sq = dx * dx + dy * dy + dz * dz
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d_sq, -i))
+                    elif d_sq < -heap[0][0]:
+                        heapq.heapreplace(heap, (-d_sq, -i))
+                continue
+            axis, split, left, right = node
+            diff = q[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Nhánh xa được duyệt sau (đẩy vào stack trước)
+            stack.append((diff * diff, far))
+            stack.append((bound, near))
+        cols = np.array([-neg_i for _, neg_i in heap], dtype=np.intp)
+        dists = self.engine.distances(lon, lat, cols)[0]
+        result = list(zip(cols.tolist(), dists.tolist()))
+        result.sort(key=lambda item: (item[1], item[0]))
+        return result
@@ -0,0 +1,220 @@
+"""
+Sinh file xuất Overpass giả lập (export.geojson) với số hiệu thuốc tùy ý
+
+Dữ liệu thật chỉ có ~200 điểm nên không đo được khả năng mở rộng của pipeline.
+File sinh ra giống dữ liệu thật ở những điểm ảnh hưởng tới hiệu năng:
+- Phân bố không gian theo cụm: nội thành dày đặc, ngoại thành thưa; trong mỗi quận
+  hiệu thuốc tập trung dọc các "trục phố" (cụm con ~300m), thêm một phần nền rải đều.
+- Trộn amenity=pharmacy / shop=chemist và một phần feature không phải hiệu thuốc
+  (phòng khám, bệnh viện) mà bước làm sạch phải lọc bỏ.
+- addr:district lộn xộn: có/không dấu, "Q.", "Quận", "District", chữ hoa, Unicode NFD,
+  sai chính tả, bỏ trống.
+- opening_hours thường gặp (kể cả giá trị không phân tích được), thương hiệu chuỗi,
+  số điện thoại, phường, một phần hiệu thuốc dạng Polygon (way) và bản ghi trùng lặp.
+
+Việc sinh dữ liệu theo từng khối bằng NumPy và ghi streaming, nên tạo được file 10^7
+hiệu thuốc với bộ nhớ không đổi. Cùng seed cho cùng một file.
+"""
+
+import argparse
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from district_normalizer import fold_accents
+from geojson_io import FeatureCollectionWriter
+
+OUTPUT_DIR = Path(__file__).parent.parent / "data" / "synthetic"
+
+# Số feature được sinh trong một khối
+GENERATE_CHUNK_SIZE = 50_000
+
+# Tâm gần đúng (lat, lon), trọng số mật độ và độ trải (mét) của từng quận/huyện
+DISTRICT_CENTRES = {
+    "Ba Đình": (21.034, 105.814, 6.0, 1500), "Hoàn Kiếm": (21.029, 105.852, 6.0, 1000),
+    "Hai Bà Trưng": (21.006, 105.857, 6.0, 1500), "Đống Đa": (21.018, 105.829, 7.0, 1500),
+    "Tây Hồ": (21.070, 105.818, 3.0, 2000), "Cầu Giấy": (21.032, 105.790, 6.0, 1500),
+    "Thanh Xuân": (20.994, 105.817, 6.0, 1500), "Hoàng Mai": (20.974, 105.863, 5.0, 2000),
+    "Long Biên": (21.047, 105.886, 4.0, 2500), "Bắc Từ Liêm": (21.071, 105.759, 4.0, 2500),
+    "Nam Từ Liêm": (21.012, 105.765, 4.0, 2500), "Hà Đông": (20.960, 105.765, 5.0, 2500),
+    "Sóc Sơn": (21.257, 105.849, 1.0, 6000), "Đông Anh": (21.137, 105.848, 1.5, 5000),
+    "Gia Lâm": (21.022, 105.944, 1.5, 4000), "Thanh Trì": (20.946, 105.845, 1.5, 3000),
+    "Thường Tín": (20.871, 105.862, 1.0, 4000), "Hoài Đức": (21.025, 105.700, 1.0, 4000),
+    "Đan Phượng": (21.087, 105.670, 0.7, 3000), "Mê Linh": (21.185, 105.718, 0.7, 4000),
+    "Phúc Thọ": (21.109, 105.582, 0.5, 4000), "Thạch Thất": (21.025, 105.565, 0.7, 5000),
+    "Quốc Oai": (20.990, 105.640, 0.7, 5000), "Chương Mỹ": (20.885, 105.665, 1.0, 6000),
+    "Thanh Oai": (20.860, 105.767, 0.7, 4000), "Mỹ Đức": (20.683, 105.740, 0.5, 6000),
+    "Ứng Hòa": (20.720, 105.775, 0.5, 5000), "Phú Xuyên": (20.739, 105.910, 0.5, 5000),
+    "Sơn Tây": (21.138, 105.505, 0.8, 3000),
+}
+# Khung bao Hà Nội cho phần điểm rải đều
+HANOI_BBOX = (105.28, 20.56, 106.02, 21.39)
+
+STREETS_PER_DISTRICT = 25
+STREET_SPREAD_M = 300
+BACKGROUND_SHARE = 0.05
+CHEMIST_SHARE = 0.10
+NON_PHARMACY_SHARE = 0.08
+MISSING_DISTRICT_SHARE = 0.30
+POLYGON_SHARE = 0.05
+DUPLICATE_SHARE = 0.01
+
+BRANDS = ["Long Châu", "Pharmacity", "An Khang", "Trung Sơn", "Minh Châu"]
+NAME_WORDS = ["Minh", "An", "Phúc", "Hưng", "Thịnh", "Tâm", "Đức", "Bình", "Hòa", "Khang",
+              "Việt", "Hà", "Thành", "Long", "Ngọc", "Mai", "Lan", "Hương", "Phương", "Sơn"]
+NAME_PREFIXES = ["Nhà thuốc", "Nhà Thuốc", "Hiệu thuốc", "Quầy thuốc", "Pharmacy", ""]
+STREET_NAMES = ["Phố Huế", "Kim Mã", "Láng Hạ", "Cầu Giấy", "Nguyễn Trãi", "Giải Phóng",
+                "Tây Sơn", "Xã Đàn", "Lê Duẩn", "Bạch Mai", "Hoàng Quốc Việt", "Trần Duy Hưng"]
+OPENING_HOURS = ["", "", "", "24/7", "Mo-Su 07:00-22:00", "Mo-Sa 07:30-21:30; Su 08:00-12:00",
+                 "07:00-23:00", "Mo-Fr 08:00-12:00,13:30-20:00", "Mo-Su 06:30-22:30",
+                 "sáng 7h - tối 10h", "Mo-Su 08:00-21:00; PH off"]
+NON_PHARMACY_TAGS = [{"amenity": "clinic"}, {"amenity": "hospital"}, {"healthcare": "dentist"}]
+
+
+def _district_variant(rng, name):
+    """Một cách viết lộn xộn của tên quận, như trong thẻ addr:district thật"""
+    style = rng.integers(8)
+    if style == 0:
+        return f"Quận {name}"
+    if style == 1:
+        return f"Q. {name}"
+    if style == 2:
+        return fold_accents(name).title()
+    if style == 3:
+        return f"{fold_accents(name).title()} District"
+    if style == 4:
+        return name.upper()
+    if style == 5:
+        return unicodedata.normalize("NFD", name)
+    if style == 6 and len(name) > 4:
+        # Sai chính tả một ký tự
+        k = int(rng.integers(1, len(name) - 1))
+        return name[:k] + name[k + 1:]
+    return name
+
+
+def _sample_points(rng, n, streets, weights):
+    """Tọa độ theo cụm: chọn quận -> trục phố -> nhiễu Gaussian quanh trục phố"""
+    lons = np.empty(n)
+    lats = np.empty(n)
+    district_idx = np.full(n, -1)
+    background = rng.random(n) < BACKGROUND_SHARE
+    nb = int(background.sum())
+    lons[background] = rng.uniform(HANOI_BBOX[0], HANOI_BBOX[2], nb)
+    lats[background] = rng.uniform(HANOI_BBOX[1], HANOI_BBOX[3], nb)
+
+    clustered = np.flatnonzero(~background)
+    district_idx[clustered] = rng.choice(len(weights), size=len(clustered), p=weights)
+    street = rng.integers(STREETS_PER_DISTRICT, size=len(clustered))
+    centres = streets[district_idx[clustered], street]
+    spread = STREET_SPREAD_M / 111_320.0
+    lats[clustered] = centres[:, 0] + rng.normal(0, spread, len(clustered))
+    lons[clustered] = centres[:, 1] + rng.normal(0, spread, len(clustered)) / np.cos(np.radians(centres[:, 0]))
+    return lons, lats, district_idx
+
+
+def _square(lon, lat, half_m):
+    d_lat = half_m / 111_320.0
+    d_lon = d_lat / np.cos(np.radians(lat))
+    ring = [[lon - d_lon, lat - d_lat], [lon + d_lon, lat - d_lat], [lon + d_lon, lat + d_lat],
+            [lon - d_lon, lat + d_lat], [lon - d_lon, lat - d_lat]]
+    return {"type": "Polygon", "coordinates": [[[round(x, 7), round(y, 7)] for x, y in ring]]}
+
+
+def iter_synthetic_features(n, seed=0):
+    """Sinh lần lượt n feature giả lập (hiệu thuốc và một phần không phải hiệu thuốc)"""
+    rng = np.random.default_rng(seed)
+    names = list(DISTRICT_CENTRES)
+    centres = np.array([DISTRICT_CENTRES[name][:2] for name in names])
+    weights = np.array([DISTRICT_CENTRES[name][2] for name in names])
+    weights = weights / weights.sum()
+    spreads = np.array([DISTRICT_CENTRES[name][3] for name in names]) / 111_320.0
+    # Trục phố cố định cho mỗi quận, để dữ liệu có cụm ở nhiều cấp
+    streets = centres[:, None, :] + rng.normal(0, 1, (len(names), STREETS_PER_DISTRICT, 2)) * spreads[:, None, None]
+
+    produced = 0
+    while produced < n:
+        size = min(GENERATE_CHUNK_SIZE, n - produced)
+        lons, lats, district_idx = _sample_points(rng, size, streets, weights)
+        kind = rng.random(size)
+        missing_district = rng.random(size) < MISSING_DISTRICT_SHARE
+        polygon = rng.random(size) < POLYGON_SHARE
+        duplicate = rng.random(size) < DUPLICATE_SHARE
+        brand = rng.integers(-4 * len(BRANDS), len(BRANDS), size)
+        words = rng.integers(len(NAME_WORDS), size=(size, 2))
+        prefix = rng.integers(len(NAME_PREFIXES), size=size)
+        hours = rng.integers(len(OPENING_HOURS), size=size)
+        street = rng.integers(len(STREET_NAMES), size=size)
+        housenumber = rng.integers(1, 400, size=size)
+        phone = rng.integers(10**8, 10**9, size=size)
+        for k in range(size):
+            osm_number = produced + k + 1
+            props = {}
+            if kind[k] < NON_PHARMACY_SHARE:
+                props.update(NON_PHARMACY_TAGS[osm_number % len(NON_PHARMACY_TAGS)])
+            elif kind[k] < NON_PHARMACY_SHARE + CHEMIST_SHARE:
+                props["shop"] = "chemist"
+            else:
+                props["amenity"] = "pharmacy"
+            if brand[k] >= 0:
+                props["brand"] = BRANDS[brand[k]]
+                props["name"] = f"Nhà thuốc {BRANDS[brand[k]]}"
+            else:
+                props["name"] = " ".join(filter(None, (NAME_PREFIXES[prefix[k]], NAME_WORDS[words[k, 0]],
+                                                       NAME_WORDS[words[k, 1]])))
+            if district_idx[k] >= 0 and not missing_district[k]:
+                props["addr:district"] = _district_variant(rng, names[district_idx[k]])
+            props["addr:street"] = STREET_NAMES[street[k]]
+            props["addr:housenumber"] = str(housenumber[k])
+            if OPENING_HOURS[hours[k]]:
+                props["opening_hours"] = OPENING_HOURS[hours[k]]
+            if k % 3 == 0:
+                props["phone"] = f"+84 {phone[k]}"
+            lon, lat = float(lons[k]), float(lats[k])
+            if polygon[k]:
+                osm_id = f"way/{osm_number}"
+                geometry = _square(lon, lat, 10)
+            else:
+                osm_id = f"node/{osm_number}"
+                geometry = {"type": "Point", "coordinates": [round(lon, 7), round(lat, 7)]}
+            props["@id"] = osm_id
+            yield {"type": "Feature", "properties": props, "geometry": geometry, "id": osm_id}
+            if duplicate[k] and produced + k + 1 < n:
+                # Bản ghi trùng: cùng hiệu thuốc được vẽ lại cách vài mét, tên viết khác
+                dup = dict(props, name=props["name"].upper())
+                dup["@id"] = f"node/{10**9 + osm_number}"
+                dup_geometry = {"type": "Point", "coordinates": [round(lon + 3e-5, 7), round(lat, 7)]}
+                yield {"type": "Feature", "properties": dup, "geometry": dup_geometry, "id": dup["@id"]}
+        produced += size
+
+
+def synthetic_path(n, seed=0, output_dir=OUTPUT_DIR):
+    return Path(output_dir) / f"export_{n}_s{seed}.geojson"
+
+
+def generate(n, seed=0, output=None, force=False):
+    """Ghi file xuất giả lập n feature (khoảng n + 1% bản ghi trùng); dùng lại nếu đã có"""
+    output = Path(output) if output else synthetic_path(n, seed)
+    if output.exists() and not force:
+        return output
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with FeatureCollectionWriter(output) as writer:
+        for feature in iter_synthetic_features(n, seed):
+            writer.write(feature)
+    print(f" Đã sinh {writer.count} feature: {output}")
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sinh file xuất Overpass giả lập cho benchmark")
+    parser.add_argument("n", type=int, help="Số feature cần sinh")
+    parser.add_argument("--seed", type=int, default=0, help="Seed ngẫu nhiên (cùng seed, cùng dữ liệu)")
+    parser.add_argument("--output", type=Path, default=None, help="File kết quả (mặc định: data/synthetic/)")
+    parser.add_argument("--force", action="store_true", help="Sinh lại kể cả khi file đã tồn tại")
+    args = parser.parse_args(argv)
+    return generate(args.n, args.seed, args.output, args.force)
+
+
+if __name__ == "__main__":
+    main()